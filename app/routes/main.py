@@ -1,20 +1,27 @@
 import logging
 import base64
 import os
-import json
-import re
-import asyncio
+import time
+from datetime import datetime, timezone
 from quart import Blueprint, request, render_template, Response, make_response, send_file, current_app
-from app.services.telegram import telegram_service
+from app.services.telegram import telegram_service, NotFoundError
 from app.services.post import PostService
 from app.services.archive import ArchiveService
+from app.services.media_cache import media_cache, clean_filename, data_checksum, MEDIA_CACHE_DIR
+from app.services.cache_janitor import cache_janitor
+from app.services.media_prefetch import media_prefetcher
+from app.services.image_variants import image_variants
+from app.services.image_worker import image_worker
+from config.settings import MEDIA_HTTP_MAX_AGE, CHANNEL_PHOTO_HTTP_MAX_AGE
 from functools import wraps
 
 logger = logging.getLogger(__name__)
 bp = Blueprint('main', __name__)
 
-# Определяем путь к директории кэша
-MEDIA_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'media_cache')
+# Медиа поста по ключу файла Telegram никогда не меняется
+MEDIA_CACHE_CONTROL = f"public, max-age={MEDIA_HTTP_MAX_AGE}, immutable"
+# Фото канала может смениться, поэтому после max-age браузер переспрашивает его по ETag
+CHANNEL_PHOTO_CACHE_CONTROL = f"public, max-age={CHANNEL_PHOTO_HTTP_MAX_AGE}"
 
 
 @bp.before_app_serving
@@ -30,6 +37,15 @@ async def startup():
             # Если не удалось создать папку, приложение не сможет кэшировать,
             # но может продолжить работу без кэширования (хотя это не идеально)
             pass # или raise e, если кэширование критично
+
+    # Загружаем индекс кэша и сверяем его с файлами на диске
+    await media_cache.init()
+
+    # Фоновая очистка кэша по объему и времени жизни
+    cache_janitor.start()
+
+    # Процессы для работы с изображениями запускаются до первого запроса
+    await image_worker.start()
     
     # Инициализация Telegram клиента
     try:
@@ -40,6 +56,17 @@ async def startup():
         raise
 
 
+@bp.after_app_serving
+async def shutdown():
+    """Остановка фоновых задач и дозапись очереди кэша"""
+    await media_prefetcher.stop()
+    await cache_janitor.stop()
+    await image_worker.stop()
+    await media_cache.drain()
+    # Сессии и соединения с DC закрываются явно, чтобы сохранить состояние сессий
+    await telegram_service.pool.disconnect()
+
+
 def no_cache(f):
     """Декоратор для отключения кэширования"""
     @wraps(f)
@@ -55,7 +82,12 @@ def no_cache(f):
 # Глобальное отключение кеширования для всех маршрутов
 @bp.after_request
 async def add_no_cache_headers(response):
-    """Отключаем кеширование для всех ответов"""
+    """
+    Отключаем кеширование для всех ответов, кроме тех,
+    для которых маршрут сам задал Cache-Control (медиа и фото каналов)
+    """
+    if 'Cache-Control' in response.headers:
+        return response
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
@@ -84,18 +116,22 @@ async def view_post():
             logger.warning(f"Пост получен, но не содержит текста: {url}")
             data["text"] = "<p>Сообщение не содержит текста или не может быть отображено.</p>"
 
-        # Получаем информацию о канале
-        channel_entity = await telegram_service.get_channel_entity(data.get("chat"))
-        if channel_entity:
-            data["channel_info"] = {
-                "title": getattr(channel_entity, "title", "Канал"),
-                "username": getattr(channel_entity, "username", None),
-                "photo": hasattr(channel_entity, "photo") and not isinstance(channel_entity.photo, type(None))
-            }
+        # Информация о канале приходит вместе с постом (из кэша готовых постов)
+        channel_info = data.pop("channel_info", None)
+        if channel_info:
+            data["channel_info"] = channel_info
+
+        # Медиа и фото канала начинают скачиваться в кэш до того, как их запросит браузер
+        media_prefetcher.schedule(
+            data["chat"], data["msg_id"], len(data.get("media_list") or []),
+            channel_photo=bool(channel_info and channel_info.get("photo")))
 
         logger.info(f"Пост успешно получен: {url}")
         data["current_url"] = url
         return await render_template("post.html", **data)
+    except NotFoundError as e:
+        logger.warning(f"Пост не найден: {url}: {e}")
+        return await render_template("post.html", error=f"Ошибка: {e}"), 404
     except ValueError as e:
         logger.warning(f"Ошибка значения при получении поста: {e}")
         return await render_template("post.html", error=f"Ошибка: {e}")
@@ -104,111 +140,230 @@ async def view_post():
         return await render_template("post.html", error=f"Ошибка при получении поста: {e}")
 
 
-def clean_filename(filename):
-    """Очищает строку для использования в качестве имени файла/директории."""
-    # Удаляем символы, недопустимые в большинстве ФС
-    # Заменяем пробелы и другие разделители на подчеркивание
-    cleaned = re.sub(r'[<>:"/\\|?*\s]+', '_', str(filename))
-    # Удаляем начальные/конечные подчеркивания и точки
-    cleaned = cleaned.strip('_. ')
-    # Ограничиваем длину, чтобы избежать проблем с путями
-    return cleaned[:100] if cleaned else "default"
-
-def get_cache_paths(cache_type: str, identifier: str, sub_identifier: str = None, index: str = None):
-    """Генерирует пути для кэша. cache_type: 'media' или 'channel_photo'. index используется только для media."""
-    safe_identifier = clean_filename(identifier)
-    
-    if cache_type == 'media':
-        if sub_identifier is None or index is None:
-            logger.error("Для кэша 'media' требуются sub_identifier (msg_id) и index")
-            return None, None
-        cache_dir = os.path.join(MEDIA_CACHE_DIR, 'media', safe_identifier, str(sub_identifier))
-        base_filename = str(index) # Имя файла - это index
-    elif cache_type == 'channel_photo':
-        cache_dir = os.path.join(MEDIA_CACHE_DIR, 'channel_photos')
-        base_filename = safe_identifier # Имя файла - очищенный chat_id
-    else:
-        logger.error(f"Неизвестный тип кэша: {cache_type}")
-        return None, None
-        
+def cache_headers(resp, etag, cache_control, last_modified=None):
+    """Проставляет заголовки HTTP-кэширования ответа"""
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+    resp.headers['Cache-Control'] = cache_control
+    # send_file добавляет Expires по своему cache_timeout; срок задает только Cache-Control
+    resp.headers.pop('Expires', None)
+    return resp
+
+
+def not_modified(etag, cache_control):
+    """
+    Ответ 304, если у браузера уже есть эта версия файла (If-None-Match).
+    Возвращает None, если файл нужно отдать.
+    """
+    if not etag or not request.if_none_match.contains_weak(etag):
+        return None
+    return cache_headers(Response('', status=304), etag, cache_control)
+
+
+def entry_etag(entry):
+    """
+    ETag записи кэша: для медиа и его вариантов - ключ файла Telegram (один
+    и тот же файл в любом посте), для фото канала - контрольная сумма содержимого.
+    """
+    if entry['kind'] in ('media', 'variant'):
+        return entry['key']
+    return entry.get('checksum') or f"{entry['key']}-{int(entry['created_at'])}"
+
+
+async def send_cached_media(entry, default_mime_type='application/octet-stream', cache_control=MEDIA_CACHE_CONTROL):
+    """Отдает файл из кэша по записи индекса (с поддержкой Range) или None, если это не удалось"""
+    data_path = media_cache.entry_path(entry)
+    mime_type = entry.get('mime_type') or default_mime_type
+    etag = entry_etag(entry)
+    resp = not_modified(etag, cache_control)
+    if resp is not None:
+        media_cache.touch(entry)
+        return resp
+    if request.range and request.range.range_for_length(entry['size']) is None:
+        # Недопустимый диапазон - ответ по индексу кэша, без обращения к Telegram
+        media_cache.touch(entry)
+        resp = await make_response("Запрошенный диапазон недоступен", 416)
+        resp.headers['Content-Range'] = f"bytes */{entry['size']}"
+        return resp
     try:
-        os.makedirs(cache_dir, exist_ok=True)
+        data = await media_cache.read_small(entry)
+        if data is not None:
+            # Небольшой файл - из памяти
+            logger.debug(f"Отдаем файл из памяти: {data_path}")
+            resp = Response(data, mimetype=mime_type)
+        else:
+            logger.info(f"Отдаем файл из кэша: {data_path}")
+            resp = await send_file(data_path, mimetype=mime_type, add_etags=False)
+        # ETag и Last-Modified ставятся до make_conditional: Quart сам обработает
+        # If-None-Match/If-Modified-Since (304) и Range (206) для памяти и файла одинаково
+        cache_headers(resp, etag, cache_control, entry.get('created_at'))
+        resp = await resp.make_conditional(request, accept_ranges=True, complete_length=entry['size'])
+        resp.headers['Accept-Ranges'] = 'bytes'
+    except FileNotFoundError:
+        media_cache.invalidate(entry)
+        return None
     except OSError as e:
-        logger.error(f"Не удалось создать директорию кэша {cache_dir}: {e}")
-        return None, None
-        
-    base_path = os.path.join(cache_dir, clean_filename(base_filename))
-    data_path = f"{base_path}.cache"
-    meta_path = f"{base_path}.meta"
-    return data_path, meta_path
-
-async def _write_to_cache(data_path: str, meta_path: str, file_bytes: bytes, metadata_dict: dict):
-    """Асинхронно записывает данные и метаданные в файлы кэша."""
-    if not (data_path and meta_path and file_bytes and metadata_dict):
-        logger.error("Недостаточно данных для записи в кэш.")
-        return
-    try:
-        # Запись файла данных
-        with open(data_path, 'wb') as f:
-            f.write(file_bytes)
-        # Запись файла метаданных
-        with open(meta_path, 'w') as f:
-            json.dump(metadata_dict, f)
-        logger.info(f"Данные успешно записаны в кэш: {data_path}")
-    except Exception as e:
-        logger.error(f"Ошибка асинхронной записи в кэш ({data_path}): {e}")
-        # Попытка удалить частично созданные файлы кэша
-        try:
-            if os.path.exists(data_path):
-                os.remove(data_path)
-            if os.path.exists(meta_path):
-                os.remove(meta_path)
-        except Exception as remove_e:
-            logger.error(f"Ошибка при удалении неполных файлов кэша: {remove_e}")
+        # Только недоступный файл отдается заново из Telegram; HTTP-ошибки проходят дальше
+        logger.error(f"Ошибка при чтении кэша ({data_path}): {e}")
+        return None
+    media_cache.touch(entry)
+    return resp
+
+
+def preferred_image_format():
+    """WebP, если браузер явно его принимает, иначе JPEG"""
+    return 'webp' if any(value == 'image/webp' and quality > 0
+                         for value, quality in request.accept_mimetypes) else 'jpeg'
+
+
+async def get_variant_response(chat, msg_id, index, width):
+    """
+    Уменьшенный вариант изображения (?w=ширина&q=качество) в формате,
+    выбранном по заголовку Accept. None - вариант невозможен, отдается оригинал.
+    """
+    width = image_variants.snap_width(width)
+    quality = image_variants.snap_quality(request.args.get('q', type=int))
+    fmt = preferred_image_format()
+
+    entry = image_variants.cached_entry(chat, msg_id, index, width, quality, fmt)
+    if entry:
+        resp = await send_cached_media(entry)
+        if resp is not None:
+            resp.headers['Vary'] = 'Accept'
+            return resp
+
+    variant = await image_variants.get(chat, msg_id, index, width, quality, fmt)
+    resp = await send_image_result(variant)
+    if resp is not None:
+        resp.headers['Vary'] = 'Accept'
+    return resp
+
+
+async def send_image_result(result):
+    """
+    Ответ с изображением из image_variants ({'key', 'mime_type', 'entry' или 'data'}).
+    None - изображения нет (или запись кэша пропала).
+    """
+    if result is None:
+        return None
+    resp = None
+    if result.get('entry'):
+        resp = await send_cached_media(result['entry'], result['mime_type'])
+    if resp is None and result.get('data'):
+        resp = not_modified(result['key'], MEDIA_CACHE_CONTROL)
+        if resp is None:
+            resp = Response(result['data'], mimetype=result['mime_type'])
+            cache_headers(resp, result['key'], MEDIA_CACHE_CONTROL, time.time())
+            resp = await resp.make_conditional(request, accept_ranges=True, complete_length=len(result['data']))
+    return resp
+
 
 async def get_media_response(chat, msg_id, index):
-    """Общая логика получения медиа с асинхронным кэшированием."""
-    data_path, meta_path = get_cache_paths('media', chat, str(msg_id), str(index))
-    
-    if data_path and meta_path and os.path.exists(data_path) and os.path.exists(meta_path):
-        # --- Обслуживание из кэша ---
+    """
+    Общая логика получения медиа: отдача из кэша или потоковая отдача с заполнением кэша.
+    Поддерживает заголовок Range (206 Partial Content) в обоих случаях.
+    ETag медиа - ключ файла Telegram, поэтому на If-None-Match отвечаем 304
+    по связи поста с файлом, не обращаясь к Telegram. Связи хранятся отдельно
+    от файлов (CACHE_REF_TTL), так что 304 работает и после вытеснения файла.
+    С параметром w отдается уменьшенный вариант изображения.
+    """
+    width = request.args.get('w', type=int)
+    if width and width > 0:
         try:
-            with open(meta_path, 'r') as f:
-                meta_data = json.load(f)
-            mime_type = meta_data.get('mime_type', 'application/octet-stream')
-            logger.info(f"Отдаем медиа из кэша: {data_path}")
-            return await send_file(data_path, mimetype=mime_type)
+            resp = await get_variant_response(chat, msg_id, index, width)
+            if resp is not None:
+                return resp
         except Exception as e:
-            logger.error(f"Ошибка при чтении кэша медиа ({data_path}): {e}")
+            logger.error(f"Ошибка при получении варианта изображения chat={chat}, msg_id={msg_id}, "
+                         f"index={index}: {e}", exc_info=True)
+
+    resp = not_modified(media_cache.get_ref(chat, msg_id, index), MEDIA_CACHE_CONTROL)
+    if resp is not None:
+        return resp
+
+    entry = media_cache.lookup_media(chat, msg_id, index)
+    if not entry:
+        # Небольшой файл может как раз скачиваться фоновой предзагрузкой страницы поста
+        entry = await media_prefetcher.join_media(media_cache.get_ref(chat, msg_id, index))
+    if entry:
+        # --- Обслуживание из кэша ---
+        resp = await send_cached_media(entry)
+        if resp is not None:
+            return resp
     
     logger.info(f"Кэш медиа не найден. Запрашиваем у Telegram: chat={chat}, msg_id={msg_id}, index={index}")
     try:
-        media = await telegram_service.get_media(chat, msg_id, index)
-        if not media or not media.get('file_bytes'):
+        source = await telegram_service.resolve_media(chat, msg_id, index)
+        if not source:
             logger.warning(f"Медиа не найдено в Telegram: chat={chat}, msg_id={msg_id}, index={index}")
             return "Медиа не найдено", 404
 
-        file_bytes = media['file_bytes']
-        mime_type = media.get('mime_type', 'application/octet-stream')
-        original_filename = media.get('filename', f'media_{index}')
-        
-        # --- Готовим ответ клиенту --- 
-        resp = await make_response(file_bytes)
-        resp.headers['Content-Type'] = mime_type
-        
-        # --- Запускаем запись в кэш в фоне --- 
-        if data_path and meta_path:
-            meta_to_save = { 'mime_type': mime_type, 'original_filename': original_filename }
+        # Файл хранится по ключу Telegram: тот же файл из другого поста уже может быть в кэше
+        file_key = source['descriptor'].get('file_key')
+        if file_key:
+            media_cache.set_ref(chat, msg_id, index, file_key)
+            resp = not_modified(file_key, MEDIA_CACHE_CONTROL)
+            if resp is not None:
+                return resp
+            entry = media_cache.get_entry('media', file_key) or await media_prefetcher.join_media(file_key)
+            if entry:
+                resp = await send_cached_media(entry)
+                if resp is not None:
+                    return resp
+
+        descriptor = source['descriptor']
+        mime_type = descriptor.get('mime_type') or 'application/octet-stream'
+        original_filename = descriptor.get('filename') or f'media_{index}'
+        file_size = source['size']
+
+        # --- Определяем запрошенный диапазон байтов ---
+        start, stop, status = 0, file_size, 200
+        if request.range and file_size:
+            byte_range = request.range.range_for_length(file_size)
+            if byte_range is None:
+                logger.warning(f"Недопустимый диапазон {request.headers.get('Range')} для файла размером {file_size}")
+                resp = await make_response("Запрошенный диапазон недоступен", 416)
+                resp.headers['Content-Range'] = f"bytes */{file_size}"
+                return resp
+            start, stop = byte_range
+            status = 206
+            logger.debug(f"Запрошен диапазон {start}-{stop - 1} из {file_size} байт")
+
+        # --- Части файла пишутся в кэш по мере отдачи клиенту ---
+        # Кэш заполняется только если клиент запросил файл целиком (в т.ч. "bytes=0-")
+        full_file = start == 0 and stop == file_size
+        writer = media_cache.open_writer('media', file_key) if full_file and file_key else None
+        chunks = telegram_service.iter_file(source, offset=start, length=stop - start)
+
+        async def stream_body():
             try:
-                 # Используем run_in_executor для синхронных операций ввода-вывода в фоне
-                 # current_app.add_background_task(_write_to_cache, data_path, meta_path, file_bytes, meta_to_save)
-                 # Используем asyncio.create_task для прямого запуска асинхронной функции
-                 asyncio.create_task(_write_to_cache(data_path, meta_path, file_bytes, meta_to_save))
-                 logger.info(f"Запланирована запись в кэш для: {data_path}")
-            except Exception as task_e:
-                 logger.error(f"Ошибка при планировании фоновой задачи записи в кэш: {task_e}")
-
-        return resp # Отдаем ответ, не дожидаясь записи
+                async for chunk in chunks:
+                    if writer:
+                        await writer.write(chunk)
+                    yield chunk
+                if writer:
+                    meta_to_save = {'mime_type': mime_type, 'original_filename': original_filename}
+                    await writer.commit(meta_to_save, expected_size=file_size)
+            except Exception as e:
+                logger.error(f"Ошибка при потоковой отдаче медиа chat={chat}, msg_id={msg_id}, index={index}: {e}")
+                raise
+            finally:
+                # Клиент отключился или скачивание прервалось - неполный файл в кэш не попадает
+                if writer and not writer.committed:
+                    writer.abort()
+
+        resp = Response(stream_body(), status=status, mimetype=mime_type)
+        resp.headers['Accept-Ranges'] = 'bytes'
+        if file_size:
+            resp.headers['Content-Length'] = str(stop - start)
+        if status == 206:
+            resp.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{file_size}"
+        if file_key:
+            cache_headers(resp, file_key, MEDIA_CACHE_CONTROL, time.time())
+        # Время отдачи больших файлов не должно ограничиваться таймаутом ответа
+        resp.timeout = None
+        return resp
 
     except Exception as e:
         logger.error(f"Критическая ошибка при получении медиа: {e}", exc_info=True)
@@ -216,7 +371,6 @@ async def get_media_response(chat, msg_id, index):
 
 
 @bp.route('/media/<chat>/<int:msg_id>')
-@no_cache
 async def get_media(chat, msg_id):
     """Получение медиафайла (с кэшированием)"""
     try:
@@ -230,7 +384,6 @@ async def get_media(chat, msg_id):
 
 
 @bp.route('/media/<chat>/<int:msg_id>/<int:index>')
-@no_cache
 async def get_media_by_index(chat, msg_id, index):
     """Получение медиафайла по индексу в URL (с кэшированием)"""
     try:
@@ -241,6 +394,22 @@ async def get_media_by_index(chat, msg_id, index):
         return "Внутренняя ошибка сервера", 500
 
 
+@bp.route('/media/<chat>/<int:msg_id>/<int:index>/poster')
+async def get_media_poster(chat, msg_id, index):
+    """Обложка видео: миниатюра документа из Telegram, без скачивания видео"""
+    try:
+        logger.debug(f"Запрос обложки видео: chat={chat}, msg_id={msg_id}, index={index}")
+        resp = await send_image_result(await image_variants.poster(chat, msg_id, index))
+        if resp is None:
+            return "Обложка не найдена", 404
+        return resp
+    except NotFoundError:
+        return "Обложка не найдена", 404
+    except Exception as e:
+        logger.error(f"Ошибка в роуте /media/.../poster: {e}", exc_info=True)
+        return "Внутренняя ошибка сервера", 500
+
+
 @bp.route('/media/<chat>/<int:msg_id>/check')
 @no_cache
 async def check_media_availability(chat, msg_id):
@@ -293,26 +462,21 @@ async def get_direct_media_url(chat, msg_id, index):
 
 
 @bp.route('/channel_photo/<chat>')
-@no_cache
 async def get_channel_photo(chat):
     """Получение фотографии канала (с асинхронным кэшированием)"""
-    data_path, meta_path = get_cache_paths('channel_photo', chat)
-    
-    if data_path and meta_path and os.path.exists(data_path) and os.path.exists(meta_path):
+    entry = media_cache.get_entry('channel_photo', chat)
+    if entry:
         # --- Обслуживание из кэша ---
-        try:
-            with open(meta_path, 'r') as f:
-                meta_data = json.load(f)
-            mime_type = meta_data.get('mime_type', 'image/jpeg')
-            logger.info(f"Отдаем фото канала из кэша: {data_path}")
-            return await send_file(data_path, mimetype=mime_type)
-        except Exception as e:
-            logger.error(f"Ошибка при чтении кэша фото канала ({data_path}): {e}")
+        resp = await send_cached_media(entry, 'image/jpeg', CHANNEL_PHOTO_CACHE_CONTROL)
+        if resp is not None:
+            return resp
             
     # --- Если кэша нет или ошибка чтения ---
     logger.info(f"Кэш фото канала не найден. Запрашиваем у Telegram: chat={chat}")
     try:
-        photo_data = await telegram_service.get_channel_photo(chat)
+        # Фото скачивается и ставится в очередь записи в кэш один раз,
+        # даже если его уже запрашивает фоновая предзагрузка
+        photo_data = await media_prefetcher.channel_photo(chat)
         if not photo_data or not photo_data.get('file_bytes'):
             logger.warning(f"Фото канала не найдено в Telegram: chat={chat}")
             return "Фото канала не найдено", 404
@@ -321,26 +485,55 @@ async def get_channel_photo(chat):
         mime_type = photo_data.get('mime_type', 'image/jpeg')
         
         # --- Готовим ответ клиенту --- 
-        resp = await make_response(file_bytes)
-        resp.headers['Content-Type'] = mime_type
-        
-        # --- Запускаем запись в кэш в фоне --- 
-        if data_path and meta_path:
-            meta_to_save = { 'mime_type': mime_type }
-            try:
-                # Используем asyncio.create_task для прямого запуска асинхронной функции
-                asyncio.create_task(_write_to_cache(data_path, meta_path, file_bytes, meta_to_save))
-                logger.info(f"Запланирована запись в кэш для фото канала: {data_path}")
-            except Exception as task_e:
-                 logger.error(f"Ошибка при планировании фоновой задачи записи фото канала в кэш: {task_e}")
-
-        return resp # Отдаем ответ, не дожидаясь записи
+        etag = data_checksum(file_bytes)
+        resp = not_modified(etag, CHANNEL_PHOTO_CACHE_CONTROL)
+        if resp is None:
+            resp = await make_response(file_bytes)
+            resp.headers['Content-Type'] = mime_type
+            cache_headers(resp, etag, CHANNEL_PHOTO_CACHE_CONTROL, time.time())
+        return resp # Отдаем ответ, не дожидаясь записи в кэш
 
     except Exception as e:
         logger.error(f"Критическая ошибка при получении фото канала: {e}", exc_info=True)
         return "Ошибка при получении фото канала", 500
 
 
+@bp.route("/api/posts", methods=["POST"])
+async def get_posts():
+    """
+    Пакетное получение постов: {"urls": ["https://t.me/chat/1", ...]}.
+    Возвращает HTML текста и метаданные медиа для каждого поста в порядке ссылок.
+    """
+    data = await request.get_json(silent=True) or {}
+    urls = data.get("urls")
+    if not isinstance(urls, list) or not urls:
+        return await make_response({"error": "Ожидается непустой список urls"}, 400)
+
+    logger.info(f"Пакетный запрос {len(urls)} постов")
+    try:
+        posts = await PostService.get_posts(urls)
+    except ValueError as e:
+        logger.warning(f"Ошибка пакетного запроса постов: {e}")
+        return await make_response({"error": str(e)}, 400)
+    except Exception as e:
+        logger.exception(f"Ошибка пакетного получения постов: {e}")
+        return await make_response({"error": f"Ошибка при получении постов: {e}"}, 500)
+    return await make_response({"posts": posts}, 200)
+
+
+@bp.route('/cache_stats')
+async def get_cache_stats():
+    """Статистика кэшей (попадания/промахи, очистка кэша на диске)"""
+    stats = telegram_service.get_cache_stats()
+    stats['disk'] = {**media_cache.stats(), 'janitor': cache_janitor.stats()}
+    stats['disk_writes'] = media_cache.write_queue.stats()
+    stats['prefetch'] = media_prefetcher.stats()
+    stats['variants'] = image_variants.stats()
+    stats['image_worker'] = image_worker.stats()
+    stats['posts'] = PostService.post_cache.stats()
+    return await make_response(stats, 200)
+
+
 @bp.route("/save_archive", methods=["POST"])
 async def save_archive():
     """Сохранение архива с постом"""
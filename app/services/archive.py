@@ -6,7 +6,8 @@ import io
 import json
 from typing import Optional, Dict, Any, List
 from app.services.telegram import telegram_service
-from PIL import Image, UnidentifiedImageError
+from app.services.rpc_scheduler import rpc_priority, PRIORITY_BACKGROUND
+from app.services.image_worker import image_worker
 
 logger = logging.getLogger(__name__)
 
@@ -59,10 +60,10 @@ class ArchiveService:
                     with open(text_image_path, "wb") as f:
                         f.write(text_screenshot_bytes)
                     logger.debug("Скриншот текстового блока сохранен: %s", text_image_path)
-                    # Получаем размеры text.png
-                    with Image.open(text_image_path) as img:
-                        text_screenshot_dims = { "width": img.width, "height": img.height }
-                        logger.debug(f"Размеры скриншота текста: {text_screenshot_dims}")
+                    # Получаем размеры text.png (Pillow работает в пуле процессов, не в цикле событий)
+                    width, height = await image_worker.probe_size(text_screenshot_bytes)
+                    text_screenshot_dims = { "width": width, "height": height }
+                    logger.debug(f"Размеры скриншота текста: {text_screenshot_dims}")
                 except Exception as e:
                     logger.error(f"Ошибка при сохранении или получении размеров скриншота текста: {e}")
                     text_image_path = None # Не удалось сохранить или обработать
@@ -87,7 +88,9 @@ class ArchiveService:
             # Получаем и сохраняем логотип канала
             channel_logo_path = None # Инициализируем как None
             try:
-                channel_photo = await telegram_service.get_channel_photo(chat)
+                # Архив - фоновая работа: запросы к Telegram уступают просмотру постов и медиа
+                with rpc_priority(PRIORITY_BACKGROUND):
+                    channel_photo = await telegram_service.get_channel_photo(chat)
                 if channel_photo and channel_photo.get('file_bytes'):
                     channel_logo_path = os.path.join(tmpdir, "channel_logo.jpg") # Присваиваем путь только если есть данные
                     with open(channel_logo_path, "wb") as f:
@@ -108,7 +111,8 @@ class ArchiveService:
             # Скачиваем все медиа и собираем их метаданные
             media_files = []
             try:
-                media_files = await telegram_service.get_messages_with_media(chat, msg_id)
+                with rpc_priority(PRIORITY_BACKGROUND):
+                    media_files = await telegram_service.get_messages_with_media(chat, msg_id)
                 logger.debug(f"Получено {len(media_files)} медиа-файлов для архивации")
                 
                 for i, media_item in enumerate(media_files):
@@ -0,0 +1,192 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ENTRY_FIELDS = (
+    'kind', 'key', 'path', 'mime_type', 'original_filename', 'size',
+    'checksum', 'file_id', 'created_at', 'last_access', 'hits', 'segment_offset',
+)
+
+
+class CacheIndex:
+    """
+    Индекс файлового кэша в SQLite (WAL).
+    При старте все записи загружаются в память, поэтому попадание в кэш -
+    один поиск в словаре без обращений к диску. Изменения сразу пишутся
+    в SQLite (вызывающий код делает это из пула потоков записи кэша),
+    а статистика обращений - пачками в flush_access().
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.refs: Dict[Tuple[str, int, int], str] = {}
+        # Время создания ссылок: ссылки живут дольше файлов (свой срок, см. prune_refs)
+        self.ref_times: Dict[Tuple[str, int, int], float] = {}
+        self._dirty_access = set()
+        self._lock = threading.Lock()
+        self._con = None
+
+    def _connect(self):
+        if self._con is not None:
+            return self._con
+        try:
+            self._con = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode = WAL")
+            self._con.execute("PRAGMA synchronous = NORMAL")
+            self._con.execute("PRAGMA busy_timeout = 5000")
+            self._con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    mime_type TEXT,
+                    original_filename TEXT,
+                    size INTEGER NOT NULL,
+                    checksum TEXT,
+                    file_id TEXT,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    segment_offset INTEGER,
+                    PRIMARY KEY (kind, key)
+                )
+                """)
+            # Индексы, созданные до появления сегментов, дополняются столбцом смещения
+            columns = {row[1] for row in self._con.execute("PRAGMA table_info(entries)")}
+            if 'segment_offset' not in columns:
+                self._con.execute("ALTER TABLE entries ADD COLUMN segment_offset INTEGER")
+            self._con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS refs (
+                    chat TEXT NOT NULL,
+                    msg_id INTEGER NOT NULL,
+                    idx INTEGER NOT NULL,
+                    file_key TEXT NOT NULL,
+                    updated_at REAL,
+                    PRIMARY KEY (chat, msg_id, idx)
+                )
+                """)
+            columns = {row[1] for row in self._con.execute("PRAGMA table_info(refs)")}
+            if 'updated_at' not in columns:
+                self._con.execute("ALTER TABLE refs ADD COLUMN updated_at REAL")
+            self._con.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось открыть индекс кэша {self.db_path}: {e}")
+            self._con = None
+        return self._con
+
+    def _execute(self, sql: str, params=(), many: bool = False):
+        with self._lock:
+            con = self._connect()
+            if con is None:
+                return
+            try:
+                if many:
+                    con.executemany(sql, params)
+                else:
+                    con.execute(sql, params)
+                con.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи в индекс кэша: {e}")
+
+    def load(self):
+        """Загружает индекс в память (один раз при старте)"""
+        with self._lock:
+            con = self._connect()
+            if con is None:
+                return
+            try:
+                rows = con.execute(f"SELECT {', '.join(ENTRY_FIELDS)} FROM entries").fetchall()
+                ref_rows = con.execute("SELECT chat, msg_id, idx, file_key, updated_at FROM refs").fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка чтения индекса кэша: {e}")
+                return
+        self.entries = {(row[0], row[1]): dict(zip(ENTRY_FIELDS, row)) for row in rows}
+        now = time.time()
+        self.refs = {(chat, msg_id, idx): file_key for chat, msg_id, idx, file_key, _ in ref_rows}
+        # У ссылок из старых индексов времени нет: срок отсчитывается от загрузки
+        self.ref_times = {(chat, msg_id, idx): updated_at or now for chat, msg_id, idx, _, updated_at in ref_rows}
+        logger.info(f"Индекс кэша загружен: {len(self.entries)} файлов, {len(self.refs)} ссылок")
+
+    def get(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get((kind, key))
+
+    def put(self, entry: Dict[str, Any]):
+        self.entries[(entry['kind'], entry['key'])] = entry
+        self._execute(
+            f"INSERT OR REPLACE INTO entries ({', '.join(ENTRY_FIELDS)}) "
+            f"VALUES ({', '.join('?' for _ in ENTRY_FIELDS)})",
+            tuple(entry.get(field) for field in ENTRY_FIELDS))
+
+    def put_many(self, entries: List[Dict[str, Any]]):
+        """Сохраняет несколько записей одной транзакцией"""
+        for entry in entries:
+            self.entries[(entry['kind'], entry['key'])] = entry
+        self._execute(
+            f"INSERT OR REPLACE INTO entries ({', '.join(ENTRY_FIELDS)}) "
+            f"VALUES ({', '.join('?' for _ in ENTRY_FIELDS)})",
+            [tuple(entry.get(field) for field in ENTRY_FIELDS) for entry in entries], many=True)
+
+    def remove(self, kind: str, key: str):
+        self.entries.pop((kind, key), None)
+        self._dirty_access.discard((kind, key))
+        self._execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Копия записей для обработки вне цикла событий"""
+        return [dict(entry) for entry in list(self.entries.values())]
+
+    def touch(self, entry: Dict[str, Any]):
+        """Отмечает обращение к записи; на диск попадает при flush_access()"""
+        entry['last_access'] = time.time()
+        entry['hits'] = (entry.get('hits') or 0) + 1
+        self._dirty_access.add((entry['kind'], entry['key']))
+
+    def flush_access(self):
+        """Сохраняет накопленную статистику обращений"""
+        dirty, self._dirty_access = self._dirty_access, set()
+        rows = []
+        for kind, key in dirty:
+            entry = self.entries.get((kind, key))
+            if entry is not None:
+                rows.append((entry['last_access'], entry['hits'], kind, key))
+        if rows:
+            self._execute("UPDATE entries SET last_access = ?, hits = ? WHERE kind = ? AND key = ?", rows, many=True)
+
+    def get_ref(self, chat: str, msg_id: int, index: int) -> Optional[str]:
+        return self.refs.get((chat, msg_id, index))
+
+    def set_ref(self, chat: str, msg_id: int, index: int, file_key: str):
+        now = time.time()
+        self.refs[(chat, msg_id, index)] = file_key
+        self.ref_times[(chat, msg_id, index)] = now
+        self._execute(
+            "INSERT OR REPLACE INTO refs (chat, msg_id, idx, file_key, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (chat, msg_id, index, file_key, now))
+
+    def prune_refs(self, max_age: float) -> int:
+        """
+        Удаляет ссылки постов на файлы старше max_age секунд.
+        Ссылка не зависит от того, есть ли сам файл в кэше: после его вытеснения
+        она по-прежнему дает ETag (ключ файла) для ответа 304 без обращения к Telegram.
+        """
+        expired_before = time.time() - max_age
+        expired = [ref for ref, updated_at in list(self.ref_times.items()) if updated_at < expired_before]
+        for ref in expired:
+            self.refs.pop(ref, None)
+            self.ref_times.pop(ref, None)
+        if expired:
+            self._execute("DELETE FROM refs WHERE chat = ? AND msg_id = ? AND idx = ?", expired, many=True)
+        return len(expired)
+
+    def close(self):
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
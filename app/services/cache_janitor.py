@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List
+from config.settings import (
+    CACHE_EXPIRY,
+    CACHE_REF_TTL,
+    CACHE_MAX_BYTES,
+    CACHE_EVICTION_POLICY,
+    CACHE_JANITOR_INTERVAL,
+)
+from app.services.media_cache import media_cache, MediaCache, cache_io_executor
+
+logger = logging.getLogger(__name__)
+
+# После превышения лимита кэш очищается до этой доли от него,
+# чтобы не вытеснять по одному файлу при каждом запуске
+LOW_WATERMARK = 0.9
+
+
+class CacheJanitor:
+    """
+    Фоновая очистка файлового кэша медиа и фото каналов.
+    Удаляет файлы, к которым не обращались дольше ttl, а при превышении
+    max_bytes вытесняет давно (lru) или редко (lfu) используемые файлы,
+    после чего сжимает сегменты, в которых накопилось много удаленных объектов.
+    Решения принимаются по индексу кэша (размер и обращения хранятся в нем),
+    без сканирования диска; удаление файлов выполняется в потоке записи кэша.
+    """
+
+    def __init__(self, cache: MediaCache, max_bytes: int = CACHE_MAX_BYTES, ttl: int = CACHE_EXPIRY,
+                 interval: int = CACHE_JANITOR_INTERVAL, policy: str = CACHE_EVICTION_POLICY):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.interval = interval
+        if policy not in ('lru', 'lfu'):
+            logger.warning(f"Неизвестная политика вытеснения кэша '{policy}', используется lru")
+            policy = 'lru'
+        self.policy = policy
+        self._task = None
+        self._stats = {
+            'runs': 0,
+            'files': 0,
+            'bytes': 0,
+            'expired_files': 0,
+            'evicted_files': 0,
+            'evicted_bytes': 0,
+            'removed_refs': 0,
+            'compacted_segments': 0,
+            'last_run': None,
+            'last_duration': None,
+        }
+
+    def start(self):
+        """Запускает периодическую очистку в текущем цикле событий"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever())
+            logger.info(
+                f"Очистка кэша запущена: лимит {self.max_bytes} байт, TTL {self.ttl} с, политика {self.policy}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка при очистке кэша: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> Dict[str, Any]:
+        """Один проход очистки; возвращает результат прохода"""
+        started = time.monotonic()
+        # Снимок индекса берется в цикле событий, удаление файлов - в потоке записи кэша
+        entries = self.cache.index.snapshot()
+        result = await asyncio.get_running_loop().run_in_executor(cache_io_executor, self._sweep, entries)
+
+        self._stats['runs'] += 1
+        self._stats['files'] = result['files']
+        self._stats['bytes'] = result['bytes']
+        self._stats['expired_files'] += result['expired_files']
+        self._stats['evicted_files'] += result['evicted_files']
+        self._stats['evicted_bytes'] += result['evicted_bytes']
+        self._stats['removed_refs'] += result['removed_refs']
+        self._stats['compacted_segments'] += result['compacted_segments']
+        self._stats['last_run'] = time.time()
+        self._stats['last_duration'] = round(time.monotonic() - started, 3)
+
+        if result['expired_files'] or result['evicted_files']:
+            logger.info(
+                f"Очистка кэша: удалено {result['expired_files']} устаревших и {result['evicted_files']} "
+                f"вытесненных файлов ({result['evicted_bytes']} байт), в кэше {result['bytes']} байт")
+        return result
+
+    def _sweep(self, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Накопленная статистика обращений нужна и политике, и после перезапуска
+        self.cache.index.flush_access()
+        now = time.time()
+        expired_files = evicted_files = evicted_bytes = 0
+
+        alive = []
+        for entry in entries:
+            if self.ttl and now - entry['last_access'] > self.ttl:
+                self.cache.remove_entry(entry)
+                expired_files += 1
+                evicted_bytes += entry['size']
+            else:
+                alive.append(entry)
+
+        total = sum(entry['size'] for entry in alive)
+        if self.max_bytes and total > self.max_bytes:
+            target = self.max_bytes * LOW_WATERMARK
+            if self.policy == 'lfu':
+                alive.sort(key=lambda entry: (entry['hits'], entry['last_access']))
+            else:
+                alive.sort(key=lambda entry: entry['last_access'])
+            for entry in alive:
+                if total <= target:
+                    break
+                self.cache.remove_entry(entry)
+                evicted_files += 1
+                evicted_bytes += entry['size']
+                total -= entry['size']
+            alive = alive[evicted_files:]
+
+        return {
+            'files': len(alive),
+            'bytes': total,
+            'expired_files': expired_files,
+            'evicted_files': evicted_files,
+            'evicted_bytes': evicted_bytes,
+            'removed_refs': self.cache.index.prune_refs(CACHE_REF_TTL),
+            'compacted_segments': self.cache.compact_segments()['compacted_segments'],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'policy': self.policy,
+            **self._stats,
+        }
+
+
+# Создаем экземпляр очистки кэша
+cache_janitor = CacheJanitor(media_cache)
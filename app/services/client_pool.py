@@ -0,0 +1,244 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from telethon import TelegramClient
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.help import GetConfigRequest
+from config.settings import (
+    API_ID,
+    API_HASH,
+    ENTITY_CACHE_PATH,
+    ENTITY_CACHE_SIZE,
+    ENTITY_CACHE_TTL,
+)
+from app.services.entity_cache import EntityCache
+from app.services.rpc_scheduler import RpcScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class PooledClient:
+    """Один авторизованный аккаунт Telegram в пуле клиентов"""
+
+    def __init__(self, session_path: str):
+        self.session_path = session_path
+        self.client: Optional[TelegramClient] = None
+        # access_hash сущностей действителен только для своего аккаунта,
+        # поэтому у каждой сессии свой кэш сущностей
+        self.entity_cache = EntityCache(
+            ENTITY_CACHE_PATH, session_path, maxsize=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL)
+        # FloodWait и лимиты Telegram считаются на аккаунт, поэтому и планировщик свой
+        self.scheduler = RpcScheduler(session_path)
+        self.inflight = 0
+        self.requests = 0
+        self._warm_senders = {}
+        # Отдельные соединения для параллельного скачивания: DC -> список MTProtoSender
+        self._download_senders: Dict[int, List[MTProtoSender]] = {}
+        # Ключи авторизации, созданные для чужих DC (для новых соединений с тем же DC)
+        self._download_auth_keys = {}
+        self._download_senders_lock = asyncio.Lock()
+
+    async def connect(self) -> bool:
+        """Подключение и проверка авторизации сессии"""
+        logger.debug(f"Подключаюсь к Telegram с сессией {self.session_path}...")
+        # flood_sleep_threshold=0: Telethon не пережидает FloodWait сам, удерживая слот
+        # планировщика, а передает каждый FloodWait планировщику (пауза сессии, другая сессия)
+        self.client = TelegramClient(self.session_path, API_ID, API_HASH, flood_sleep_threshold=0)
+        await self.client.connect()
+
+        if not await self.client.is_user_authorized():
+            logger.error(
+                f"Сессия {self.session_path} не авторизована. Запустите скрипт auth.py {self.session_path}")
+            await self.client.disconnect()
+            return False
+
+        # Проверка соединения с чтением диалогов
+        try:
+            dialogs = await self.client.get_dialogs(limit=1)
+            logger.info(
+                f"Сессия {self.session_path}: подключение проверено успешно, доступно {len(dialogs)} диалогов")
+        except Exception as e:
+            logger.error(f"Ошибка при проверке диалогов сессии {self.session_path}: {e}")
+
+        # Освобождаем базу данных сессии, если была заблокирована
+        self.reset_session_locks(enable_wal=True)
+        return True
+
+    def reset_session_locks(self, enable_wal: bool = False):
+        """Сбрасывает блокировки SQLite-файла сессии"""
+        con = getattr(self.client.session, 'con', None) if self.client else None
+        if not con:
+            return
+        try:
+            logger.debug(f"Проверка и сброс блокировок сессии {self.session_path}...")
+            con.execute("PRAGMA busy_timeout = 5000")
+            if enable_wal:
+                con.execute("PRAGMA journal_mode = WAL")
+            con.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка при обновлении сессии {self.session_path}: {e}")
+
+    async def warm_dc(self, dc_id: int):
+        """
+        Держит экспортированный sender для DC с медиа открытым:
+        Telethon отключает неиспользуемые sender'ы, и каждое новое
+        скачивание с другого DC снова платило бы за ExportAuthorization.
+        """
+        if not self.client or not dc_id or dc_id == self.client.session.dc_id or dc_id in self._warm_senders:
+            return
+        self._warm_senders[dc_id] = None
+        try:
+            self._warm_senders[dc_id] = await self.client._borrow_exported_sender(dc_id)
+            logger.info(f"Сессия {self.session_path}: соединение с DC {dc_id} подготовлено для медиа")
+        except Exception as e:
+            logger.warning(f"Сессия {self.session_path}: не удалось подготовить соединение с DC {dc_id}: {e}")
+            del self._warm_senders[dc_id]
+
+    async def download_senders(self, dc_id: int, count: int) -> List[MTProtoSender]:
+        """
+        До count отдельных соединений с DC для параллельного скачивания частей файла.
+        Соединения открываются при первом запросе и остаются открытыми до отключения
+        сессии; если открыть их не удалось, возвращается сколько есть (возможно, пустой список).
+        """
+        async with self._download_senders_lock:
+            senders = self._download_senders.setdefault(dc_id, [])
+            senders[:] = [sender for sender in senders if sender.is_connected()]
+            while len(senders) < count:
+                try:
+                    senders.append(await self._create_download_sender(dc_id))
+                except Exception as e:
+                    logger.warning(
+                        f"Сессия {self.session_path}: не удалось открыть соединение с DC {dc_id} для скачивания: {e}")
+                    break
+            return senders[:count]
+
+    async def _create_download_sender(self, dc_id: int) -> MTProtoSender:
+        client = self.client
+        dc = await client._get_dc(dc_id)
+        if dc_id == client.session.dc_id:
+            auth_key = client.session.auth_key
+        else:
+            auth_key = self._download_auth_keys.get(dc_id)
+
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address, dc.port, dc.id, loggers=client._log, proxy=client._proxy, local_addr=client._local_addr))
+        if auth_key is None:
+            # Первое соединение с чужим DC: новый ключ и импорт авторизации аккаунта
+            auth = await self.call('export_authorization', lambda: client(ExportAuthorizationRequest(dc_id)))
+            client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+            await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+            self._download_auth_keys[dc_id] = sender.auth_key
+        else:
+            client._init_request.query = GetConfigRequest()
+            await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+        logger.debug(f"Сессия {self.session_path}: открыто соединение с DC {dc_id} для скачивания")
+        return sender
+
+    async def call(self, method: str, factory: Callable[[], Awaitable[Any]], priority: int = None) -> Any:
+        """Выполняет запрос к Telegram через планировщик сессии"""
+        return await self.scheduler.call(method, factory, priority)
+
+    async def disconnect(self):
+        for sender in self._warm_senders.values():
+            if sender is not None:
+                try:
+                    await self.client._return_exported_sender(sender)
+                except Exception as e:
+                    logger.debug(f"Ошибка при возврате sender'а: {e}")
+        self._warm_senders.clear()
+        for senders in self._download_senders.values():
+            for sender in senders:
+                try:
+                    await sender.disconnect()
+                except Exception as e:
+                    logger.debug(f"Ошибка при закрытии соединения для скачивания: {e}")
+        self._download_senders.clear()
+        if self.client:
+            await self.client.disconnect()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'inflight': self.inflight,
+            'requests': self.requests,
+            'warm_dcs': sorted(dc_id for dc_id, sender in self._warm_senders.items() if sender),
+            'download_senders': {dc_id: len(senders) for dc_id, senders in self._download_senders.items()},
+            'entities': self.entity_cache.stats(),
+            'scheduler': self.scheduler.stats(),
+        }
+
+
+class ClientPool:
+    """
+    Пул авторизованных сессий Telegram.
+    Каждая операция выполняется на наименее загруженном клиенте,
+    поэтому пропускная способность и запас по FloodWait растут с числом сессий.
+    """
+
+    def __init__(self, session_paths: List[str]):
+        self.clients: List[PooledClient] = [PooledClient(path) for path in session_paths]
+
+    async def connect(self, media_dc_ids: List[int] = None) -> int:
+        """Подключает все сессии; неавторизованные исключаются из пула"""
+        connected = []
+        for pooled in self.clients:
+            try:
+                if await pooled.connect():
+                    connected.append(pooled)
+            except Exception as e:
+                logger.error(f"Ошибка при подключении сессии {pooled.session_path}: {e}")
+        self.clients = connected
+
+        for pooled in self.clients:
+            for dc_id in media_dc_ids or []:
+                await pooled.warm_dc(dc_id)
+
+        logger.info(f"В пуле клиентов Telegram {len(self.clients)} сессий")
+        return len(self.clients)
+
+    @property
+    def primary(self) -> Optional[PooledClient]:
+        return self.clients[0] if self.clients else None
+
+    def least_loaded(self) -> PooledClient:
+        if not self.clients:
+            raise Exception("Нет подключенных сессий Telegram. Запустите скрипт auth.py")
+        # Сессии, ожидающие окончания FloodWait, выбираются в последнюю очередь
+        return min(self.clients, key=lambda pooled: (
+            pooled.scheduler.flood_remaining() > 0, pooled.inflight, pooled.requests))
+
+    def owner_of(self, message) -> PooledClient:
+        """
+        Клиент, через который было получено сообщение. Медиа скачивается
+        тем же аккаунтом, что и сообщение, чтобы file_reference был действителен.
+        """
+        client = getattr(message, '_client', None)
+        for pooled in self.clients:
+            if pooled.client is client:
+                return pooled
+        return self.least_loaded()
+
+    @asynccontextmanager
+    async def acquire(self, pooled: PooledClient = None):
+        """Занимает клиент (по умолчанию наименее загруженный) на время операции"""
+        pooled = pooled or self.least_loaded()
+        pooled.inflight += 1
+        pooled.requests += 1
+        try:
+            yield pooled
+        finally:
+            pooled.inflight -= 1
+
+    async def disconnect(self):
+        for pooled in self.clients:
+            try:
+                await pooled.disconnect()
+            except Exception as e:
+                logger.warning(f"Ошибка при отключении сессии {pooled.session_path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {pooled.session_path: pooled.stats() for pooled in self.clients}
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from telethon.tl.types import (
+    Channel,
+    User,
+    Chat,
+    ChatPhoto,
+    ChatPhotoEmpty,
+    UserProfilePhoto,
+)
+from app.utils.cache import TTLCache
+from app.services.media_cache import cache_io_executor
+
+logger = logging.getLogger(__name__)
+
+
+class EntityCache:
+    """
+    Кэш разрешенных сущностей Telegram (каналы, пользователи, чаты).
+    Первый уровень - LRU в памяти, второй - таблица SQLite, чтобы кэш
+    переживал перезапуск приложения и не требовал ResolveUsername.
+    Запросы к SQLite выполняются в потоках записи кэша, а не в цикле событий.
+    """
+
+    def __init__(self, db_path, scope: str, maxsize: int = 1024, ttl: float = 86400):
+        self.db_path = str(db_path)
+        # Scope - имя сессии: access_hash действителен только для своего аккаунта
+        self.scope = scope
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk_hits = 0
+        self.misses = 0
+        self._con = None
+        # Соединение одно на все потоки записи кэша
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._con is not None:
+            return self._con
+        try:
+            self._con = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode = WAL")
+            self._con.execute("PRAGMA busy_timeout = 5000")
+            self._con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entities (
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    peer_id INTEGER NOT NULL,
+                    access_hash INTEGER,
+                    title TEXT,
+                    username TEXT,
+                    photo_id INTEGER,
+                    photo_dc_id INTEGER,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (scope, key)
+                )
+                """)
+            self._con.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось открыть кэш сущностей {self.db_path}: {e}")
+            self._con = None
+        return self._con
+
+    @staticmethod
+    def normalize_key(chat_id) -> str:
+        """Usernames в Telegram нечувствительны к регистру"""
+        return str(chat_id).strip().lstrip('@').lower()
+
+    async def get(self, chat_id) -> Optional[Any]:
+        """Возвращает сущность из памяти или с диска, либо None"""
+        key = self.normalize_key(chat_id)
+
+        entity = self.memory.get(key)
+        if entity is not None:
+            return entity
+
+        row = await asyncio.get_running_loop().run_in_executor(cache_io_executor, self._load, key)
+        if not row or time.time() - row[7] > self.ttl:
+            self.misses += 1
+            return None
+
+        entity = self._entity_from_row(row)
+        if entity is None:
+            self.misses += 1
+            return None
+
+        self.disk_hits += 1
+        self.memory.set(key, entity, ttl=max(1, self.ttl - (time.time() - row[7])))
+        logger.debug(f"Entity для {key} восстановлен из дискового кэша")
+        return entity
+
+    def _load(self, key: str):
+        with self._lock:
+            con = self._connect()
+            if con is None:
+                return None
+            try:
+                return con.execute(
+                    "SELECT kind, peer_id, access_hash, title, username, photo_id, photo_dc_id, updated_at "
+                    "FROM entities WHERE scope = ? AND key = ?",
+                    (self.scope, key)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка чтения кэша сущностей для {key}: {e}")
+                return None
+
+    def put(self, chat_id, entity):
+        """
+        Сохраняет сущность под переданным ключом, а также под ее id и username.
+        В памяти - сразу, на диск - в фоне, в потоке записи кэша.
+        """
+        row = self._row_from_entity(entity)
+        if row is None:
+            return
+
+        keys = {self.normalize_key(chat_id), str(entity.id)}
+        username = getattr(entity, 'username', None)
+        if username:
+            keys.add(self.normalize_key(username))
+
+        for key in keys:
+            self.memory.set(key, entity)
+
+        now = time.time()
+        cache_io_executor.submit(self._store, [(self.scope, key, *row, now) for key in keys])
+
+    def _store(self, rows):
+        with self._lock:
+            con = self._connect()
+            if con is None:
+                return
+            try:
+                con.executemany(
+                    "INSERT OR REPLACE INTO entities "
+                    "(scope, key, kind, peer_id, access_hash, title, username, photo_id, photo_dc_id, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows)
+                con.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка записи в кэш сущностей: {e}")
+
+    def invalidate(self, chat_id):
+        key = self.normalize_key(chat_id)
+        self.memory.pop(key)
+        cache_io_executor.submit(self._delete, key)
+
+    def _delete(self, key: str):
+        with self._lock:
+            con = self._connect()
+            if con is None:
+                return
+            try:
+                con.execute("DELETE FROM entities WHERE scope = ? AND key = ?", (self.scope, key))
+                con.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка удаления из кэша сущностей: {e}")
+
+    @staticmethod
+    def _row_from_entity(entity):
+        if isinstance(entity, Channel):
+            kind, title = 'channel', entity.title
+        elif isinstance(entity, Chat):
+            kind, title = 'chat', entity.title
+        elif isinstance(entity, User):
+            kind = 'user'
+            title = ' '.join(filter(None, [entity.first_name, entity.last_name]))
+        else:
+            return None
+
+        photo = getattr(entity, 'photo', None)
+        photo_id = getattr(photo, 'photo_id', None)
+        photo_dc_id = getattr(photo, 'dc_id', None)
+        return (kind, entity.id, getattr(entity, 'access_hash', None), title,
+                getattr(entity, 'username', None), photo_id, photo_dc_id)
+
+    @staticmethod
+    def _entity_from_row(row):
+        """Восстанавливает объект Telethon, достаточный для запросов и скачивания аватарки"""
+        kind, peer_id, access_hash, title, username, photo_id, photo_dc_id, _ = row
+        if kind == 'channel':
+            photo = ChatPhoto(photo_id, photo_dc_id) if photo_id else ChatPhotoEmpty()
+            return Channel(id=peer_id, title=title, photo=photo, date=None,
+                           access_hash=access_hash, username=username)
+        if kind == 'chat':
+            photo = ChatPhoto(photo_id, photo_dc_id) if photo_id else ChatPhotoEmpty()
+            return Chat(id=peer_id, title=title, photo=photo, participants_count=0,
+                        date=None, version=0)
+        if kind == 'user':
+            photo = UserProfilePhoto(photo_id, photo_dc_id) if photo_id else None
+            return User(id=peer_id, access_hash=access_hash, first_name=title,
+                        username=username, photo=photo)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        memory_stats = self.memory.stats()
+        return {
+            'size': memory_stats['size'],
+            'memory_hits': memory_stats['hits'],
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+from config.settings import (
+    IMAGE_VARIANT_WIDTHS,
+    IMAGE_VARIANT_QUALITY,
+    IMAGE_VARIANT_MAX_SOURCE,
+)
+from app.services.telegram import telegram_service
+from app.services.media_cache import media_cache, cache_io_executor
+from app.services.media_prefetch import media_prefetcher
+from app.services.image_worker import image_worker
+from app.utils.cache import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Форматы, в которых отдаются варианты, и их MIME-типы
+VARIANT_FORMATS = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+# Уменьшаются только статичные изображения; GIF и прочее отдается как есть
+RESIZABLE_MIME_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+
+
+class ImageVariantService:
+    """
+    Уменьшенные варианты изображений для галереи.
+    Ширина округляется до одной из IMAGE_VARIANT_WIDTHS, чтобы число вариантов
+    одного файла было ограничено. Если у фото в Telegram есть готовый
+    PhotoSize не уже запрошенного, скачивается только он; иначе вариант
+    делается из оригинала (из кэша или скачанного). Каждый вариант
+    хранится в кэше отдельной записью ('variant'), как и обложки видео.
+    """
+
+    def __init__(self, widths: List[int] = None, quality: int = IMAGE_VARIANT_QUALITY,
+                 max_source: int = IMAGE_VARIANT_MAX_SOURCE):
+        self.widths = widths or IMAGE_VARIANT_WIDTHS
+        self.quality = quality
+        self.max_source = max_source
+        self._flight = SingleFlight()
+        self._stats = {
+            'generated': 0,
+            'from_thumbs': 0,
+            'from_original': 0,
+            'posters': 0,
+            'bytes': 0,
+        }
+
+    def snap_width(self, width: int) -> int:
+        """Ближайшая поддерживаемая ширина не меньше запрошенной"""
+        for allowed in self.widths:
+            if allowed >= width:
+                return allowed
+        return self.widths[-1]
+
+    def snap_quality(self, quality: Optional[int]) -> int:
+        if not quality:
+            return self.quality
+        return max(30, min(95, int(round(quality / 5.0)) * 5))
+
+    @staticmethod
+    def variant_key(file_key: str, width: int, quality: int, fmt: str) -> str:
+        return f"{file_key}_w{width}_q{quality}_{fmt}"
+
+    def srcset(self, base_url: str, width: Optional[int]) -> Optional[str]:
+        """Значение srcset для изображения исходной ширины width"""
+        if not width:
+            return None
+        candidates = [f"{base_url}?w={allowed} {allowed}w" for allowed in self.widths if allowed < width]
+        candidates.append(f"{base_url} {width}w")
+        return ", ".join(candidates)
+
+    def cached_entry(self, chat: str, msg_id: int, index: int, width: int, quality: int,
+                     fmt: str) -> Optional[Dict[str, Any]]:
+        """Вариант из кэша, если медиа поста уже связано с файлом (без запросов к Telegram)"""
+        file_key = media_cache.get_ref(chat, msg_id, index)
+        if not file_key:
+            return None
+        return media_cache.get_entry('variant', self.variant_key(file_key, width, quality, fmt))
+
+    async def get(self, chat: str, msg_id: int, index: int, width: int, quality: int,
+                  fmt: str) -> Optional[Dict[str, Any]]:
+        """
+        Вариант изображения медиа поста: {'key', 'mime_type', 'entry'} для варианта
+        из кэша или {'key', 'mime_type', 'data'} для только что сделанного.
+        None - вариант невозможен (не изображение, слишком большой файл), нужно отдать оригинал.
+        """
+        source = await telegram_service.resolve_media(chat, msg_id, index)
+        if not source:
+            return None
+        descriptor = source['descriptor']
+        file_key = descriptor.get('file_key')
+        if not file_key or descriptor.get('mime_type') not in RESIZABLE_MIME_TYPES:
+            return None
+        media_cache.set_ref(chat, msg_id, index, file_key)
+
+        key = self.variant_key(file_key, width, quality, fmt)
+        result = {'key': key, 'mime_type': VARIANT_FORMATS[fmt]}
+        entry = media_cache.get_entry('variant', key)
+        if entry:
+            return {**result, 'entry': entry}
+
+        data = await self._flight.run(key, lambda: self._build(chat, msg_id, index, source, key, width, quality, fmt))
+        return {**result, 'data': data} if data else None
+
+    async def poster(self, chat: str, msg_id: int, index: int) -> Optional[Dict[str, Any]]:
+        """
+        Обложка видео (документа) - его миниатюра из Telegram, без скачивания
+        самого файла. Формат ответа как у get; None - у документа нет миниатюры.
+        """
+        source = await telegram_service.resolve_document_thumb(chat, msg_id, index)
+        if not source:
+            return None
+        key = source['descriptor']['file_key']
+        result = {'key': key, 'mime_type': source['descriptor']['mime_type']}
+        entry = media_cache.get_entry('variant', key)
+        if entry:
+            return {**result, 'entry': entry}
+
+        data = await self._flight.run(key, lambda: self._fetch_poster(source))
+        return {**result, 'data': data} if data else None
+
+    async def _fetch_poster(self, source: Dict[str, Any]) -> bytes:
+        descriptor = source['descriptor']
+        data = await self._download(source)
+        self._stats['posters'] += 1
+        meta_to_save = {'mime_type': descriptor['mime_type'], 'original_filename': f"{descriptor['file_key']}.jpg"}
+        await media_cache.write('variant', descriptor['file_key'], data, meta_to_save)
+        return data
+
+    async def _download(self, source: Dict[str, Any]) -> bytes:
+        return b''.join([chunk async for chunk in telegram_service.iter_file(source)])
+
+    async def _build(self, chat: str, msg_id: int, index: int, source: Dict[str, Any], key: str,
+                     width: int, quality: int, fmt: str) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        descriptor = source['descriptor']
+        file_key = descriptor['file_key']
+
+        thumb = await telegram_service.resolve_photo_size(chat, msg_id, index, width)
+        if thumb:
+            # Готовый вариант Telegram: полный файл не нужен
+            data = await self._download(thumb)
+            self._stats['from_thumbs'] += 1
+        else:
+            entry = (media_cache.get_entry('media', file_key)
+                     or await media_prefetcher.join_media(file_key, max_bytes=self.max_source))
+            if entry:
+                data = await loop.run_in_executor(cache_io_executor, media_cache.read_entry, entry)
+            elif source['size'] > self.max_source:
+                logger.info(f"Изображение {file_key} ({source['size']} байт) слишком большое для уменьшения")
+                return None
+            else:
+                data = await self._download(source)
+                meta_to_save = {'mime_type': descriptor['mime_type'], 'original_filename': descriptor.get('filename')}
+                await media_cache.write('media', file_key, data, meta_to_save)
+            self._stats['from_original'] += 1
+
+        variant = await image_worker.render_variant(data, width, quality, fmt)
+        logger.debug(f"Сделан вариант {key}: {len(data)} -> {len(variant)} байт")
+        self._stats['generated'] += 1
+        self._stats['bytes'] += len(variant)
+
+        meta_to_save = {'mime_type': VARIANT_FORMATS[fmt], 'original_filename': descriptor.get('filename')}
+        await media_cache.write('variant', key, variant, meta_to_save)
+        return variant
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'widths': self.widths,
+            **self._stats,
+            **self._flight.stats(),
+        }
+
+
+# Создаем экземпляр сервиса вариантов изображений
+image_variants = ImageVariantService()
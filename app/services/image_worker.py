@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Callable, Dict, Optional, Tuple
+from PIL import Image, ImageOps
+from config.settings import IMAGE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Функции ниже выполняются в процессах пула: принимают и возвращают только
+# байты и простые значения. Процессы запускаются через spawn и не наследуют
+# потоки, цикл событий и соединения с Telegram основного процесса.
+
+
+def probe_size(data: bytes) -> Tuple[int, int]:
+    """Ширина и высота изображения (читается только заголовок)"""
+    with Image.open(BytesIO(data)) as image:
+        return image.width, image.height
+
+
+def render_variant(data: bytes, width: int, quality: int, fmt: str) -> bytes:
+    """Уменьшает изображение до ширины width (пропорционально) и кодирует в fmt"""
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.width > width:
+            image.thumbnail((width, image.height), Image.LANCZOS)
+        if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif fmt == 'webp' and image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+        output = BytesIO()
+        image.save(output, format=fmt.upper(), quality=quality)
+    return output.getvalue()
+
+
+def _warm_up() -> bool:
+    # Pillow и его кодеки загружаются при запуске процесса, а не на первом запросе
+    Image.init()
+    return True
+
+
+class ImageWorkerService:
+    """
+    Пул процессов для работы с изображениями (Pillow).
+    Декодирование и кодирование изображений занимают процессор и держат GIL,
+    поэтому в потоках они замедляли бы цикл событий и отдачу медиа из кэша.
+    Задачи передаются в процессы в виде байтов; с workers=0 выполняются
+    в пуле потоков по умолчанию.
+    """
+
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.workers = max(0, workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._stats = {
+            'tasks': 0,
+            'errors': 0,
+            'restarts': 0,
+        }
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers and self._pool is None:
+            # spawn, а не fork: к этому моменту в процессе уже есть потоки кэша, цикл событий
+            # и соединения с Telegram, а унаследованные блокировки могут повесить воркер
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    async def start(self):
+        """Создает пул и заранее запускает все процессы"""
+        pool = self._get_pool()
+        if pool is None:
+            logger.info("Пул процессов для изображений отключен, обработка в потоках")
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(pool, _warm_up) for _ in range(self.workers)))
+        logger.info(f"Пул процессов для изображений запущен: {self.workers} процессов")
+
+    async def stop(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """Выполняет func(*args) в пуле; func - функция этого модуля"""
+        loop = asyncio.get_running_loop()
+        self._stats['tasks'] += 1
+        try:
+            return await loop.run_in_executor(self._get_pool(), func, *args)
+        except BrokenProcessPool:
+            # Процесс-воркер завершился аварийно: следующий вызов создаст новый пул
+            logger.error("Пул процессов для изображений сломан, пересоздается")
+            self._stats['errors'] += 1
+            self._stats['restarts'] += 1
+            self._pool = None
+            raise
+        except Exception:
+            self._stats['errors'] += 1
+            raise
+
+    async def probe_size(self, data: bytes) -> Tuple[int, int]:
+        return await self.run(probe_size, data)
+
+    async def render_variant(self, data: bytes, width: int, quality: int, fmt: str) -> bytes:
+        return await self.run(render_variant, data, width, quality, fmt)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            **self._stats,
+        }
+
+
+# Создаем экземпляр пула обработки изображений
+image_worker = ImageWorkerService()
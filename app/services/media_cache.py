@@ -0,0 +1,633 @@
+import logging
+import os
+import re
+import json
+import uuid
+import hashlib
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from config.settings import (
+    CACHE_DIR,
+    CACHE_REF_TTL,
+    CACHE_WRITE_WORKERS,
+    CACHE_WRITE_QUEUE_BYTES,
+    CACHE_WRITE_QUEUE_SIZE,
+    CACHE_VERIFY_CHECKSUMS,
+    CACHE_MEMORY_BYTES,
+    CACHE_MEMORY_MAX_OBJECT,
+    CACHE_SEGMENTS,
+    CACHE_SEGMENT_MAX_OBJECT,
+    CACHE_SEGMENT_BYTES,
+    CACHE_SEGMENT_COMPACT_RATIO,
+)
+from app.services.cache_index import CacheIndex
+from app.services.segment_store import SegmentStore, SEGMENT_NAME
+from app.utils.cache import ByteLRUCache
+
+logger = logging.getLogger(__name__)
+
+# Определяем путь к директории кэша
+MEDIA_CACHE_DIR = str(CACHE_DIR)
+
+
+def clean_filename(filename):
+    """Очищает строку для использования в качестве имени файла/директории."""
+    # Удаляем символы, недопустимые в большинстве ФС
+    # Заменяем пробелы и другие разделители на подчеркивание
+    cleaned = re.sub(r'[<>:"/\\|?*\s]+', '_', str(filename))
+    # Удаляем начальные/конечные подчеркивания и точки
+    cleaned = cleaned.strip('_. ')
+    # Ограничиваем длину, чтобы избежать проблем с путями
+    return cleaned[:100] if cleaned else "default"
+
+
+def file_checksum(path: str) -> str:
+    """Контрольная сумма файла кэша (та же, что считает CacheWriter)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def data_checksum(data: bytes) -> str:
+    """Контрольная сумма данных в памяти (совпадает с суммой файла в кэше)"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class CacheWriter:
+    """
+    Запись файла в кэш по частям во время его отдачи клиенту.
+    Данные пишутся во временный файл и переносятся на итоговый путь
+    только в commit(), после чего файл регистрируется в индексе кэша
+    (on_commit). Недокачанный файл никогда не попадает в кэш.
+    Небольшой файл при заданном segments вместо переноса дописывается в сегмент.
+    Вся работа с диском выполняется в пуле потоков, а не в цикле событий.
+    """
+
+    def __init__(self, data_path: str, on_commit: Callable[..., None] = None,
+                 executor: ThreadPoolExecutor = None, segments: SegmentStore = None):
+        self.data_path = data_path
+        self.on_commit = on_commit
+        self.segments = segments
+        self.temp_path = f"{data_path}.{uuid.uuid4().hex}.part"
+        self.executor = executor or cache_io_executor
+        self.bytes_written = 0
+        self.committed = False
+        self.closed = False
+        self._file = None
+        self._digest = hashlib.blake2b(digest_size=16)
+        # Запись идет в потоке, а abort() может прийти из цикла событий при отмене
+        self._lock = threading.Lock()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def write_sync(self, chunk: bytes):
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+                    self._file = open(self.temp_path, 'wb')
+                self._file.write(chunk)
+                self._digest.update(chunk)
+                self.bytes_written += len(chunk)
+                return
+            except OSError as e:
+                logger.error(f"Ошибка записи во временный файл кэша {self.temp_path}: {e}")
+        self.abort()
+
+    async def write(self, chunk: bytes):
+        if not self.closed:
+            await self._run(self.write_sync, chunk)
+
+    def commit_sync(self, metadata_dict: dict, expected_size: int = None) -> bool:
+        """Фиксирует файл в кэше, если он скачан полностью"""
+        with self._lock:
+            if self.closed:
+                return False
+            complete = self.bytes_written and not (expected_size and self.bytes_written != expected_size)
+            if complete:
+                try:
+                    self._file.close()
+                    data_path, offset = self._place()
+                    if self.on_commit:
+                        self.on_commit(metadata_dict, self.bytes_written, self._digest.hexdigest(), data_path, offset)
+                    self.committed = True
+                    self.closed = True
+                    logger.info(f"Данные успешно записаны в кэш: {data_path} ({self.bytes_written} байт)")
+                    return True
+                except Exception as e:
+                    logger.error(f"Ошибка фиксации файла кэша ({self.data_path}): {e}")
+            else:
+                logger.warning(
+                    f"Файл для кэша {self.data_path} неполный ({self.bytes_written} из {expected_size} байт), не сохраняем")
+        self.abort()
+        return False
+
+    def _place(self):
+        """Переносит временный файл в кэш; возвращает (путь, смещение в сегменте или None)"""
+        if self.segments is not None and self.segments.accepts(self.bytes_written):
+            with open(self.temp_path, 'rb') as f:
+                location = self.segments.append(f.read())
+            os.remove(self.temp_path)
+            return location
+        os.replace(self.temp_path, self.data_path)
+        return self.data_path, None
+
+    async def commit(self, metadata_dict: dict, expected_size: int = None) -> bool:
+        return await self._run(self.commit_sync, metadata_dict, expected_size)
+
+    def abort(self):
+        """Отменяет запись и удаляет временный файл"""
+        with self._lock:
+            if self.committed:
+                return
+            self.closed = True
+            try:
+                if self._file is not None:
+                    self._file.close()
+                if os.path.exists(self.temp_path):
+                    os.remove(self.temp_path)
+            except Exception as e:
+                logger.error(f"Ошибка при удалении временного файла кэша {self.temp_path}: {e}")
+            self._file = None
+
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи в кэш.
+    Запись выполняется в пуле потоков; объем данных, ожидающих записи,
+    ограничен: при переполнении submit() ждет, пока очередь освободится,
+    поэтому всплеск запросов не накапливает в памяти неограниченно байты файлов.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, max_bytes: int = CACHE_WRITE_QUEUE_BYTES,
+                 max_items: int = CACHE_WRITE_QUEUE_SIZE):
+        self.executor = executor
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self._pending_bytes = 0
+        self._pending_items = 0
+        self._condition = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.waited = 0
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Создается лениво, внутри работающего цикла событий
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _has_room(self, size: int) -> bool:
+        # Одиночная запись больше лимита все равно пропускается, если очередь пуста
+        return self._pending_items == 0 or (
+            self._pending_items < self.max_items and self._pending_bytes + size <= self.max_bytes)
+
+    async def submit(self, func, size: int):
+        """Ставит запись в очередь; возвращается, как только для нее есть место"""
+        condition = self._get_condition()
+        async with condition:
+            if not self._has_room(size):
+                self.waited += 1
+                logger.debug(f"Очередь записи в кэш заполнена ({self._pending_bytes} байт), ожидаем")
+            await condition.wait_for(lambda: self._has_room(size))
+            self._pending_items += 1
+            self._pending_bytes += size
+            self.submitted += 1
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, func)
+        future.add_done_callback(lambda f: asyncio.ensure_future(self._finish(f, size)))
+
+    async def _finish(self, future, size: int):
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+            if not future.cancelled():
+                logger.error(f"Ошибка отложенной записи в кэш: {future.exception()}")
+        else:
+            self.completed += 1
+        condition = self._get_condition()
+        async with condition:
+            self._pending_items -= 1
+            self._pending_bytes -= size
+            condition.notify_all()
+
+    async def drain(self):
+        """Дожидается завершения всех поставленных записей"""
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._pending_items == 0)
+
+    def stats(self):
+        return {
+            'pending_items': self._pending_items,
+            'pending_bytes': self._pending_bytes,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'waited': self.waited,
+        }
+
+
+# Пул потоков для всех операций записи в кэш
+cache_io_executor = ThreadPoolExecutor(max_workers=CACHE_WRITE_WORKERS, thread_name_prefix='media-cache')
+
+
+class MediaCache:
+    """
+    Файловый кэш медиа и фотографий каналов.
+    Медиа хранится по ключу файла в Telegram (id фото/документа и вариант размера),
+    поэтому один и тот же файл, пересланный в разные каналы, хранится один раз.
+    Сведения о файлах (MIME-тип, размер, контрольная сумма, обращения) и связи
+    постов с файлами (chat, msg_id, index) -> ключ хранятся в индексе SQLite,
+    загруженном в память: попадание в кэш не требует обращений к диску до отдачи файла.
+    Небольшие файлы (аватары каналов, фото) дополнительно держатся в памяти
+    и отдаются без обращений к файловой системе, а при CACHE_SEGMENTS
+    хранятся на диске в общих файлах-сегментах (SegmentStore).
+    """
+
+    # Каталоги типов кэша, файлы которых раскладываются по подкаталогам
+    SHARDED_DIRS = {'media': 'files', 'variant': 'variants'}
+
+    def __init__(self, cache_dir: str = MEDIA_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index = CacheIndex(os.path.join(cache_dir, 'index.sqlite'))
+        self.write_queue = WriteBehindQueue(cache_io_executor)
+        self.memory = ByteLRUCache(CACHE_MEMORY_BYTES, CACHE_MEMORY_MAX_OBJECT)
+        # Уже записанные в сегменты файлы читаются и при выключенной настройке
+        self.segments = SegmentStore(
+            os.path.join(cache_dir, 'segments'), CACHE_SEGMENT_BYTES,
+            CACHE_SEGMENT_MAX_OBJECT if CACHE_SEGMENTS else 0)
+        self.repair_stats = {}
+
+    @staticmethod
+    def _key(identifier) -> str:
+        return clean_filename(identifier)
+
+    def get_path(self, cache_type: str, identifier: str) -> Optional[str]:
+        """
+        Путь к файлу кэша. cache_type: 'media' (identifier - ключ файла),
+        'variant' (уменьшенный вариант изображения) или 'channel_photo' (identifier - chat_id).
+        """
+        key = self._key(identifier)
+        if cache_type in self.SHARDED_DIRS:
+            # Раскладываем файлы по подкаталогам, чтобы не держать все в одной директории
+            shard = hashlib.md5(key.encode()).hexdigest()[:2]
+            return os.path.join(self.cache_dir, self.SHARDED_DIRS[cache_type], shard, f"{key}.cache")
+        if cache_type == 'channel_photo':
+            return os.path.join(self.cache_dir, 'channel_photos', f"{key}.cache")
+        logger.error(f"Неизвестный тип кэша: {cache_type}")
+        return None
+
+    def entry_path(self, entry: Dict[str, Any]) -> str:
+        return os.path.join(self.cache_dir, entry['path'])
+
+    def get_entry(self, cache_type: str, identifier: str) -> Optional[Dict[str, Any]]:
+        """Запись индекса о закэшированном файле или None"""
+        return self.index.get(cache_type, self._key(identifier))
+
+    async def read_small(self, entry: Dict[str, Any]) -> Optional[bytes]:
+        """
+        Содержимое небольшого файла из памяти; при промахе файл читается
+        в потоке и остается в памяти. Для больших файлов - None
+        (файлы из сегментов читаются всегда: отдельного файла для них нет).
+        FileNotFoundError пробрасывается, чтобы вызывающий код удалил запись.
+        """
+        in_segment = entry.get('segment_offset') is not None
+        if not in_segment and not self.memory.fits(entry['size']):
+            return None
+        memory_key = (entry['kind'], entry['key'], entry['created_at'])
+        data = self.memory.get(memory_key)
+        if data is None:
+            data = await asyncio.get_running_loop().run_in_executor(cache_io_executor, self.read_entry, entry)
+            self.memory.set(memory_key, data)
+        return data
+
+    def read_entry(self, entry: Dict[str, Any]) -> bytes:
+        """Читает содержимое файла кэша (из отдельного файла или сегмента)"""
+        if entry.get('segment_offset') is not None:
+            return self.segments.read(self.entry_path(entry), entry['segment_offset'], entry['size'])
+        with open(self.entry_path(entry), 'rb') as f:
+            return f.read()
+
+    def touch(self, entry: Dict[str, Any]):
+        """Отмечает обращение к файлу кэша (в памяти, без stat/utime)"""
+        self.index.touch(entry)
+
+    @staticmethod
+    def _ref_chat(chat: str) -> str:
+        # Usernames в Telegram нечувствительны к регистру
+        return clean_filename(chat).lower()
+
+    def get_ref(self, chat: str, msg_id, index) -> Optional[str]:
+        """Ключ файла, ранее связанного с медиа поста, или None"""
+        return self.index.get_ref(self._ref_chat(chat), int(msg_id), int(index))
+
+    def set_ref(self, chat: str, msg_id, index, file_key: str):
+        """Связывает медиа поста с ключом файла"""
+        ref = (self._ref_chat(chat), int(msg_id), int(index))
+        if self.index.get_ref(*ref) == file_key:
+            # Подтвержденная связь продлевается не чаще, чем раз в десятую часть срока ее жизни
+            if self.index.ref_times.get(ref, 0) > time.time() - CACHE_REF_TTL / 10:
+                return
+        cache_io_executor.submit(self.index.set_ref, *ref, file_key)
+
+    def lookup_media(self, chat: str, msg_id, index) -> Optional[Dict[str, Any]]:
+        """Запись индекса о закэшированном медиа поста или None"""
+        file_key = self.get_ref(chat, msg_id, index)
+        return self.index.get('media', file_key) if file_key else None
+
+    def _register(self, cache_type: str, identifier: str, data_path: str):
+        """Колбэк фиксации файла: добавляет его в индекс (вызывается в потоке записи)"""
+        def on_commit(metadata_dict: dict, size: int, checksum: str, stored_path: str = None,
+                      segment_offset: int = None):
+            now = time.time()
+            rel_path = os.path.relpath(stored_path or data_path, self.cache_dir)
+            previous = self.index.get(cache_type, self._key(identifier))
+            self.index.put({
+                'kind': cache_type,
+                'key': self._key(identifier),
+                'path': rel_path,
+                'mime_type': metadata_dict.get('mime_type'),
+                'original_filename': metadata_dict.get('original_filename'),
+                'size': size,
+                'checksum': checksum,
+                'file_id': identifier if cache_type == 'media' else metadata_dict.get('file_id'),
+                'created_at': now,
+                'last_access': now,
+                'hits': 0,
+                'segment_offset': segment_offset,
+            })
+            if previous and previous.get('segment_offset') is None and previous['path'] != rel_path:
+                # Прежняя версия лежала отдельным файлом, а новая - в сегменте
+                self._remove_file(self.entry_path(previous))
+        return on_commit
+
+    def open_writer(self, cache_type: str, identifier: str) -> Optional[CacheWriter]:
+        """Создает потокового писателя для заполнения кэша во время отдачи файла"""
+        data_path = self.get_path(cache_type, identifier)
+        if not data_path:
+            return None
+        return CacheWriter(data_path, self._register(cache_type, identifier, data_path),
+                           segments=self.segments)
+
+    async def write(self, cache_type: str, identifier: str, file_bytes: bytes, metadata_dict: dict):
+        """
+        Ставит данные в очередь записи в кэш.
+        Возвращается сразу после постановки в очередь (или когда в ней появится место).
+        """
+        data_path = self.get_path(cache_type, identifier)
+        if not (data_path and file_bytes and metadata_dict):
+            logger.error("Недостаточно данных для записи в кэш.")
+            return
+
+        def write_file():
+            on_commit = self._register(cache_type, identifier, data_path)
+            if self.segments.accepts(len(file_bytes)):
+                # Данные уже в памяти: сразу дописываем в сегмент, без временного файла
+                segment_path, offset = self.segments.append(file_bytes)
+                on_commit(metadata_dict, len(file_bytes), data_checksum(file_bytes), segment_path, offset)
+                stored = True
+            else:
+                writer = CacheWriter(data_path, on_commit)
+                writer.write_sync(file_bytes)
+                stored = writer.commit_sync(metadata_dict, expected_size=len(file_bytes))
+            if stored:
+                # Только что записанный небольшой файл сразу попадает и в память
+                entry = self.get_entry(cache_type, identifier)
+                if entry:
+                    self.memory.set((entry['kind'], entry['key'], entry['created_at']), file_bytes)
+
+        await self.write_queue.submit(write_file, len(file_bytes))
+
+    def remove_entry(self, entry: Dict[str, Any]):
+        """Удаляет файл и его запись из индекса (выполняется в потоке)"""
+        self.memory.pop((entry['kind'], entry['key'], entry['created_at']))
+        current = self.index.get(entry['kind'], entry['key'])
+        if current is not None and not self.same_entry(current, entry):
+            # Файл успели перезаписать или перенести при сжатии - новая версия не трогается
+            return
+        if entry.get('segment_offset') is None:
+            try:
+                os.remove(self.entry_path(entry))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл кэша {entry['path']}: {e}")
+        # Место в сегменте освобождается при его сжатии
+        self.index.remove(entry['kind'], entry['key'])
+
+    def compact_segments(self, ratio: float = CACHE_SEGMENT_COMPACT_RATIO) -> Dict[str, int]:
+        """
+        Переписывает сегменты, в которых доля удаленных данных не меньше ratio:
+        живые объекты дописываются в активный сегмент, старый сегмент удаляется.
+        Выполняется в потоке записи кэша (из очистки кэша).
+        """
+        live: Dict[str, list] = {}
+        for entry in self.index.snapshot():
+            if entry.get('segment_offset') is not None:
+                live.setdefault(entry['path'], []).append(entry)
+
+        result = {'compacted_segments': 0, 'moved_objects': 0, 'reclaimed_bytes': 0}
+        for path, size in sorted(self.segments.list_segments().items()):
+            if not self.segments.is_sealed(path):
+                continue
+            entries = live.get(os.path.relpath(path, self.cache_dir), [])
+            live_bytes = sum(entry['size'] for entry in entries)
+            if size and (size - live_bytes) / size < ratio:
+                continue
+
+            moved = []
+            for entry in entries:
+                current = self.index.get(entry['kind'], entry['key'])
+                if (current is None or current['path'] != entry['path']
+                        or current['segment_offset'] != entry['segment_offset']):
+                    continue
+                try:
+                    data = self.segments.read(path, entry['segment_offset'], entry['size'])
+                except OSError as e:
+                    logger.warning(f"Объект {entry['key']} в сегменте {path} недоступен: {e}")
+                    continue
+                new_path, offset = self.segments.append(data)
+                moved.append({**current, 'path': os.path.relpath(new_path, self.cache_dir), 'segment_offset': offset})
+            if moved:
+                self.index.put_many(moved)
+            self.segments.retire(path)
+
+            result['compacted_segments'] += 1
+            result['moved_objects'] += len(moved)
+            result['reclaimed_bytes'] += size - live_bytes
+            logger.info(f"Сегмент кэша {path} сжат: перенесено {len(moved)} объектов, "
+                        f"освобождено {size - live_bytes} байт")
+
+        self.segments.compacted_segments += result['compacted_segments']
+        self.segments.reclaimed_bytes += result['reclaimed_bytes']
+        return result
+
+    @staticmethod
+    def same_entry(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        """Одна и та же версия файла: не перезаписана и не перенесена в другой сегмент"""
+        return (a['path'] == b['path'] and a.get('segment_offset') == b.get('segment_offset')
+                and a['created_at'] == b['created_at'])
+
+    def invalidate(self, entry: Dict[str, Any]):
+        """Удаляет запись, файл которой оказался недоступен"""
+        current = self.index.get(entry['kind'], entry['key'])
+        if current is None or not self.same_entry(current, entry):
+            # Запись уже заменена новой версией (запись или сжатие сегмента) - она действительна
+            return
+        logger.warning(f"Файл кэша {entry['path']} недоступен, запись удалена из индекса")
+        self.index.entries.pop((entry['kind'], entry['key']), None)
+        cache_io_executor.submit(self.remove_entry, entry)
+
+    async def init(self):
+        """Загружает индекс и сверяет его с файлами на диске"""
+        await asyncio.get_running_loop().run_in_executor(cache_io_executor, self.load_and_repair)
+
+    def load_and_repair(self, verify_checksums: bool = CACHE_VERIFY_CHECKSUMS):
+        """
+        Загружает индекс и приводит его в соответствие с файлами:
+        - записи без файла или с другим размером (и контрольной суммой) удаляются;
+        - файлы без записи в индексе удаляются, а файлы старого формата
+          с .meta рядом переносятся в индекс;
+        - брошенные временные .part файлы удаляются;
+        - старые .ref файлы переносятся в индекс.
+        """
+        started = time.monotonic()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index.load()
+        stats = {'removed_entries': 0, 'imported_files': 0, 'removed_files': 0, 'imported_refs': 0}
+
+        for entry in self.index.snapshot():
+            path = self.entry_path(entry)
+            try:
+                if entry.get('segment_offset') is not None:
+                    valid = os.path.getsize(path) >= entry['segment_offset'] + entry['size']
+                    if valid and verify_checksums and entry.get('checksum'):
+                        valid = data_checksum(self.read_entry(entry)) == entry['checksum']
+                else:
+                    valid = os.path.getsize(path) == entry['size']
+                    if valid and verify_checksums and entry.get('checksum'):
+                        valid = file_checksum(path) == entry['checksum']
+            except OSError:
+                valid = False
+            if not valid:
+                logger.warning(f"Запись кэша {entry['path']} не совпадает с файлом, удаляем")
+                self.remove_entry(entry)
+                stats['removed_entries'] += 1
+
+        known_paths = {entry['path'] for entry in self.index.entries.values()}
+        for cache_type, cache_dir in (('media', os.path.join(self.cache_dir, 'files')),
+                                      ('variant', os.path.join(self.cache_dir, 'variants')),
+                                      ('channel_photo', os.path.join(self.cache_dir, 'channel_photos'))):
+            for root, _, files in os.walk(cache_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    rel_path = os.path.relpath(path, self.cache_dir)
+                    if name.endswith('.cache') and rel_path in known_paths:
+                        continue
+                    if name.endswith('.cache') and self._import_legacy(cache_type, path):
+                        stats['imported_files'] += 1
+                        continue
+                    legacy_data_path = f"{path[:-len('.meta')]}.cache"
+                    if (name.endswith('.meta') and os.path.exists(legacy_data_path)
+                            and os.path.relpath(legacy_data_path, self.cache_dir) not in known_paths):
+                        # Обработается вместе со своим .cache
+                        continue
+                    self._remove_file(path)
+                    stats['removed_files'] += 1
+
+        # В каталоге сегментов не должно быть ничего, кроме самих сегментов
+        for root, _, files in os.walk(self.segments.directory):
+            for name in files:
+                if not SEGMENT_NAME.match(name):
+                    self._remove_file(os.path.join(root, name))
+                    stats['removed_files'] += 1
+
+        # Кэш медиа по постам (media/<chat>/<msg_id>/) больше не используется.
+        # Каталог не удаляется автоматически: его можно удалить вручную
+        legacy_media_dir = os.path.join(self.cache_dir, 'media')
+        if os.path.isdir(legacy_media_dir):
+            logger.info(f"Устаревший каталог кэша {legacy_media_dir} не используется и может быть удален")
+
+        stats['imported_refs'] = self._import_legacy_refs()
+        stats['pruned_refs'] = self.index.prune_refs(CACHE_REF_TTL)
+        stats['duration'] = round(time.monotonic() - started, 3)
+        self.repair_stats = stats
+        logger.info(f"Проверка кэша завершена: {stats}")
+
+    def _import_legacy(self, cache_type: str, data_path: str) -> bool:
+        """Переносит файл кэша со старым .meta в индекс"""
+        meta_path = f"{data_path[:-len('.cache')]}.meta"
+        if not os.path.exists(meta_path):
+            return False
+        try:
+            with open(meta_path, 'r') as f:
+                metadata_dict = json.load(f)
+            identifier = os.path.basename(data_path)[:-len('.cache')]
+            self._register(cache_type, identifier, data_path)(
+                metadata_dict, os.path.getsize(data_path), file_checksum(data_path))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось перенести в индекс файл кэша {data_path}: {e}")
+            return False
+        self._remove_file(meta_path)
+        return True
+
+    def _import_legacy_refs(self) -> int:
+        """Переносит старые .ref файлы posts/<chat>/<msg_id>/<index>.ref в индекс"""
+        refs_dir = os.path.join(self.cache_dir, 'posts')
+        imported = 0
+        for root, _, files in os.walk(refs_dir, topdown=False):
+            for name in files:
+                path = os.path.join(root, name)
+                parts = os.path.relpath(path, refs_dir).split(os.sep)
+                if name.endswith('.ref') and len(parts) == 3 and parts[1].isdigit():
+                    try:
+                        with open(path, 'r') as f:
+                            file_key = f.read().strip()
+                        index = name[:-len('.ref')]
+                        if file_key and index.isdigit():
+                            self.index.set_ref(self._ref_chat(parts[0]), int(parts[1]), int(index), file_key)
+                            imported += 1
+                    except OSError:
+                        pass
+                self._remove_file(path)
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+        return imported
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Не удалось удалить файл кэша {path}: {e}")
+
+    async def drain(self):
+        """Дожидается записи всех данных из очереди и сохраняет статистику обращений"""
+        await self.write_queue.drain()
+        await asyncio.get_running_loop().run_in_executor(cache_io_executor, self.index.flush_access)
+
+    def stats(self) -> Dict[str, Any]:
+        entries = list(self.index.entries.values())
+        return {
+            'entries': len(entries),
+            'bytes': sum(entry['size'] for entry in entries),
+            'refs': len(self.index.refs),
+            'repair': self.repair_stats,
+            'memory': self.memory.stats(),
+            'segments': self.segments.stats(),
+        }
+
+
+# Создаем экземпляр кэша
+media_cache = MediaCache()
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+from config.settings import (
+    PREFETCH_ENABLED,
+    PREFETCH_MAX_BYTES,
+    PREFETCH_POST_MAX_BYTES,
+    PREFETCH_CONCURRENCY,
+    PREFETCH_JOIN_MAX_BYTES,
+)
+from app.services.telegram import telegram_service
+from app.services.media_cache import media_cache
+from app.services.rpc_scheduler import rpc_priority, current_priority, PRIORITY_BACKGROUND
+from app.utils.cache import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class MediaPrefetcher:
+    """
+    Фоновая предзагрузка медиа поста и фото канала в кэш.
+    Страница поста открывается раньше, чем браузер запросит медиа,
+    поэтому к моменту запроса файл уже в кэше или скачивается:
+    маршрут медиа присоединяется к идущему скачиванию небольшого файла
+    (join), а не начинает свое. Запросы к Telegram идут с фоновым
+    приоритетом, пока к скачиванию не присоединится интерактивный запрос.
+    Предзагружаются только изображения поста и не больше post_max_bytes
+    на пост: видео и документы браузер без действия пользователя не запрашивает.
+    """
+
+    def __init__(self, enabled: bool = PREFETCH_ENABLED, max_bytes: int = PREFETCH_MAX_BYTES,
+                 concurrency: int = PREFETCH_CONCURRENCY, join_max_bytes: int = PREFETCH_JOIN_MAX_BYTES,
+                 post_max_bytes: int = PREFETCH_POST_MAX_BYTES):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.post_max_bytes = post_max_bytes
+        self.join_max_bytes = join_max_bytes
+        self.concurrency = max(1, concurrency)
+        self._semaphore = None
+        self._media_flight = SingleFlight()
+        self._photo_flight = SingleFlight()
+        self._jobs: Dict[tuple, asyncio.Task] = {}
+        # Идущие скачивания (прошедшие семафор): ключ файла -> размер и приоритет запросов
+        self._active: Dict[str, Dict[str, int]] = {}
+        # Ожидающие очереди скачивания, файл которых уже скачивает интерактивный запрос
+        self._superseded = set()
+        self._stats = {
+            'posts': 0,
+            'files': 0,
+            'bytes': 0,
+            'skipped_large': 0,
+            'skipped_type': 0,
+            'skipped_budget': 0,
+            'joined': 0,
+            'errors': 0,
+        }
+
+    def schedule(self, chat: str, msg_id: int, media_count: int, channel_photo: bool = False):
+        """Ставит предзагрузку медиа поста в фон; повторный вызов для того же поста ничего не делает"""
+        if not self.enabled or (not media_count and not channel_photo):
+            return
+        key = (chat.lower(), msg_id)
+        if key in self._jobs:
+            return
+        # Задача наследует контекст, поэтому все ее запросы к Telegram - фоновые
+        with rpc_priority(PRIORITY_BACKGROUND):
+            task = asyncio.create_task(self._prefetch_post(chat, msg_id, media_count, channel_photo))
+        self._jobs[key] = task
+        task.add_done_callback(lambda t: self._jobs.pop(key, None))
+        self._stats['posts'] += 1
+
+    async def _prefetch_post(self, chat: str, msg_id: int, media_count: int, channel_photo: bool):
+        resolved = await asyncio.gather(*(self._resolve_item(chat, msg_id, index) for index in range(media_count)),
+                                        return_exceptions=True)
+        jobs = []
+        budget = self.post_max_bytes
+        for index, source in enumerate(resolved):
+            if isinstance(source, Exception):
+                self._stats['errors'] += 1
+                logger.warning(f"Ошибка предзагрузки медиа {chat}/{msg_id}/{index}: {source}")
+                continue
+            if not source:
+                continue
+            # Бюджет поста расходуется по порядку медиа: первые показываются раньше
+            if self.post_max_bytes and source['size'] > budget:
+                self._stats['skipped_budget'] += 1
+                continue
+            budget -= source['size']
+            file_key = source['descriptor']['file_key']
+            jobs.append(self._media_flight.run(file_key, lambda source=source, file_key=file_key, index=index:
+                                               self._download(source, file_key, index)))
+        if channel_photo and not media_cache.get_entry('channel_photo', chat):
+            jobs.append(self.channel_photo(chat))
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                self._stats['errors'] += 1
+                logger.warning(f"Ошибка предзагрузки медиа поста {chat}/{msg_id}: {result}")
+
+    async def _resolve_item(self, chat: str, msg_id: int, index: int) -> Optional[Dict[str, Any]]:
+        """Источник медиа поста для предзагрузки или None, если его предзагружать не нужно"""
+        if media_cache.lookup_media(chat, msg_id, index):
+            return None
+        source = await telegram_service.resolve_media(chat, msg_id, index)
+        file_key = source['descriptor'].get('file_key') if source else None
+        if not file_key:
+            return None
+        media_cache.set_ref(chat, msg_id, index, file_key)
+        if media_cache.get_entry('media', file_key):
+            return None
+        mime_type = source['descriptor'].get('mime_type') or ''
+        if not mime_type.startswith('image/'):
+            self._stats['skipped_type'] += 1
+            return None
+        if self.max_bytes and source['size'] > self.max_bytes:
+            self._stats['skipped_large'] += 1
+            logger.debug(f"Медиа {chat}/{msg_id}/{index} ({source['size']} байт) слишком большое для предзагрузки")
+            return None
+        return source
+
+    async def _download(self, source: Dict[str, Any], file_key: str, index: int) -> Optional[Dict[str, Any]]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            entry = media_cache.get_entry('media', file_key)
+            if entry:
+                return entry
+            if file_key in self._superseded:
+                self._superseded.discard(file_key)
+                return None
+            writer = media_cache.open_writer('media', file_key)
+            if writer is None:
+                return None
+            descriptor = source['descriptor']
+            state = self._active[file_key] = {'size': source['size'], 'priority': PRIORITY_BACKGROUND}
+            stream = telegram_service.iter_file(source)
+            try:
+                while True:
+                    # Приоритет читается перед каждой частью: его может повысить join_media
+                    with rpc_priority(state['priority']):
+                        try:
+                            chunk = await stream.__anext__()
+                        except StopAsyncIteration:
+                            break
+                    await writer.write(chunk)
+                meta_to_save = {
+                    'mime_type': descriptor.get('mime_type') or 'application/octet-stream',
+                    'original_filename': descriptor.get('filename') or f'media_{index}',
+                }
+                if await writer.commit(meta_to_save, expected_size=source['size']):
+                    self._stats['files'] += 1
+                    self._stats['bytes'] += source['size']
+                    logger.debug(f"Предзагружено медиа {file_key} ({source['size']} байт)")
+            finally:
+                self._active.pop(file_key, None)
+                await stream.aclose()
+                if not writer.committed:
+                    writer.abort()
+        return media_cache.get_entry('media', file_key)
+
+    async def join_media(self, file_key: Optional[str], max_bytes: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Дожидается идущей предзагрузки файла и возвращает его запись в кэше.
+        Присоединяется только к уже идущему скачиванию файла не больше max_bytes
+        (по умолчанию join_max_bytes): большой файл выгоднее отдавать потоком сразу.
+        Запросы присоединившегося скачивания получают приоритет вызывающего.
+        Если ждать нечего или скачать файл не удалось, возвращает None.
+        """
+        if not file_key or file_key not in self._media_flight:
+            return None
+        state = self._active.get(file_key)
+        if state is None:
+            # Скачивание еще ждет очереди: вызывающий скачает файл сам, а предзагрузка его пропустит
+            self._superseded.add(file_key)
+            return None
+        if state['size'] > (self.join_max_bytes if max_bytes is None else max_bytes):
+            return None
+        state['priority'] = min(state['priority'], current_priority())
+        self._stats['joined'] += 1
+        try:
+            return await self._media_flight.join(file_key)
+        except Exception as e:
+            logger.warning(f"Предзагрузка {file_key} завершилась ошибкой, скачиваем заново: {e}")
+            return None
+
+    async def channel_photo(self, chat: str) -> Optional[Dict[str, Any]]:
+        """
+        Фото канала из Telegram с записью в кэш. Одновременные запросы
+        (предзагрузка и маршрут фото канала) скачивают фото один раз.
+        """
+        return await self._photo_flight.run(chat.lower(), lambda: self._fetch_channel_photo(chat))
+
+    async def _fetch_channel_photo(self, chat: str) -> Optional[Dict[str, Any]]:
+        photo_data = await telegram_service.get_channel_photo(chat)
+        if not photo_data or not photo_data.get('file_bytes'):
+            return None
+        meta_to_save = {'mime_type': photo_data.get('mime_type', 'image/jpeg')}
+        try:
+            await media_cache.write('channel_photo', chat, photo_data['file_bytes'], meta_to_save)
+            logger.info(f"Запланирована запись в кэш для фото канала: {chat}")
+        except Exception as e:
+            logger.error(f"Ошибка при планировании записи фото канала в кэш: {e}")
+        return photo_data
+
+    async def stop(self):
+        """Отменяет незавершенные предзагрузки (при остановке приложения)"""
+        jobs = list(self._jobs.values())
+        for task in jobs:
+            task.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'jobs': len(self._jobs),
+            'downloads': self._media_flight.stats(),
+            'channel_photos': self._photo_flight.stats(),
+            **self._stats,
+        }
+
+
+# Создаем экземпляр предзагрузчика медиа
+media_prefetcher = MediaPrefetcher()
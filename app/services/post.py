@@ -1,14 +1,21 @@
 import re
 import logging
 import json
-from typing import Dict, Tuple, Any
-from app.services.telegram import telegram_service
+import asyncio
+from typing import Dict, List, Optional, Tuple, Any
+from app.services.telegram import telegram_service, NotFoundError
+from app.services.image_variants import image_variants, RESIZABLE_MIME_TYPES
+from config.settings import BATCH_POSTS_LIMIT, POST_CACHE_SIZE, POST_CACHE_TTL
 from app.utils.formatters import MessageFormatter
+from app.utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 
 class PostService:
+    # Готовые посты по (chat, msg_id) вместе с edit_date сообщения, из которого собраны
+    post_cache = TTLCache(maxsize=POST_CACHE_SIZE, ttl=POST_CACHE_TTL)
+
     @staticmethod
     def parse_url(url: str) -> Tuple[str, int]:
         """Парсит URL поста Telegram"""
@@ -110,85 +117,197 @@ class PostService:
             message = await telegram_service.get_message(chat, msg_id)
             if not message:
                 logger.error(f"Сообщение не найдено: {chat}/{msg_id}")
-                raise ValueError("Сообщение не найдено")
+                raise NotFoundError("Сообщение не найдено")
 
-            logger.debug(f"Получено сообщение с ID: {msg_id}")
+            return await cls.render_post(chat, msg_id, message)
+        except NotFoundError:
+            raise
+        except Exception as e:
+            logger.exception(f"Ошибка при получении поста: {e}")
+            raise
 
-            # Диагностика типа сообщения
-            logger.debug(f"Тип сообщения: {type(message).__name__}")
+    @classmethod
+    async def render_post(cls, chat: str, msg_id: int, message: Any,
+                          channel_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Данные поста с информацией о канале из кэша готовых постов.
+        Кэш проверяется по edit_date полученного сообщения: отредактированный
+        пост собирается заново, неизмененный не требует других запросов к Telegram.
+        """
+        key = (chat.lower(), msg_id)
+        edit_date = getattr(message, 'edit_date', None)
+        cached = cls.post_cache.get(key)
+        if cached and cached['edit_date'] == edit_date:
+            logger.debug(f"Пост {chat}/{msg_id} взят из кэша")
+            return dict(cached['post'])
+
+        post = await cls.build_post(chat, msg_id, message)
+        if channel_info is None:
+            channel_info = await cls.get_channel_info(chat)
+        post["channel_info"] = channel_info
+        cls.post_cache.set(key, {'edit_date': edit_date, 'post': post})
+        return dict(post)
 
-            full_html, layout = cls.build_post_html(message, chat, msg_id)
+    @classmethod
+    async def build_post(cls, chat: str, msg_id: int, message: Any) -> Dict[str, Any]:
+        """Собирает данные поста (HTML текста и список медиа) из полученного сообщения"""
+        logger.debug(f"Получено сообщение с ID: {msg_id}")
 
-            # Получаем список медиафайлов
-            media_list = await telegram_service.get_messages_with_media(chat, msg_id)
-            logger.debug(
-                f"Получен список медиафайлов: {len(media_list) if media_list else 0} файлов")
+        # Диагностика типа сообщения
+        logger.debug(f"Тип сообщения: {type(message).__name__}")
 
-            # Преобразуем список медиафайлов в формат, который можно сериализовать в JSON
-            # Не включаем байтовые данные, только метаданные
-            media_info = []
-            for i, media in enumerate(media_list):
-                # Определяем тип медиа по MIME-типу
-                mime_type = media.get('mime_type', 'unknown')
-                media_type = "document"  # По умолчанию считаем документом
+        full_html, layout = cls.build_post_html(message, chat, msg_id)
 
-                if mime_type.startswith('image/'):
-                    media_type = "photo"
-                elif mime_type.startswith('video/'):
-                    media_type = "video"
+        # Получаем описания медиафайлов без их скачивания
+        media_list = await telegram_service.get_media_descriptors(chat, msg_id)
+        logger.debug(
+            f"Получен список медиафайлов: {len(media_list) if media_list else 0} файлов")
+
+        # Преобразуем список медиафайлов в формат, который можно сериализовать в JSON
+        media_info = []
+        for i, media in enumerate(media_list):
+            # Определяем тип медиа по MIME-типу
+            mime_type = media.get('mime_type', 'unknown')
+            media_type = "document"  # По умолчанию считаем документом
+
+            if mime_type.startswith('image/'):
+                media_type = "photo"
+            elif mime_type.startswith('video/'):
+                media_type = "video"
 
-                media_info.append({
-                    'index': i,
-                    'type': media_type,
-                    'mime_type': mime_type,
-                    'size': len(media.get('file_bytes', b'')) if media.get('file_bytes') else 0,
-                    'id': i,  # Добавляем id для совместимости с JavaScript-кодом
-                    'filename': f"media_{i}.{media_type.split('/')[0] if '/' in media_type else media_type}"
-                })
+            media_info.append({
+                'index': i,
+                'type': media_type,
+                'mime_type': mime_type,
+                'size': media.get('size', 0),
+                'id': i,  # Добавляем id для совместимости с JavaScript-кодом
+                'filename': media.get('filename') or f"media_{i}",
+                'width': media.get('width'),
+                'height': media.get('height'),
+                'duration': media.get('duration'),
+                'thumbs': media.get('thumbs', []),
+                # Встроенная миниатюра Telegram (data-URI): показывается до загрузки файла
+                'placeholder': media.get('placeholder'),
+                # Уменьшенные варианты для <img srcset>: браузер берет ширину под размер блока
+                'srcset': image_variants.srcset(f"/media/{chat}/{msg_id}/{i}", media.get('width'))
+                if mime_type in RESIZABLE_MIME_TYPES else None,
+                # Обложка видео из миниатюры документа: для <video preload="none" poster>
+                'poster': f"/media/{chat}/{msg_id}/{i}/poster"
+                if mime_type.startswith('video/') and media.get('thumbs') else None
+            })
 
-                logger.debug(
-                    f"Добавлен медиафайл #{i}, тип: {media_type}, MIME: {mime_type}")
+            logger.debug(
+                f"Добавлен медиафайл #{i}, тип: {media_type}, MIME: {mime_type}")
 
-            # Определяем тип медиа с расширенной логикой
-            media_type = "none"
+        # Определяем тип медиа с расширенной логикой
+        media_type = "none"
 
-            if hasattr(message, 'photo') and message.photo:
+        if hasattr(message, 'photo') and message.photo:
+            media_type = "photo"
+        elif hasattr(message, 'document') and message.document:
+            if hasattr(message.document, 'mime_type') and message.document.mime_type:
+                if message.document.mime_type.startswith("video"):
+                    media_type = "video"
+                elif message.document.mime_type.startswith("image"):
+                    media_type = "photo"
+        elif hasattr(message, 'video') and message.video:
+            media_type = "video"
+        elif hasattr(message, 'media'):
+            media_obj = message.media
+            media_class_name = type(media_obj).__name__
+            logger.debug(f"Класс медиа: {media_class_name}")
+
+            if "Photo" in media_class_name:
                 media_type = "photo"
-            elif hasattr(message, 'document') and message.document:
-                if hasattr(message.document, 'mime_type') and message.document.mime_type:
-                    if message.document.mime_type.startswith("video"):
-                        media_type = "video"
-                    elif message.document.mime_type.startswith("image"):
-                        media_type = "photo"
-            elif hasattr(message, 'video') and message.video:
+            elif "Video" in media_class_name or "Document" in media_class_name:
                 media_type = "video"
-            elif hasattr(message, 'media'):
-                media_obj = message.media
-                media_class_name = type(media_obj).__name__
-                logger.debug(f"Класс медиа: {media_class_name}")
 
-                if "Photo" in media_class_name:
-                    media_type = "photo"
-                elif "Video" in media_class_name or "Document" in media_class_name:
-                    media_type = "video"
+        logger.debug(f"Определен тип медиа: {media_type}")
 
-            logger.debug(f"Определен тип медиа: {media_type}")
+        # Если в списке медиа есть элементы, но тип не определен, установим фото по умолчанию
+        if media_info and media_type == "none":
+            media_type = "photo"
+            if any(media.get('mime_type', '').startswith('video') for media in media_info):
+                media_type = "video"
+            logger.debug(f"Установлен тип медиа из списка: {media_type}")
 
-            # Если в списке медиа есть элементы, но тип не определен, установим фото по умолчанию
-            if media_info and media_type == "none":
-                media_type = "photo"
-                if any(media.get('mime_type', '').startswith('video') for media in media_info):
-                    media_type = "video"
-                logger.debug(f"Установлен тип медиа из списка: {media_type}")
-
-            return {
-                "text": full_html,
-                "chat": chat,
-                "msg_id": msg_id,
-                "layout": layout,
-                "media_list": media_info,
-                "media_type": media_type
-            }
+        return {
+            "text": full_html,
+            "chat": chat,
+            "msg_id": msg_id,
+            "layout": layout,
+            "media_list": media_info,
+            "media_type": media_type
+        }
+
+    @staticmethod
+    async def get_channel_info(chat: str) -> Optional[Dict[str, Any]]:
+        """Краткая информация о канале для шапки поста"""
+        channel_entity = await telegram_service.get_channel_entity(chat)
+        if not channel_entity:
+            return None
+        return {
+            "title": getattr(channel_entity, "title", "Канал"),
+            "username": getattr(channel_entity, "username", None),
+            "photo": hasattr(channel_entity, "photo") and not isinstance(channel_entity.photo, type(None))
+        }
+
+    @classmethod
+    async def _get_chat_posts(cls, chat: str, msg_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Получает посты одного чата: сообщения запрашиваются пачкой"""
+        try:
+            messages = await telegram_service.get_messages_batch(chat, msg_ids)
+            channel_info = await cls.get_channel_info(chat)
         except Exception as e:
-            logger.exception(f"Ошибка при получении поста: {e}")
-            raise
+            logger.error(f"Ошибка при получении сообщений из {chat}: {e}")
+            return {msg_id: {"error": f"Ошибка при получении поста: {e}"} for msg_id in msg_ids}
+
+        posts = {}
+        for msg_id in msg_ids:
+            message = messages.get(msg_id)
+            if not message:
+                posts[msg_id] = {"error": "Сообщение не найдено"}
+                continue
+            try:
+                posts[msg_id] = await cls.render_post(chat, msg_id, message, channel_info)
+            except Exception as e:
+                logger.exception(f"Ошибка при обработке поста {chat}/{msg_id}: {e}")
+                posts[msg_id] = {"error": f"Ошибка при обработке поста: {e}"}
+        return posts
+
+    @classmethod
+    async def get_posts(cls, urls: List[str]) -> List[Dict[str, Any]]:
+        """
+        Получает несколько постов по списку URL.
+        Ссылки группируются по чатам, и сообщения каждого чата запрашиваются
+        одним get_messages (по 100 id), а не отдельным запросом на каждый пост.
+        Результаты возвращаются в порядке ссылок; для ошибочных - поле error.
+        """
+        if len(urls) > BATCH_POSTS_LIMIT:
+            raise ValueError(f"Слишком много ссылок: максимум {BATCH_POSTS_LIMIT}")
+
+        parsed = []
+        ids_by_chat: Dict[str, List[int]] = {}
+        for url in urls:
+            try:
+                chat, msg_id = cls.parse_url(str(url))
+            except ValueError as e:
+                parsed.append((url, None, None, str(e)))
+                continue
+            parsed.append((url, chat, msg_id, None))
+            chat_ids = ids_by_chat.setdefault(chat, [])
+            if msg_id not in chat_ids:
+                chat_ids.append(msg_id)
+
+        logger.debug(f"get_posts: {len(urls)} ссылок из {len(ids_by_chat)} чатов")
+        chats = list(ids_by_chat)
+        results = await asyncio.gather(*[cls._get_chat_posts(chat, ids_by_chat[chat]) for chat in chats])
+        posts_by_chat = dict(zip(chats, results))
+
+        posts = []
+        for url, chat, msg_id, error in parsed:
+            if error:
+                posts.append({"url": url, "error": error})
+            else:
+                posts.append({"url": url, **posts_by_chat[chat][msg_id]})
+        return posts
@@ -0,0 +1,230 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import sqlite3
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict
+from telethon.errors import (
+    FloodWaitError, RPCError, ServerError, RpcCallFailError, TimedOutError,
+    UsernameNotOccupiedError, UsernameInvalidError, ChannelInvalidError, ChannelPrivateError,
+    PeerIdInvalidError, ChatIdInvalidError, MsgIdInvalidError,
+)
+from config.settings import (
+    RPC_CONCURRENCY,
+    RPC_DEFAULT_RATE,
+    RPC_METHOD_RATES,
+    RPC_FLOOD_MAX_WAIT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов: чем меньше значение, тем раньше запрос получает слот
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_current_priority = contextvars.ContextVar('rpc_priority', default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def rpc_priority(priority: int):
+    """
+    Задает приоритет для всех запросов к Telegram внутри блока,
+    включая задачи, созданные в нем (они наследуют контекст).
+    """
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> int:
+    return _current_priority.get()
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Имеет ли смысл повторять запрос после ошибки.
+    Ошибки запроса (400/403/404, неизвестный канал) повторять бесполезно,
+    а FloodWait обрабатывает сам планировщик.
+    """
+    if isinstance(error, FloodWaitError):
+        return False
+    if isinstance(error, (ServerError, RpcCallFailError, TimedOutError)):
+        return True
+    if isinstance(error, RPCError):
+        return False
+    if isinstance(error, sqlite3.OperationalError):
+        return "database is locked" in str(error)
+    if isinstance(error, (ValueError, TypeError)):
+        return False
+    # Обрывы соединения и прочие сетевые ошибки
+    return True
+
+
+# Начала сообщений ValueError, которыми get_entity Telethon сообщает о неизвестной сущности
+NOT_FOUND_MESSAGES = (
+    'Cannot find any entity corresponding to',
+    'No user has',
+)
+
+
+def is_not_found_error(error: Exception) -> bool:
+    """
+    Означает ли ошибка, что запрошенного канала или сообщения нет
+    (или к нему нет доступа). Такой ответ можно кэшировать как отрицательный.
+    """
+    if isinstance(error, (UsernameNotOccupiedError, UsernameInvalidError, ChannelInvalidError,
+                          ChannelPrivateError, PeerIdInvalidError, ChatIdInvalidError, MsgIdInvalidError)):
+        return True
+    # Telethon сообщает о неизвестной сущности через ValueError; другие ValueError
+    # (ошибки разбора, внутренние ошибки) отрицательно не кэшируются
+    return type(error) is ValueError and str(error).startswith(NOT_FOUND_MESSAGES)
+
+
+def retry_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Экспоненциальная задержка перед повтором со случайным разбросом"""
+    return min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+class TokenBucket:
+    """Ограничение частоты: rate запросов в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RpcScheduler:
+    """
+    Планировщик запросов одной сессии Telegram.
+    Ограничивает число одновременных запросов, выдает слоты по приоритету,
+    соблюдает частоту по методам (token bucket) и при FloodWait
+    приостанавливает все запросы сессии на указанное Telegram время.
+    """
+
+    def __init__(self, name: str = '', concurrency: int = RPC_CONCURRENCY,
+                 method_rates: Dict[str, tuple] = None, default_rate: float = RPC_DEFAULT_RATE,
+                 flood_max_wait: int = RPC_FLOOD_MAX_WAIT):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.method_rates = RPC_METHOD_RATES if method_rates is None else method_rates
+        self.default_rate = default_rate
+        self.flood_max_wait = flood_max_wait
+        self._active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._flood_until = 0.0
+        self.calls = 0
+        self.queued = 0
+        self.floods = 0
+
+    def _bucket(self, method: str) -> TokenBucket:
+        bucket = self._buckets.get(method)
+        if bucket is None:
+            rate, burst = self.method_rates.get(method, (self.default_rate, self.default_rate))
+            bucket = self._buckets[method] = TokenBucket(rate, burst)
+        return bucket
+
+    async def _acquire_slot(self, priority: int):
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            return
+
+        self.queued += 1
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), waiter))
+        try:
+            # Слот передается напрямую из _release_slot
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+
+    def _release_slot(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def flood_remaining(self) -> float:
+        return max(0.0, self._flood_until - time.monotonic())
+
+    async def wait_flood(self):
+        # Цикл: пока ждем, FloodWait может прийти снова и продлить паузу
+        while True:
+            delay = self.flood_remaining()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def note_flood(self, seconds: int, method: str = None):
+        """Приостанавливает все запросы сессии после FloodWait"""
+        self.floods += 1
+        self._flood_until = max(self._flood_until, time.monotonic() + seconds)
+        logger.warning(f"FloodWait {seconds} с для сессии {self.name} (метод {method}), запросы приостановлены")
+
+    @asynccontextmanager
+    async def slot(self, method: str, priority: int = None):
+        """Занимает слот для запроса: очередь по приоритету, пауза FloodWait, лимит частоты"""
+        await self._acquire_slot(current_priority() if priority is None else priority)
+        try:
+            await self.wait_flood()
+            await self._bucket(method).take()
+            self.calls += 1
+            yield
+        finally:
+            self._release_slot()
+
+    async def throttle(self, method: str, priority: int = None):
+        """Дожидается очереди для одного запроса, выполняемого вне планировщика"""
+        async with self.slot(method, priority):
+            pass
+
+    async def call(self, method: str, factory: Callable[[], Awaitable[Any]], priority: int = None) -> Any:
+        """
+        Выполняет запрос через планировщик. FloodWait не расходует попытки
+        вызывающего кода: запрос повторяется после паузы, если она не длиннее
+        flood_max_wait, иначе ошибка возвращается вызывающему.
+        """
+        while True:
+            try:
+                async with self.slot(method, priority):
+                    return await factory()
+            except FloodWaitError as e:
+                self.note_flood(e.seconds, method)
+                if e.seconds > self.flood_max_wait:
+                    raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active': self._active,
+            'waiting': sum(1 for _, _, waiter in self._waiters if not waiter.done()),
+            'calls': self.calls,
+            'queued': self.queued,
+            'floods': self.floods,
+            'flood_remaining': round(self.flood_remaining(), 1),
+        }
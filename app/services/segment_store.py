@@ -0,0 +1,158 @@
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_NAME = re.compile(r'^seg_(\d{6})\.dat$')
+
+
+class SegmentStore:
+    """
+    Хранилище небольших объектов кэша в больших файлах-сегментах.
+    Объекты дописываются в конец активного сегмента, а индекс кэша хранит
+    сегмент и смещение, поэтому число файлов на диске не растет с числом
+    закэшированных фото. Чтение - os.pread по открытому дескриптору сегмента.
+    Удаленные объекты остаются в сегменте "дырами"; сегменты, в которых
+    их стало много, переписываются (compact в MediaCache).
+    """
+
+    def __init__(self, directory: str, segment_bytes: int, max_object: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        # 0 - новые объекты в сегменты не пишутся (уже записанные читаются)
+        self.max_object = max_object
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_path = None
+        self._fds: Dict[str, int] = {}
+        # Дескрипторы удаленных сегментов закрываются при следующем сжатии:
+        # чтение, начатое до переноса объекта, должно успеть завершиться
+        self._retired: List[int] = []
+        self.appended = 0
+        self.compacted_segments = 0
+        self.reclaimed_bytes = 0
+
+    def accepts(self, size: int) -> bool:
+        return 0 < size <= self.max_object
+
+    def segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"seg_{segment_id:06d}.dat")
+
+    def list_segments(self) -> Dict[str, int]:
+        """Существующие сегменты: путь -> размер"""
+        segments = {}
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return segments
+        for name in names:
+            if SEGMENT_NAME.match(name):
+                path = os.path.join(self.directory, name)
+                try:
+                    segments[path] = os.path.getsize(path)
+                except OSError:
+                    pass
+        return segments
+
+    @property
+    def active_path(self) -> Optional[str]:
+        return self._active_path
+
+    def _open_active(self):
+        if self._active is not None and self._active.tell() < self.segment_bytes:
+            return
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        ids = [int(SEGMENT_NAME.match(os.path.basename(path)).group(1)) for path in self.list_segments()]
+        segment_id = max(ids, default=0)
+        path = self.segment_path(segment_id) if segment_id else None
+        # После перезапуска дописываем последний сегмент, если в нем есть место
+        if path is None or path == self._active_path or os.path.getsize(path) >= self.segment_bytes:
+            segment_id += 1
+            path = self.segment_path(segment_id)
+        self._active = open(path, 'ab')
+        self._active_path = path
+        logger.debug(f"Активный сегмент кэша: {path}")
+
+    def append(self, data: bytes) -> Tuple[str, int]:
+        """Дописывает объект в активный сегмент; возвращает (путь сегмента, смещение)"""
+        with self._lock:
+            self._open_active()
+            offset = self._active.tell()
+            self._active.write(data)
+            self._active.flush()
+            self.appended += 1
+            return self._active_path, offset
+
+    def _fd(self, path: str) -> int:
+        fd = self._fds.get(path)
+        if fd is None:
+            with self._lock:
+                fd = self._fds.get(path)
+                if fd is None:
+                    fd = self._fds[path] = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        return fd
+
+    def read(self, path: str, offset: int, size: int) -> bytes:
+        """
+        Читает объект из сегмента. FileNotFoundError - если сегмента нет
+        или он короче ожидаемого (вызывающий код удалит запись из индекса).
+        """
+        if hasattr(os, 'pread'):
+            data = os.pread(self._fd(path), size, offset)
+        else:
+            # Windows: pread недоступен, читаем через отдельный дескриптор
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(size)
+        if len(data) != size:
+            raise FileNotFoundError(f"Сегмент {path} поврежден: нет {size} байт по смещению {offset}")
+        return data
+
+    def retire(self, path: str):
+        """Удаляет сегмент после переноса из него всех живых объектов"""
+        with self._lock:
+            for fd in self._retired:
+                os.close(fd)
+            self._retired = []
+            fd = self._fds.pop(path, None)
+            if fd is not None:
+                if hasattr(os, 'pread'):
+                    self._retired.append(fd)
+                else:
+                    os.close(fd)
+        try:
+            os.remove(path)
+        except OSError as e:
+            # Удалится при следующем сжатии
+            logger.warning(f"Не удалось удалить сегмент кэша {path}: {e}")
+
+    def is_sealed(self, path: str, min_age: float = 60) -> bool:
+        """
+        Можно ли сжимать сегмент: не активный и давно не изменялся
+        (объект, дописанный перед сменой сегмента, мог еще не попасть в индекс).
+        """
+        if path == self._active_path:
+            return False
+        try:
+            return time.time() - os.path.getmtime(path) >= min_age
+        except OSError:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self.list_segments()
+        return {
+            'segments': len(segments),
+            'bytes': sum(segments.values()),
+            'max_object': self.max_object,
+            'appended': self.appended,
+            'compacted_segments': self.compacted_segments,
+            'reclaimed_bytes': self.reclaimed_bytes,
+        }
@@ -1,7 +1,10 @@
 import logging
 import json
+import base64
 from io import BytesIO
-from telethon import TelegramClient
+from telethon import utils
+from telethon.errors import FloodWaitError, FileReferenceExpiredError
+from telethon.tl.functions.upload import GetFileRequest
 from telethon.tl.types import (
     MessageEntityBold,
     MessageEntityItalic,
@@ -16,59 +19,199 @@ from telethon.tl.types import (
     User,
     Chat,
     InputChannel,
-    DocumentAttributeFilename,
     DocumentAttributeVideo,
     DocumentAttributeAudio,
-    DocumentAttributeImageSize
+    DocumentAttributeImageSize,
+    PhotoSize,
+    PhotoCachedSize,
+    PhotoStrippedSize,
+    PhotoSizeProgressive,
+    InputPhotoFileLocation,
+    InputDocumentFileLocation
 )
-from config.settings import API_ID, API_HASH, TELEGRAM_SESSION, SESSION_PATH
+from config.settings import (
+    TELEGRAM_SESSION,
+    SESSION_PATHS,
+    MEDIA_DC_IDS,
+    MESSAGE_CACHE_SIZE,
+    MESSAGE_CACHE_TTL,
+    NEGATIVE_CACHE_SIZE,
+    NEGATIVE_CACHE_TTL,
+    ALBUM_CACHE_SIZE,
+    ALBUM_CACHE_TTL,
+    MEDIA_CHUNK_SIZE,
+    ALBUM_DOWNLOAD_CONCURRENCY,
+    PARALLEL_DOWNLOAD_WORKERS,
+    PARALLEL_DOWNLOAD_MIN_SIZE,
+    PARALLEL_DOWNLOAD_SENDERS,
+)
+from app.services.entity_cache import EntityCache
+from app.services.client_pool import ClientPool
+from app.services.rpc_scheduler import is_transient_error, is_not_found_error, retry_delay
+from app.services.media_cache import media_cache, cache_io_executor
+from app.utils.cache import TTLCache, SingleFlight
 import os
 import asyncio
 import sqlite3
 import tempfile
+import uuid
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
+# Максимальное количество медиа в одном альбоме Telegram
+ALBUM_MAX_ITEMS = 10
+# Максимальное количество id в одном запросе messages.getMessages/channels.getMessages
+MESSAGES_PER_REQUEST = 100
+
+
+class NotFoundError(ValueError):
+    """Канал или сообщение не существует в Telegram (или недоступно)"""
+
+
+async def close_download_iter(stream):
+    """
+    Закрывает итератор скачивания. Telethon возвращает заимствованный
+    sender другого DC только в close(), а при досрочном выходе из цикла
+    он сам его не вызывает.
+    """
+    close = getattr(stream, 'close', None) or getattr(stream, 'aclose', None)
+    if close is None:
+        return
+    try:
+        await close()
+    except Exception as e:
+        logger.debug(f"Ошибка при закрытии итератора скачивания: {e}")
+
+
+class ParallelDownloader:
+    """
+    Параллельное скачивание одного файла по частям.
+    Файл делится на части, выровненные по part_size; до `workers` частей
+    запрашиваются одновременно, а результат отдается строго по порядку.
+    Части распределяются по нескольким отдельным соединениям (MTProtoSender)
+    с DC файла: одно соединение Telegram обслуживает запросы upload.getFile
+    последовательно, поэтому прирост скорости дают именно несколько соединений.
+    Если соединения открыть не удалось, части идут через основной клиент.
+    Каждая часть проходит через планировщик сессии; при FloodWait
+    планировщик приостанавливает запросы, а параллелизм уменьшается.
+    """
+
+    def __init__(self, pooled, source, workers=PARALLEL_DOWNLOAD_WORKERS,
+                 part_size=MEDIA_CHUNK_SIZE, max_attempts=3, senders=PARALLEL_DOWNLOAD_SENDERS):
+        self.pooled = pooled
+        self.client = pooled.client
+        self.scheduler = pooled.scheduler
+        self.location = source['location']
+        self.dc_id = source['dc_id']
+        self.file_size = source['size']
+        self.workers = max(1, workers)
+        self.part_size = part_size
+        self.max_attempts = max_attempts
+        self.sender_count = min(senders, self.workers)
+        self.senders = []
+
+    async def _request_part(self, offset, part):
+        """Один запрос части: через отдельное соединение или через iter_download клиента"""
+        if self.senders:
+            sender = self.senders[part % len(self.senders)]
+            result = await sender.send(GetFileRequest(self.location, offset, self.part_size))
+            return result.bytes
+
+        stream = self.client.iter_download(
+            self.location, offset=offset, limit=1, request_size=self.part_size,
+            file_size=self.file_size, dc_id=self.dc_id)
+        try:
+            async for chunk in stream:
+                return chunk
+            return b''
+        finally:
+            await close_download_iter(stream)
+
+    async def _fetch_part(self, offset, part):
+        """Скачивает одну часть файла, начиная с выровненного смещения"""
+        attempt = 1
+        while True:
+            try:
+                async with self.scheduler.slot('download'):
+                    # Повтор идет через следующее соединение
+                    return await self._request_part(offset, part + attempt - 1)
+            except FloodWaitError as e:
+                # Flood wait не расходует попытки: планировщик ждет, а мы снижаем параллелизм
+                logger.warning(
+                    f"FloodWait {e.seconds} с при скачивании части {offset}, уменьшаем число воркеров")
+                self.scheduler.note_flood(e.seconds, 'download')
+                self.workers = max(1, self.workers // 2)
+                if e.seconds > self.scheduler.flood_max_wait:
+                    raise
+            except FileReferenceExpiredError:
+                raise
+            except Exception as e:
+                if attempt >= self.max_attempts:
+                    logger.error(f"Не удалось скачать часть {offset} после {attempt} попыток: {e}")
+                    raise
+                logger.warning(f"Ошибка при скачивании части {offset} (попытка {attempt}/{self.max_attempts}): {e}")
+                await asyncio.sleep(retry_delay(attempt))
+                attempt += 1
+
+    async def iter_parts(self, first_offset=0, count=None):
+        """Асинхронный генератор частей файла по порядку, начиная с first_offset"""
+        if count is None:
+            count = (self.file_size - first_offset + self.part_size - 1) // self.part_size
+
+        if self.sender_count > 1:
+            self.senders = await self.pooled.download_senders(self.dc_id, self.sender_count)
+
+        pending = deque()
+        next_part = 0
+        try:
+            while next_part < count or pending:
+                # Держим в работе не больше self.workers частей (память ограничена workers * part_size)
+                while next_part < count and len(pending) < self.workers:
+                    offset = first_offset + next_part * self.part_size
+                    pending.append(asyncio.ensure_future(self._fetch_part(offset, next_part)))
+                    next_part += 1
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def download_to_file(self, path):
+        """Скачивает файл целиком в path; возвращает количество записанных байт"""
+        written = 0
+        with open(path, 'wb') as f:
+            async for chunk in self.iter_parts():
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
 
 class TelegramService:
     def __init__(self):
         self.client = None
         self.is_initialized = False
+        # Пул сессий; при одной сессии (SESSION_PATH) работает как прежде
+        self.pool = ClientPool(SESSION_PATHS)
+        self.message_cache = TTLCache(maxsize=MESSAGE_CACHE_SIZE, ttl=MESSAGE_CACHE_TTL)
+        self._message_flight = SingleFlight()
+        self.album_cache = TTLCache(maxsize=ALBUM_CACHE_SIZE, ttl=ALBUM_CACHE_TTL)
+        self._album_flight = SingleFlight()
+        # Отрицательные ответы хранятся отдельно от найденных объектов и живут недолго
+        self.negative_cache = TTLCache(maxsize=NEGATIVE_CACHE_SIZE, ttl=NEGATIVE_CACHE_TTL)
 
     async def init(self):
-        """Инициализация клиента Telegram"""
+        """Инициализация клиентов Telegram"""
         if self.is_initialized:
             return
 
         try:
             logger.debug("Подключаюсь к Telegram...")
-            self.client = TelegramClient(SESSION_PATH, API_ID, API_HASH)
-            await self.client.connect()
-
-            if not await self.client.is_user_authorized():
+            if not await self.pool.connect(MEDIA_DC_IDS):
                 raise Exception(
                     "Необходима авторизация в Telegram. Запустите скрипт auth.py")
 
-            # Проверка соединения с чтением диалогов
-            try:
-                dialogs = await self.client.get_dialogs(limit=1)
-                logger.info(
-                    f"Подключение проверено успешно: доступно {len(dialogs)} диалогов")
-            except Exception as e:
-                logger.error(f"Ошибка при проверке диалогов: {e}")
-
-            # Освобождаем базу данных сессии, если была заблокирована
-            if hasattr(self.client.session, 'con') and self.client.session.con:
-                try:
-                    logger.debug("Проверка и сброс блокировок сессии...")
-                    self.client.session.con.execute(
-                        "PRAGMA busy_timeout = 5000")
-                    self.client.session.con.execute(
-                        "PRAGMA journal_mode = WAL")
-                    self.client.session.con.commit()
-                    logger.debug("Сессия обновлена")
-                except Exception as e:
-                    logger.warning(f"Ошибка при обновлении сессии: {e}")
+            # Основной клиент - для совместимости с кодом, работающим с одним клиентом
+            self.client = self.pool.primary.client
 
             self.is_initialized = True
             logger.debug("Подключение к Telegram завершено")
@@ -77,11 +220,28 @@ class TelegramService:
             logger.error(f"Ошибка при инициализации Telegram клиента: {e}")
             return False
 
-    async def get_entity(self, chat_id):
-        """Получение сущности чата по его ID"""
+    async def get_entity(self, chat_id, pooled=None):
+        """
+        Получение сущности чата по его ID.
+        pooled - клиент пула, для которого нужна сущность (access_hash у
+        каждого аккаунта свой); по умолчанию наименее загруженный.
+        """
         if not self.is_initialized:
             await self.init()
 
+        not_found = self.negative_cache.get(('entity', EntityCache.normalize_key(chat_id)))
+        if not_found is not None:
+            raise NotFoundError(not_found)
+
+        if pooled is None:
+            async with self.pool.acquire() as pooled:
+                return await self.get_entity(chat_id, pooled)
+
+        cached = await pooled.entity_cache.get(chat_id)
+        if cached is not None:
+            logger.debug(f"Entity для {chat_id} взят из кэша")
+            return cached
+
         max_attempts = 3
         current_attempt = 1
 
@@ -91,21 +251,34 @@ class TelegramService:
                     f"Получение entity для чата: {chat_id} (попытка {current_attempt}/{max_attempts})")
 
                 # Пробуем получить entity по username или ID
-                if chat_id.isdigit():
-                    entity = await self.client.get_entity(int(chat_id))
-                else:
-                    entity = await self.client.get_entity(chat_id)
+                peer = int(chat_id) if chat_id.isdigit() else chat_id
+                entity = await pooled.call('get_entity', lambda: pooled.client.get_entity(peer))
 
                 logger.debug(
                     f"Entity получен: {entity.id} - {getattr(entity, 'title', getattr(entity, 'first_name', 'Неизвестно'))}")
+                pooled.entity_cache.put(chat_id, entity)
                 return entity
             except Exception as e:
                 logger.warning(
                     f"Ошибка при получении entity для чата {chat_id} (попытка {current_attempt}/{max_attempts}): {e}")
-                if current_attempt == max_attempts:
+                if is_not_found_error(e):
+                    reason = f"Канал {chat_id} не найден: {e}"
+                    self.negative_cache.set(('entity', EntityCache.normalize_key(chat_id)), reason)
+                    raise NotFoundError(reason) from e
+                # Неизвестный канал или долгий FloodWait повторять бесполезно
+                if current_attempt == max_attempts or not is_transient_error(e):
                     raise
+                await asyncio.sleep(retry_delay(current_attempt))
                 current_attempt += 1
-                await asyncio.sleep(1)  # Ждем секунду перед повторной попыткой
+
+    def get_cache_stats(self):
+        """Статистика внутренних кэшей сервиса"""
+        return {
+            'clients': self.pool.stats(),
+            'messages': {**self.message_cache.stats(), **self._message_flight.stats()},
+            'albums': {**self.album_cache.stats(), **self._album_flight.stats()},
+            'negative': self.negative_cache.stats(),
+        }
 
     async def get_channel_entity(self, channel_id):
         """Получение сущности канала по его ID"""
@@ -113,30 +286,66 @@ class TelegramService:
 
     async def get_channel_photo(self, channel_id):
         """Получение фотографии канала"""
+        negative_key = ('channel_photo', EntityCache.normalize_key(channel_id))
+        if negative_key in self.negative_cache:
+            logger.debug(f"У канала {channel_id} нет фото (из кэша)")
+            return {'file_bytes': None, 'mime_type': 'image/jpeg'}
         try:
-            entity = await self.get_entity(channel_id)
+            if not self.is_initialized:
+                await self.init()
 
-            if not hasattr(entity, 'photo') or entity.photo is None:
-                logger.warning(f"У канала {channel_id} нет фото")
-                return {'file_bytes': None, 'mime_type': 'image/jpeg'}
+            async with self.pool.acquire() as pooled:
+                entity = await self.get_entity(channel_id, pooled)
+
+                if not hasattr(entity, 'photo') or entity.photo is None:
+                    logger.warning(f"У канала {channel_id} нет фото")
+                    self.negative_cache.set(negative_key, True)
+                    return {'file_bytes': None, 'mime_type': 'image/jpeg'}
 
-            # Загружаем фото канала
-            photo = await self.client.download_profile_photo(entity, bytes)
+                # Загружаем фото канала тем же аккаунтом, что разрешил сущность
+                photo = await pooled.call(
+                    'download', lambda: pooled.client.download_profile_photo(entity, bytes))
 
             if not photo:
                 logger.warning(
                     f"Не удалось загрузить фото канала {channel_id}")
+                self.negative_cache.set(negative_key, True)
                 return {'file_bytes': None, 'mime_type': 'image/jpeg'}
 
             logger.debug(
                 f"Фото канала {channel_id} успешно получено, размер={len(photo)} байт")
             return {'file_bytes': photo, 'mime_type': 'image/jpeg'}
+        except NotFoundError as e:
+            logger.debug(f"Фото канала {channel_id} недоступно: {e}")
+            return {'file_bytes': None, 'mime_type': 'image/jpeg'}
         except Exception as e:
             logger.error(f"Ошибка при получении фото канала {channel_id}: {e}")
             return {'file_bytes': None, 'mime_type': 'image/jpeg'}
 
+    @staticmethod
+    def _message_key(chat_id, message_id):
+        return EntityCache.normalize_key(chat_id), int(message_id)
+
     async def get_message(self, chat_id, message_id, max_attempts=3):
-        """Получение сообщения по его ID"""
+        """
+        Получение сообщения по его ID.
+        Результат кэшируется на короткое время, а одновременные запросы
+        одного и того же сообщения объединяются в один вызов Telegram.
+        """
+        key = self._message_key(chat_id, message_id)
+        message = self.message_cache.get(key)
+        if message is not None:
+            logger.debug(f"Сообщение {message_id} из {chat_id} взято из кэша")
+            return message
+        if ('message', key) in self.negative_cache:
+            logger.debug(f"Сообщение {message_id} из {chat_id} не существует (из кэша)")
+            return None
+
+        return await self._message_flight.run(
+            key, lambda: self._fetch_message(chat_id, message_id, max_attempts))
+
+    async def _fetch_message(self, chat_id, message_id, max_attempts=3):
+        """Получение сообщения из Telegram с повторными попытками"""
         # Проверяем инициализацию клиента
         if not self.is_initialized:
             await self.init()
@@ -149,209 +358,763 @@ class TelegramService:
                 logger.debug(
                     f"Получение сообщения {message_id} из {chat_id} (попытка {attempt}/{max_attempts})")
 
-                # Если у нас проблемы с сессией, пробуем пересоздать соединение
-                if attempt > 1:
-                    try:
-                        # Проверяем состояние базы данных и сбрасываем блокировки
-                        if hasattr(self.client.session, 'con') and self.client.session.con:
-                            self.client.session.con.execute(
-                                "PRAGMA busy_timeout = 5000")
-                            self.client.session.con.commit()
-                    except Exception as e:
-                        logger.warning(
-                            f"Не удалось сбросить состояние сессии: {e}")
-
-                entity = await self.get_entity(chat_id)
-                if not entity:
-                    logger.error(f"Не удалось получить entity для {chat_id}")
-                    return None
+                async with self.pool.acquire() as pooled:
+                    # Если у нас проблемы с сессией, сбрасываем блокировки базы данных
+                    if attempt > 1:
+                        pooled.reset_session_locks()
 
-                # Получаем сообщение с защитой от ошибки типа
-                try:
-                    # Преобразуем message_id в целое число, если это строка
-                    msg_id = int(message_id) if isinstance(message_id, str) else message_id
-                    
-                    # Получаем сообщение
-                    message = await self.client.get_messages(entity, ids=msg_id)
-                except TypeError as type_error:
-                    logger.error(f"Ошибка типа при получении сообщения: {type_error}")
-                    # Пробуем альтернативный подход
+                    entity = await self.get_entity(chat_id, pooled)
+                    if not entity:
+                        logger.error(f"Не удалось получить entity для {chat_id}")
+                        return None
+
+                    # Получаем сообщение с защитой от ошибки типа
+                    deleted = False
                     try:
-                        messages = await self.client.get_messages(entity, limit=1, 
-                                                                offset_id=int(message_id)+1)
-                        if messages and len(messages) > 0:
-                            message = messages[0]
-                            logger.debug(f"Сообщение получено альтернативным способом")
-                        else:
+                        # Преобразуем message_id в целое число, если это строка
+                        msg_id = int(message_id) if isinstance(message_id, str) else message_id
+
+                        # Получаем сообщение
+                        message = await pooled.call(
+                            'get_messages', lambda: pooled.client.get_messages(entity, ids=msg_id))
+                        # Telegram ответил, что такого сообщения нет (удалено или не существовало)
+                        deleted = message is None
+                    except TypeError as type_error:
+                        logger.error(f"Ошибка типа при получении сообщения: {type_error}")
+                        # Пробуем альтернативный подход
+                        try:
+                            messages = await pooled.call('get_messages', lambda: pooled.client.get_messages(
+                                entity, limit=1, offset_id=int(message_id)+1))
+                            if messages and len(messages) > 0 and messages[0].id == int(message_id):
+                                message = messages[0]
+                                logger.debug(f"Сообщение получено альтернативным способом")
+                            elif messages is not None:
+                                # Ближайшее более старое сообщение - другое: запрошенного нет
+                                message = None
+                                deleted = True
+                                logger.warning(f"Сообщение {message_id} не найдено альтернативным способом")
+                            else:
+                                message = None
+                                logger.warning(f"Не удалось получить сообщение альтернативным способом")
+                        except Exception as alt_error:
+                            logger.error(f"Ошибка при альтернативном получении сообщения: {alt_error}")
                             message = None
-                            logger.warning(f"Не удалось получить сообщение альтернативным способом")
-                    except Exception as alt_error:
-                        logger.error(f"Ошибка при альтернативном получении сообщения: {alt_error}")
-                        message = None
 
                 if not message:
                     logger.warning(
                         f"Сообщение {message_id} не найдено в {chat_id}")
+                    if deleted:
+                        self.negative_cache.set(('message', self._message_key(chat_id, message_id)), True)
                     return None
 
                 logger.debug(
                     f"Сообщение {message_id} успешно получено из {chat_id}")
+                self.message_cache.set(self._message_key(chat_id, message_id), message)
                 return message
 
+            except NotFoundError as e:
+                logger.warning(f"Сообщение {message_id} из {chat_id} недоступно: {e}")
+                return None
+
             except sqlite3.OperationalError as e:
                 if "database is locked" in str(e):
                     logger.warning(
                         f"База данных заблокирована (попытка {attempt}/{max_attempts}): {e}")
-                    await asyncio.sleep(1)  # Ждем перед следующей попыткой
                 else:
                     logger.error(f"Ошибка SQLite при получении сообщения: {e}")
                     last_error = e
+                    break
 
             except Exception as e:
                 logger.error(
                     f"Ошибка при получении сообщения {message_id} из {chat_id}: {e}")
                 last_error = e
+                if is_not_found_error(e):
+                    self.negative_cache.set(('message', self._message_key(chat_id, message_id)), True)
+                # Ошибки запроса и долгий FloodWait не повторяем
+                if not is_transient_error(e):
+                    break
 
+            if attempt < max_attempts:
+                await asyncio.sleep(retry_delay(attempt))
             attempt += 1
-            await asyncio.sleep(0.5)  # Небольшая пауза между попытками
 
         logger.error(
-            f"Не удалось получить сообщение после {max_attempts} попыток. Последняя ошибка: {last_error}")
+            f"Не удалось получить сообщение после {attempt} попыток. Последняя ошибка: {last_error}")
         return None
 
-    async def get_media(self, chat_id, message_id, index=0):
-        """Получение медиафайла из сообщения"""
-        try:
-            message = await self.get_message(chat_id, message_id)
+    async def get_messages_batch(self, chat_id, message_ids):
+        """
+        Получение нескольких сообщений одного чата.
+        Сообщения из кэша не запрашиваются, остальные запрашиваются
+        одним get_messages на каждые MESSAGES_PER_REQUEST id.
+        Возвращает словарь {id: сообщение}; отсутствующих сообщений в нем нет.
+        """
+        if not self.is_initialized:
+            await self.init()
 
-            # Получаем медиа из сообщения
-            if message.media:
-                logger.debug(
-                    f"Получение медиафайла для сообщения {message_id} из {chat_id}, индекс={index}")
-
-                # Проверяем, является ли сообщение частью альбома
-                if hasattr(message, 'grouped_id') and message.grouped_id and index > 0:
-                    # Это альбом - получаем нужное сообщение из альбома по индексу
-                    entity = await self.get_entity(chat_id)
-                    grouped_id = message.grouped_id
-
-                    logger.debug(
-                        f"Сообщение {message_id} является частью альбома с grouped_id={grouped_id}, запрошенный индекс={index}")
-
-                    # Получаем все сообщения в диапазоне, чтобы найти все части альбома
-                    album_messages = await self.client.get_messages(
-                        entity,
-                        # Берем немного больший диапазон, чтобы точно захватить все медиа альбома
-                        min_id=message_id-50,
-                        max_id=message_id+50   # Увеличиваем диапазон поиска частей альбома
-                    )
-
-                    album_messages = [msg for msg in album_messages if hasattr(
-                        msg, 'grouped_id') and msg.grouped_id == grouped_id and msg.media]
-
-                    # Сортируем сообщения по ID, чтобы порядок был стабильный
-                    album_messages.sort(key=lambda msg: msg.id)
-
-                    logger.debug(
-                        f"Найдено {len(album_messages)} сообщений в альбоме {grouped_id}")
-
-                    # Проверяем, что индекс в пределах доступных медиа
-                    if index < len(album_messages):
-                        # Берем сообщение по индексу
-                        target_message = album_messages[index]
-                        logger.debug(
-                            f"Выбрано сообщение с ID {target_message.id} по индексу {index}")
-                        
-                        # Используем target_message для дальнейшей обработки
-                        message = target_message
+        messages = {}
+        missing_ids = []
+        for msg_id in dict.fromkeys(int(msg_id) for msg_id in message_ids):
+            key = self._message_key(chat_id, msg_id)
+            cached = self.message_cache.get(key)
+            if cached is not None:
+                messages[msg_id] = cached
+            elif ('message', key) not in self.negative_cache:
+                missing_ids.append(msg_id)
+
+        if not missing_ids:
+            return messages
+
+        async with self.pool.acquire() as pooled:
+            entity = await self.get_entity(chat_id, pooled)
+            for start in range(0, len(missing_ids), MESSAGES_PER_REQUEST):
+                batch_ids = missing_ids[start:start + MESSAGES_PER_REQUEST]
+                logger.debug(f"Получение {len(batch_ids)} сообщений из {chat_id} одним запросом")
+                fetched = await pooled.call(
+                    'get_messages', lambda: pooled.client.get_messages(entity, ids=batch_ids))
+                for msg_id, msg in zip(batch_ids, fetched):
+                    if msg:
+                        messages[msg_id] = msg
+                        self.message_cache.set(self._message_key(chat_id, msg_id), msg)
                     else:
-                        logger.warning(
-                            f"Запрошенный индекс {index} превышает количество доступных медиафайлов {len(album_messages)} в альбоме")
-                        return {'file_bytes': None, 'mime_type': None, 'filename': None}
+                        self.negative_cache.set(('message', self._message_key(chat_id, msg_id)), True)
 
-                # Скачиваем медиа в байты
-                try:
-                    file_bytes = await self.client.download_media(message.media, bytes)
-                except Exception as e:
-                    logger.error(f"Ошибка при скачивании медиа: {e}")
-                    return {'file_bytes': None, 'mime_type': None, 'filename': None}
-
-                # Определяем тип медиа и имя файла
-                mime_type = "application/octet-stream"  # По умолчанию
-                filename = None
-
-                # Проверяем тип медиа и извлекаем информацию
-                if isinstance(message.media, MessageMediaPhoto):
-                    # Это фотография
-                    mime_type = "image/jpeg"
-                    filename = f"photo_{message.id}.jpg"
-                
-                elif hasattr(message.media, 'document'):
-                    # Это документ (видео, аудио, файл и т.д.)
-                    document = message.media.document
-                    
-                    # Пытаемся получить MIME-тип из атрибутов документа
-                    if hasattr(document, 'mime_type') and document.mime_type:
-                        mime_type = document.mime_type
-                    
-                    # Ищем имя файла в атрибутах
-                    for attr in document.attributes:
-                        if hasattr(attr, 'file_name') and attr.file_name:
-                            filename = attr.file_name
-                            break
-                    
-                    # Если имя файла не найдено, создаем на основе ID и типа
-                    if not filename:
-                        if mime_type.startswith('video/'):
-                            filename = f"video_{message.id}.mp4"
-                        elif mime_type.startswith('audio/'):
-                            filename = f"audio_{message.id}.mp3"
-                        elif mime_type.startswith('image/'):
-                            ext = mime_type.split('/')[-1]
-                            filename = f"image_{message.id}.{ext}"
-                        else:
-                            filename = f"file_{message.id}"
-                
-                elif isinstance(message.media, MessageMediaWebPage) and hasattr(message.media.webpage, 'photo'):
-                    # Это веб-страница с фото
-                    mime_type = "image/jpeg"
-                    filename = f"webpage_photo_{message.id}.jpg"
-                
-                # Если все еще нет имени файла, используем ID сообщения
-                if not filename:
-                    filename = f"media_{message.id}"
-                
-                # Гарантируем, что у нас есть расширение файла для распространенных типов
-                if mime_type == "image/jpeg" and not filename.lower().endswith(('.jpg', '.jpeg')):
-                    filename += ".jpg"
-                elif mime_type == "image/png" and not filename.lower().endswith('.png'):
-                    filename += ".png"
-                elif mime_type == "image/gif" and not filename.lower().endswith('.gif'):
-                    filename += ".gif"
-                elif mime_type == "video/mp4" and not filename.lower().endswith(('.mp4', '.avi', '.mov')):
-                    filename += ".mp4"
-                elif mime_type == "audio/mpeg" and not filename.lower().endswith(('.mp3', '.mpeg')):
-                    filename += ".mp3"
+        return messages
 
-                logger.debug(
-                    f"Медиафайл получен, размер={len(file_bytes) if file_bytes else 0} байт, тип={mime_type}, имя={filename}")
-                return {
-                    'file_bytes': file_bytes, 
-                    'mime_type': mime_type, 
-                    'filename': filename
-                }
-            else:
+    @staticmethod
+    def _is_supported_media(media):
+        """Проверка поддерживаемых типов медиа"""
+        return (
+            isinstance(media, MessageMediaPhoto) or
+            hasattr(media, 'document') or
+            # У превью ссылки без картинки (и у WebPageEmpty/WebPagePending) photo - None
+            (isinstance(media, MessageMediaWebPage) and
+             getattr(media.webpage, 'photo', None) is not None)
+        )
+
+    @staticmethod
+    def _photo_size_info(size):
+        """Описание размера фото/миниатюры в виде, пригодном для JSON"""
+        if isinstance(size, (PhotoSize, PhotoCachedSize, PhotoSizeProgressive)):
+            return {
+                'type': size.type,
+                'width': size.w,
+                'height': size.h,
+                'size': utils._photo_size_byte_count(size)
+            }
+        return None
+
+    @staticmethod
+    def _inline_placeholder(sizes):
+        """
+        Миниатюра, которую Telegram передает прямо в объекте фото/документа
+        (PhotoCachedSize или PhotoStrippedSize), в виде data-URI. None, если ее нет.
+        """
+        data = None
+        for size in sizes or []:
+            if isinstance(size, PhotoCachedSize) and size.bytes:
+                data = size.bytes
+                break
+            if isinstance(size, PhotoStrippedSize) and size.bytes and data is None:
+                # Заголовок JPEG в stripped-миниатюре опущен, восстанавливаем его
+                data = utils.stripped_photo_to_jpg(size.bytes)
+        if not data:
+            return None
+        if data[:4] == b'RIFF':
+            mime_type = 'image/webp'
+        elif data[:4] == b'\x89PNG':
+            mime_type = 'image/png'
+        else:
+            mime_type = 'image/jpeg'
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+    @classmethod
+    def _photo_details(cls, photo):
+        """Размер, габариты и миниатюры фото по его PhotoSize, без скачивания"""
+        placeholder = cls._inline_placeholder(getattr(photo, 'sizes', None))
+        sizes = [info for info in (cls._photo_size_info(size) for size in getattr(photo, 'sizes', None) or [])
+                 if info]
+        if not sizes:
+            return {'size': 0, 'width': None, 'height': None, 'thumbs': [], 'placeholder': placeholder}
+
+        # Telethon скачивает самый большой вариант фото
+        largest = max(sizes, key=lambda info: info['size'] or 0)
+        return {
+            'size': largest['size'] or 0,
+            'width': largest['width'],
+            'height': largest['height'],
+            'thumbs': [info for info in sizes if info is not largest],
+            'placeholder': placeholder
+        }
+
+    @classmethod
+    def _document_details(cls, document):
+        """Размер, габариты, длительность и миниатюры документа по его атрибутам"""
+        details = {
+            'size': getattr(document, 'size', 0) or 0,
+            'width': None,
+            'height': None,
+            'duration': None,
+            'thumbs': [info for info in (cls._photo_size_info(size) for size in getattr(document, 'thumbs', None) or [])
+                       if info],
+            'placeholder': cls._inline_placeholder(getattr(document, 'thumbs', None))
+        }
+        for attr in getattr(document, 'attributes', None) or []:
+            if isinstance(attr, (DocumentAttributeVideo, DocumentAttributeImageSize)):
+                details['width'] = attr.w
+                details['height'] = attr.h
+            if isinstance(attr, (DocumentAttributeVideo, DocumentAttributeAudio)):
+                details['duration'] = attr.duration
+        return details
+
+    @classmethod
+    def describe_media(cls, message):
+        """
+        Описание медиа сообщения без его скачивания: MIME-тип, имя файла,
+        размер, габариты, длительность и доступные миниатюры.
+        """
+        mime_type = "application/octet-stream"  # По умолчанию
+        filename = None
+        details = {'size': 0, 'width': None, 'height': None, 'duration': None, 'thumbs': [], 'placeholder': None}
+
+        # Проверяем тип медиа и извлекаем информацию
+        if isinstance(message.media, MessageMediaPhoto):
+            # Это фотография
+            mime_type = "image/jpeg"
+            filename = f"photo_{message.id}.jpg"
+            details.update(cls._photo_details(message.media.photo))
+
+        elif hasattr(message.media, 'document'):
+            # Это документ (видео, аудио, файл и т.д.)
+            document = message.media.document
+            details.update(cls._document_details(document))
+
+            # Пытаемся получить MIME-тип из атрибутов документа
+            if hasattr(document, 'mime_type') and document.mime_type:
+                mime_type = document.mime_type
+
+            # Ищем имя файла в атрибутах
+            for attr in getattr(document, 'attributes', []):
+                if hasattr(attr, 'file_name') and attr.file_name:
+                    filename = attr.file_name
+                    break
+
+            # Если имя файла не найдено, создаем на основе ID и типа
+            if not filename:
+                if mime_type.startswith('video/'):
+                    filename = f"video_{message.id}.mp4"
+                elif mime_type.startswith('audio/'):
+                    filename = f"audio_{message.id}.mp3"
+                elif mime_type.startswith('image/'):
+                    ext = mime_type.split('/')[-1]
+                    filename = f"image_{message.id}.{ext}"
+                else:
+                    filename = f"file_{message.id}"
+
+        elif isinstance(message.media, MessageMediaWebPage) and getattr(message.media.webpage, 'photo', None) is not None:
+            # Это веб-страница с фото
+            mime_type = "image/jpeg"
+            filename = f"webpage_photo_{message.id}.jpg"
+            details.update(cls._photo_details(message.media.webpage.photo))
+
+        # Если все еще нет имени файла, используем ID сообщения
+        if not filename:
+            filename = f"media_{message.id}"
+
+        # Гарантируем, что у нас есть расширение файла для распространенных типов
+        if mime_type == "image/jpeg" and not filename.lower().endswith(('.jpg', '.jpeg')):
+            filename += ".jpg"
+        elif mime_type == "image/png" and not filename.lower().endswith('.png'):
+            filename += ".png"
+        elif mime_type == "image/gif" and not filename.lower().endswith('.gif'):
+            filename += ".gif"
+        elif mime_type == "video/mp4" and not filename.lower().endswith(('.mp4', '.avi', '.mov')):
+            filename += ".mp4"
+        elif mime_type == "audio/mpeg" and not filename.lower().endswith(('.mp3', '.mpeg')):
+            filename += ".mp3"
+
+        return {
+            'message_id': message.id,
+            'file_key': cls.media_file_key(message.media),
+            'mime_type': mime_type,
+            'filename': filename,
+            **details
+        }
+
+    async def get_album_manifest(self, chat_id, message):
+        """
+        Манифест альбома: grouped_id -> упорядоченные ID сообщений и описания медиа.
+        Манифест кэшируется и используется всеми путями получения медиа.
+        """
+        key = (EntityCache.normalize_key(chat_id), message.grouped_id)
+        manifest = self.album_cache.get(key)
+        if manifest is not None:
+            logger.debug(f"Манифест альбома {message.grouped_id} взят из кэша")
+            return manifest
+
+        return await self._album_flight.run(
+            key, lambda: self._build_album_manifest(chat_id, message))
+
+    async def _build_album_manifest(self, chat_id, message):
+        """Находит части альбома одним запросом по явному окну ID"""
+        grouped_id = message.grouped_id
+
+        # В альбоме не больше ALBUM_MAX_ITEMS частей с последовательными ID,
+        # поэтому все соседи лежат в окне ±(ALBUM_MAX_ITEMS - 1) от любой из них
+        first_id = max(1, message.id - ALBUM_MAX_ITEMS + 1)
+        last_id = message.id + ALBUM_MAX_ITEMS - 1
+        window_ids = [i for i in range(first_id, last_id + 1) if i != message.id]
+
+        logger.debug(
+            f"Поиск частей альбома {grouped_id} по ID {first_id}-{last_id}")
+        async with self.pool.acquire(self.pool.owner_of(message)) as pooled:
+            entity = await self.get_entity(chat_id, pooled)
+            fetched = await pooled.call(
+                'get_messages', lambda: pooled.client.get_messages(entity, ids=window_ids))
+        by_id = {msg.id: msg for msg in fetched if msg}
+        by_id[message.id] = message
+
+        # Идем от исходного сообщения в обе стороны и останавливаемся на границе группы
+        members = [message]
+        for step in (-1, 1):
+            current_id = message.id + step
+            while first_id <= current_id <= last_id:
+                msg = by_id.get(current_id)
+                if msg is not None:
+                    if getattr(msg, 'grouped_id', None) != grouped_id:
+                        break
+                    members.append(msg)
+                current_id += step
+
+        members = [msg for msg in members if msg.media and self._is_supported_media(msg.media)]
+        members.sort(key=lambda msg: msg.id)
+
+        chat_key = EntityCache.normalize_key(chat_id)
+        for msg in members:
+            self.message_cache.set((chat_key, msg.id), msg)
+
+        manifest = {
+            'grouped_id': grouped_id,
+            'message_ids': [msg.id for msg in members],
+            'media': [self.describe_media(msg) for msg in members]
+        }
+        self.album_cache.set((chat_key, grouped_id), manifest)
+        logger.info(
+            f"Альбом {grouped_id}: найдено {len(members)} частей ({manifest['message_ids']})")
+        return manifest
+
+    async def get_media_messages(self, chat_id, message_id):
+        """
+        Упорядоченный список сообщений с медиа для поста:
+        части альбома или само сообщение, если альбома нет.
+        """
+        message = await self.get_message(chat_id, message_id)
+        if not message:
+            return []
+
+        if not getattr(message, 'grouped_id', None):
+            if message.media and self._is_supported_media(message.media):
+                return [message]
+            return []
+
+        manifest = await self.get_album_manifest(chat_id, message)
+
+        # Сообщения, вытесненные из кэша, дозапрашиваются одним вызовом
+        messages = await self.get_messages_batch(chat_id, manifest['message_ids'])
+        return [messages[msg_id] for msg_id in manifest['message_ids'] if messages.get(msg_id)]
+
+    async def get_media_descriptors(self, chat_id, message_id):
+        """Описания всех медиа поста (альбома) без скачивания файлов"""
+        message = await self.get_message(chat_id, message_id)
+        if not message:
+            return []
+
+        if getattr(message, 'grouped_id', None):
+            manifest = await self.get_album_manifest(chat_id, message)
+            return manifest['media']
+
+        if message.media and self._is_supported_media(message.media):
+            return [self.describe_media(message)]
+        return []
+
+    @staticmethod
+    def _media_photo(media):
+        """Фото из медиа сообщения (в т.ч. из превью веб-страницы) или None"""
+        if isinstance(media, MessageMediaPhoto):
+            return media.photo
+        if isinstance(media, MessageMediaWebPage):
+            return getattr(media.webpage, 'photo', None)
+        return None
+
+    @staticmethod
+    def _largest_photo_size(photo):
+        """Самый большой скачиваемый вариант фото - его же скачивает download_media"""
+        sizes = [size for size in getattr(photo, 'sizes', None) or []
+                 if isinstance(size, (PhotoSize, PhotoSizeProgressive))]
+        if not sizes:
+            return None
+        return max(sizes, key=utils._photo_size_byte_count)
+
+    @classmethod
+    def media_file_key(cls, media):
+        """
+        Ключ файла для кэша: id фото/документа в Telegram и вариант размера.
+        Не зависит от чата и сообщения, поэтому пересланное медиа дает тот же ключ.
+        """
+        photo = cls._media_photo(media)
+        if photo is not None:
+            largest = cls._largest_photo_size(photo)
+            return f"photo_{photo.id}_{largest.type}" if largest else None
+        document = getattr(media, 'document', None)
+        if document is not None:
+            return f"document_{document.id}"
+        return None
+
+    @classmethod
+    def _download_location(cls, media):
+        """
+        Возвращает (dc_id, InputFileLocation, размер) для скачивания медиа по частям.
+        Для фото выбирается самый большой вариант, как и в download_media.
+        """
+        photo = cls._media_photo(media)
+        if photo is not None:
+            largest = cls._largest_photo_size(photo)
+            if largest is None:
+                return None
+            location = InputPhotoFileLocation(
+                id=photo.id,
+                access_hash=photo.access_hash,
+                file_reference=photo.file_reference,
+                thumb_size=largest.type
+            )
+            return photo.dc_id, location, utils._photo_size_byte_count(largest)
+
+        document = getattr(media, 'document', None)
+        if document is None:
+            return None
+        dc_id, location = utils.get_input_location(document)
+        return dc_id, location, document.size
+
+    async def resolve_media(self, chat_id, message_id, index=0):
+        """
+        Находит медиа поста по индексу без скачивания.
+        Возвращает источник {'descriptor', 'dc_id', 'location', 'size'} или None.
+        """
+        media_messages = await self.get_media_messages(chat_id, message_id)
+        if index >= len(media_messages):
+            logger.warning(
+                f"Медиа с индексом {index} не найдено в сообщении {message_id} из {chat_id}")
+            return None
+
+        message = media_messages[index]
+        download_location = self._download_location(message.media)
+        if download_location is None:
+            logger.warning(f"Не удалось определить расположение файла для сообщения {message.id}")
+            return None
+
+        dc_id, location, file_size = download_location
+        descriptor = self.describe_media(message)
+        descriptor['size'] = file_size
+        return {
+            'pooled': self.pool.owner_of(message),
+            'descriptor': descriptor,
+            'dc_id': dc_id,
+            'location': location,
+            'size': file_size
+        }
+
+    async def resolve_photo_size(self, chat_id, message_id, index, min_width):
+        """
+        Источник для скачивания готового уменьшенного варианта фото (PhotoSize)
+        шириной не меньше min_width - без скачивания полного файла.
+        Возвращает None, если медиа не фото или подходящего варианта меньше оригинала нет.
+        """
+        media_messages = await self.get_media_messages(chat_id, message_id)
+        if index >= len(media_messages):
+            return None
+
+        message = media_messages[index]
+        photo = self._media_photo(message.media)
+        if photo is None:
+            return None
+        largest = self._largest_photo_size(photo)
+        sizes = [size for size in photo.sizes
+                 if isinstance(size, (PhotoSize, PhotoSizeProgressive))
+                 and size is not largest and size.w >= min_width]
+        if not sizes:
+            return None
+
+        size = min(sizes, key=lambda size: size.w)
+        location = InputPhotoFileLocation(
+            id=photo.id,
+            access_hash=photo.access_hash,
+            file_reference=photo.file_reference,
+            thumb_size=size.type
+        )
+        file_size = utils._photo_size_byte_count(size)
+        return {
+            'pooled': self.pool.owner_of(message),
+            'descriptor': {'mime_type': 'image/jpeg', 'width': size.w, 'height': size.h, 'size': file_size},
+            'dc_id': photo.dc_id,
+            'location': location,
+            'size': file_size
+        }
+
+    async def resolve_document_thumb(self, chat_id, message_id, index):
+        """
+        Источник для скачивания самой большой статичной миниатюры документа
+        (кадр-обложка видео) без скачивания самого файла.
+        Анимированные video_thumbs не используются. Возвращает None, если миниатюры нет.
+        """
+        media_messages = await self.get_media_messages(chat_id, message_id)
+        if index >= len(media_messages):
+            return None
+
+        document = getattr(media_messages[index].media, 'document', None)
+        if document is None:
+            return None
+        sizes = [size for size in getattr(document, 'thumbs', None) or []
+                 if isinstance(size, (PhotoSize, PhotoSizeProgressive))]
+        if not sizes:
+            return None
+
+        size = max(sizes, key=utils._photo_size_byte_count)
+        location = InputDocumentFileLocation(
+            id=document.id,
+            access_hash=document.access_hash,
+            file_reference=document.file_reference,
+            thumb_size=size.type
+        )
+        file_size = utils._photo_size_byte_count(size)
+        return {
+            'pooled': self.pool.owner_of(media_messages[index]),
+            'descriptor': {
+                'mime_type': 'image/jpeg',
+                'file_key': f"document_{document.id}_thumb_{size.type}",
+                'width': size.w,
+                'height': size.h,
+                'size': file_size
+            },
+            'dc_id': document.dc_id,
+            'location': location,
+            'size': file_size
+        }
+
+    async def iter_file(self, source, offset=0, length=None, chunk_size=MEDIA_CHUNK_SIZE):
+        """
+        Асинхронный генератор байтов файла в диапазоне [offset, offset + length).
+        Запросы к Telegram выравниваются по размеру части, лишние байты
+        в начале первой и в конце последней части отбрасываются.
+        """
+        file_size = source['size']
+        end = file_size if length is None else min(file_size, offset + length)
+        if offset >= end:
+            return
+
+        aligned_offset = offset - offset % chunk_size
+        skip = offset - aligned_offset
+        remaining = end - offset
+        parts = (end - aligned_offset + chunk_size - 1) // chunk_size
+
+        logger.debug(
+            f"Скачивание диапазона {offset}-{end - 1} из {file_size} байт: "
+            f"{parts} частей по {chunk_size} начиная с {aligned_offset}")
+
+        # Скачиваем тем же аккаунтом, которым получено сообщение
+        pooled = source.get('pooled') or self.pool.least_loaded()
+        await pooled.warm_dc(source['dc_id'])
+
+        parallel = PARALLEL_DOWNLOAD_WORKERS > 1 and end - aligned_offset >= PARALLEL_DOWNLOAD_MIN_SIZE
+        if parallel:
+            # Части параллельного скачивания сами проходят через планировщик
+            downloader = ParallelDownloader(pooled, source, part_size=chunk_size)
+            stream = downloader.iter_parts(aligned_offset, parts)
+        else:
+            stream = pooled.client.iter_download(
+                source['location'], offset=aligned_offset, limit=parts,
+                request_size=chunk_size, file_size=file_size, dc_id=source['dc_id'])
+
+        async with self.pool.acquire(pooled):
+            try:
+                while True:
+                    # Каждый запрос части проходит очередь планировщика и лимит частоты
+                    if not parallel:
+                        await pooled.scheduler.throttle('download')
+                    try:
+                        chunk = await stream.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except FloodWaitError as e:
+                        pooled.scheduler.note_flood(e.seconds, 'download')
+                        raise
+                    if skip:
+                        chunk = chunk[skip:]
+                        skip = 0
+                    if len(chunk) > remaining:
+                        chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                    if chunk:
+                        yield chunk
+                    if remaining <= 0:
+                        break
+            finally:
+                await close_download_iter(stream)
+
+    async def iter_media(self, chat_id, message_id, index=0, chunk_size=MEDIA_CHUNK_SIZE):
+        """
+        Потоковое получение медиафайла целиком.
+        Возвращает (описание медиа, асинхронный итератор частей файла) или None.
+        """
+        source = await self.resolve_media(chat_id, message_id, index)
+        if source is None:
+            return None
+
+        logger.debug(
+            f"Потоковое скачивание медиа {message_id}/{index} из {chat_id}: размер={source['size']}, DC={source['dc_id']}")
+        return source['descriptor'], self.iter_file(source, chunk_size=chunk_size)
+
+    async def get_media(self, chat_id, message_id, index=0):
+        """Получение медиафайла из сообщения"""
+        try:
+            media_messages = await self.get_media_messages(chat_id, message_id)
+            if not media_messages:
                 logger.warning(
                     f"Сообщение {message_id} из {chat_id} не содержит медиа")
                 return {'file_bytes': None, 'mime_type': None, 'filename': None}
+
+            # Проверяем, что индекс в пределах доступных медиа
+            if index >= len(media_messages):
+                logger.warning(
+                    f"Запрошенный индекс {index} превышает количество доступных медиафайлов {len(media_messages)}")
+                return {'file_bytes': None, 'mime_type': None, 'filename': None}
+
+            message = media_messages[index]
+            logger.debug(
+                f"Получение медиафайла для сообщения {message.id} из {chat_id}, индекс={index}")
+
+            # Скачиваем медиа в байты
+            try:
+                async with self.pool.acquire(self.pool.owner_of(message)) as pooled:
+                    file_bytes = await pooled.call(
+                        'download', lambda: pooled.client.download_media(message.media, bytes))
+            except Exception as e:
+                logger.error(f"Ошибка при скачивании медиа: {e}")
+                return {'file_bytes': None, 'mime_type': None, 'filename': None}
+
+            descriptor = self.describe_media(message)
+            logger.debug(
+                f"Медиафайл получен, размер={len(file_bytes) if file_bytes else 0} байт, тип={descriptor['mime_type']}, имя={descriptor['filename']}")
+            return {
+                'file_bytes': file_bytes,
+                'mime_type': descriptor['mime_type'],
+                'filename': descriptor['filename']
+            }
         except Exception as e:
             logger.error(
                 f"Ошибка при получении медиафайла для сообщения {message_id} из {chat_id}: {e}")
             return {'file_bytes': None, 'mime_type': None, 'filename': None}
 
+    async def _download_media_item(self, msg, position, total, semaphore):
+        """Скачивает одно медиа альбома; ошибки не выходят за пределы элемента"""
+        async with semaphore:
+            try:
+                logger.info(f"Обработка медиа #{position}/{total} (ID: {msg.id})")
+
+                descriptor = self.describe_media(msg)
+                file_key = descriptor['file_key']
+                entry = media_cache.get_entry('media', file_key) if file_key else None
+                if entry:
+                    # Этот файл уже скачан - через этот или другой пост
+                    try:
+                        file_bytes = await media_cache.read_small(entry)
+                        if file_bytes is None:
+                            # Большой файл читается в потоке кэша, не блокируя цикл событий
+                            file_bytes = await asyncio.get_running_loop().run_in_executor(
+                                cache_io_executor, media_cache.read_entry, entry)
+                        media_cache.touch(entry)
+                        logger.info(f"Медиа #{position} взято из кэша: {descriptor['filename']}, размер={len(file_bytes)} байт")
+                        return {
+                            'file_bytes': file_bytes,
+                            'mime_type': descriptor['mime_type'],
+                            'filename': descriptor['filename']
+                        }
+                    except FileNotFoundError:
+                        media_cache.invalidate(entry)
+
+                # Прямое скачивание медиа через Telethon в уникальный временный путь
+                file_path = os.path.join(tempfile.gettempdir(), f"temp_media_{msg.id}_{uuid.uuid4().hex}")
+                logger.debug(f"Начинаю скачивание медиа #{position} в файл {file_path}")
+                try:
+                    download_location = self._download_location(msg.media)
+                    async with self.pool.acquire(self.pool.owner_of(msg)) as pooled:
+                        if (PARALLEL_DOWNLOAD_WORKERS > 1 and download_location
+                                and download_location[2] >= PARALLEL_DOWNLOAD_MIN_SIZE):
+                            # Большие файлы качаем параллельно по частям
+                            dc_id, location, size = download_location
+                            downloader = ParallelDownloader(
+                                pooled, {'dc_id': dc_id, 'location': location, 'size': size})
+                            await downloader.download_to_file(file_path)
+                            downloaded_file = file_path
+                        else:
+                            downloaded_file = await pooled.call(
+                                'download', lambda: pooled.client.download_media(msg.media, file_path))
+                    logger.debug(f"Результат скачивания: {downloaded_file}")
+
+                    if not downloaded_file:
+                        logger.warning(f"Telethon вернул пустой результат для медиа #{position}")
+                        return None
+
+                    if not os.path.exists(downloaded_file):
+                        logger.error(f"Файл {downloaded_file} не существует после скачивания!")
+                        return None
+
+                    file_size = os.path.getsize(downloaded_file)
+                    logger.debug(f"Размер скачанного файла: {file_size} байт")
+
+                    if file_size == 0:
+                        logger.warning(f"Скачанный файл имеет нулевой размер")
+                        os.remove(downloaded_file)
+                        return None
+                except TypeError as type_error:
+                    logger.error(f"Ошибка типа при скачивании медиа #{position}: {type_error}", exc_info=True)
+                    logger.error(f"Тип медиа: {type(msg.media)}")
+                    return None
+                except Exception as download_error:
+                    logger.error(f"Ошибка при скачивании медиа #{position}: {download_error}", exc_info=True)
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    return None
+
+                # Читаем файл в память и удаляем временный файл
+                with open(downloaded_file, 'rb') as f:
+                    file_bytes = f.read()
+
+                try:
+                    os.remove(downloaded_file)
+                except Exception as e:
+                    logger.warning(f"Не удалось удалить временный файл {downloaded_file}: {e}")
+
+                if file_key:
+                    meta_to_save = {'mime_type': descriptor['mime_type'], 'original_filename': descriptor['filename']}
+                    await media_cache.write('media', file_key, file_bytes, meta_to_save)
+
+                logger.info(f"Успешно добавлено медиа #{position}: {descriptor['filename']}, размер={len(file_bytes)} байт")
+                return {
+                    'file_bytes': file_bytes,
+                    'mime_type': descriptor['mime_type'],
+                    'filename': descriptor['filename']
+                }
+
+            except Exception as e:
+                logger.error(f"Ошибка при обработке медиа #{position} (ID: {msg.id}): {e}", exc_info=True)
+                return None
+
     async def get_messages_with_media(self, chat_id, message_id):
         """
         Получение всех медиафайлов из сообщения или альбома.
+        Части альбома скачиваются параллельно (не более ALBUM_DOWNLOAD_CONCURRENCY
+        одновременно), результат возвращается в порядке альбома.
         Возвращает список словарей с медиафайлами или пустой список, если медиа нет.
         """
         try:
@@ -359,276 +1122,22 @@ class TelegramService:
             if not self.is_initialized:
                 logger.info("Инициализация клиента перед получением медиа")
                 await self.init()
-            
-            message = await self.get_message(chat_id, message_id)
-            if not message:
-                logger.error(f"Не удалось получить сообщение {message_id} из {chat_id}")
+
+            media_messages = await self.get_media_messages(chat_id, message_id)
+            if not media_messages:
+                logger.info(f"Сообщение {message_id} из {chat_id} не содержит медиа")
                 return []
-            
-            results = []
-            logger.info(f"Начинаю скачивание медиа из сообщения {message_id} канала {chat_id}")
-
-            # Проверяем, является ли сообщение частью альбома
-            if hasattr(message, 'grouped_id') and message.grouped_id:
-                entity = await self.get_entity(chat_id)
-                grouped_id = message.grouped_id
-                
-                logger.info(f"Обнаружен альбом с ID={grouped_id} для сообщения {message_id}")
-                
-                try:
-                    # Получаем все сообщения в альбоме с более широким диапазоном
-                    # Увеличим диапазон ID еще больше для надежности
-                    min_search_id = message_id - 200
-                    max_search_id = message_id + 200
-                    logger.debug(f"Поиск сообщений альбома в диапазоне ID: {min_search_id} - {max_search_id}")
-                    
-                    all_messages_in_range = await self.client.get_messages(
-                        entity,
-                        min_id=min_search_id,
-                        max_id=max_search_id
-                    )
-                    
-                    if not all_messages_in_range:
-                        logger.warning(f"В диапазоне {min_search_id}-{max_search_id} не найдено сообщений")
-                        return []
-                    
-                    logger.debug(f"Найдено {len(all_messages_in_range)} сообщений в диапазоне для альбома {grouped_id}")
-                    
-                    # Фильтруем только сообщения альбома с медиа
-                    album_messages = []
-                    for msg in all_messages_in_range:
-                        if hasattr(msg, 'grouped_id') and msg.grouped_id == grouped_id and hasattr(msg, 'media') and msg.media:
-                            album_messages.append(msg)
-                            logger.debug(f"  -> Найдено сообщение {msg.id} из альбома {grouped_id}")
-                        else:
-                            logger.debug(f"  -> Сообщение {msg.id} не принадлежит альбому {grouped_id} или не содержит медиа (Grouped ID: {getattr(msg, 'grouped_id', 'N/A')}, Has Media: {hasattr(msg, 'media') and msg.media is not None})")
-                    
-                    if not album_messages:
-                        logger.warning(f"Не найдено сообщений, принадлежащих альбому {grouped_id} с медиа в диапазоне")
-                        return []
-                    
-                    # Сортируем по ID для стабильного порядка
-                    album_messages.sort(key=lambda msg: msg.id)
-                    
-                    logger.info(f"Отфильтровано {len(album_messages)} сообщений с медиа для альбома {grouped_id}")
-                    
-                    # Обрабатываем каждое сообщение в альбоме
-                    for i, msg in enumerate(album_messages):
-                        try:
-                            logger.info(f"Обработка сообщения #{i+1}/{len(album_messages)} из альбома {grouped_id} (ID: {msg.id})")
-                            
-                            # Проверка наличия и типа медиа
-                            if not hasattr(msg, 'media') or msg.media is None:
-                                logger.warning(f"Сообщение {msg.id} не содержит медиа")
-                                continue
-                                
-                            # Проверка поддерживаемых типов медиа
-                            media_supported = (
-                                isinstance(msg.media, MessageMediaPhoto) or
-                                hasattr(msg.media, 'document') or
-                                (isinstance(msg.media, MessageMediaWebPage) and 
-                                hasattr(msg.media.webpage, 'photo'))
-                            )
-                            
-                            if not media_supported:
-                                logger.warning(f"Неподдерживаемый тип медиа в сообщении {msg.id}: {type(msg.media)}")
-                                continue
-                            
-                            # Прямое скачивание медиа через Telethon в абсолютный временный путь
-                            file_path = os.path.join(tempfile.gettempdir(), f"temp_media_{msg.id}")
-                            logger.debug(f"Начинаю скачивание медиа #{i+1} в файл {file_path}")
-                            try:
-                                downloaded_file = await self.client.download_media(msg.media, file_path)
-                                logger.debug(f"Результат скачивания: {downloaded_file}")
-                                
-                                if not downloaded_file:
-                                    logger.warning(f"Telethon вернул пустой результат для медиа #{i+1}")
-                                    continue
-                                
-                                logger.debug(f"Файл сохранен во временный путь: {downloaded_file}, проверяю существование")
-                                
-                                if not os.path.exists(downloaded_file):
-                                    logger.error(f"Файл {downloaded_file} не существует после скачивания!")
-                                    continue
-                                
-                                file_size = os.path.getsize(downloaded_file)
-                                logger.debug(f"Размер скачанного файла: {file_size} байт")
-                                
-                                if file_size == 0:
-                                    logger.warning(f"Скачанный файл имеет нулевой размер")
-                                    continue
-                            except TypeError as type_error:
-                                logger.error(f"Ошибка типа при скачивании медиа #{i+1}: {type_error}", exc_info=True)
-                                logger.error(f"Тип медиа: {type(msg.media)}")
-                                continue
-                            except Exception as download_error:
-                                logger.error(f"Ошибка при скачивании медиа #{i+1}: {download_error}", exc_info=True)
-                                continue
-                            
-                            # Читаем файл в память и удаляем временный файл
-                            with open(downloaded_file, 'rb') as f:
-                                file_bytes = f.read()
-                            
-                            try:
-                                os.remove(downloaded_file)
-                            except Exception as e:
-                                logger.warning(f"Не удалось удалить временный файл {downloaded_file}: {e}")
-                            
-                            # Определяем тип файла и имя
-                            mime_type = "application/octet-stream"
-                            filename = os.path.basename(downloaded_file)
-                            
-                            # Уточняем тип и имя файла на основе медиа
-                            if isinstance(msg.media, MessageMediaPhoto):
-                                mime_type = "image/jpeg"
-                                filename = f"photo_{msg.id}.jpg"
-                            
-                            elif hasattr(msg.media, 'document'):
-                                document = msg.media.document
-                                
-                                # Получаем MIME-тип
-                                if hasattr(document, 'mime_type') and document.mime_type:
-                                    mime_type = document.mime_type
-                                
-                                # Ищем имя файла в атрибутах
-                                filename_found = False
-                                for attr in document.attributes:
-                                    if isinstance(attr, DocumentAttributeFilename):
-                                        filename = attr.file_name
-                                        filename_found = True
-                                        break
-                                
-                                # Если имя не найдено, создаем на основе типа
-                                if not filename_found:
-                                    if mime_type.startswith('video/'):
-                                        filename = f"video_{msg.id}.mp4"
-                                    elif mime_type.startswith('image/'):
-                                        filename = f"image_{msg.id}.jpg"
-                                    else:
-                                        filename = f"file_{msg.id}"
-                            
-                            # Добавляем расширение, если его нет
-                            if '.' not in filename:
-                                if mime_type == "image/jpeg":
-                                    filename += ".jpg"
-                                elif mime_type == "video/mp4":
-                                    filename += ".mp4"
-                            
-                            # Создаем и добавляем запись о медиа
-                            media_item = {
-                                'file_bytes': file_bytes,
-                                'mime_type': mime_type,
-                                'filename': filename
-                            }
-                            
-                            results.append(media_item)
-                            logger.info(f"Успешно добавлено медиа #{i+1} из альбома: {filename}, размер={len(file_bytes)} байт")
-                        
-                        except Exception as e:
-                            logger.error(f"Ошибка при обработке медиа #{i+1} из альбома {grouped_id}: {e}", exc_info=True)
-                
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке альбома {grouped_id}: {e}", exc_info=True)
-            
-            elif message.media:
-                # Одиночное медиа
-                logger.info(f"Обнаружено одиночное медиа в сообщении {message_id}")
-                
-                try:
-                    # Проверка типа медиа
-                    media_supported = (
-                        isinstance(message.media, MessageMediaPhoto) or
-                        hasattr(message.media, 'document') or
-                        (isinstance(message.media, MessageMediaWebPage) and 
-                        hasattr(message.media.webpage, 'photo'))
-                    )
-                    
-                    if not media_supported:
-                        logger.warning(f"Неподдерживаемый тип медиа в сообщении {message_id}: {type(message.media)}")
-                        return []
-                    
-                    # Скачиваем во временный файл для надежности, используя абсолютный путь
-                    file_path = os.path.join(tempfile.gettempdir(), f"temp_media_{message_id}")
-                    logger.debug(f"Начинаю скачивание одиночного медиа в файл {file_path}")
-                    try:
-                        downloaded_file = await self.client.download_media(message.media, file_path)
-                        logger.debug(f"Результат скачивания: {downloaded_file}")
-                        
-                        if not downloaded_file:
-                            logger.warning(f"Не удалось скачать медиа из сообщения {message_id}")
-                            return []
-                        
-                        logger.debug(f"Медиа сохранено во временный файл: {downloaded_file}, проверяю существование")
-                        
-                        if not os.path.exists(downloaded_file):
-                            logger.error(f"Файл {downloaded_file} не существует после скачивания!")
-                            return []
-                        
-                        file_size = os.path.getsize(downloaded_file)
-                        logger.debug(f"Размер скачанного файла: {file_size} байт")
-                        
-                        if file_size == 0:
-                            logger.warning(f"Скачанный файл имеет нулевой размер")
-                            return []
-                    except TypeError as type_error:
-                        logger.error(f"Ошибка типа при скачивании медиа: {type_error}", exc_info=True)
-                        logger.error(f"Тип медиа: {type(message.media)}")
-                        return []
-                    except Exception as download_error:
-                        logger.error(f"Ошибка при скачивании одиночного медиа: {download_error}", exc_info=True)
-                        return []
-                    
-                    # Читаем файл в память
-                    with open(downloaded_file, 'rb') as f:
-                        file_bytes = f.read()
-                    
-                    # Удаляем временный файл
-                    try:
-                        os.remove(downloaded_file)
-                    except Exception as e:
-                        logger.warning(f"Не удалось удалить временный файл {downloaded_file}: {e}")
-                    
-                    # Определяем тип и имя
-                    mime_type = "application/octet-stream"
-                    filename = os.path.basename(downloaded_file)
-                    
-                    if isinstance(message.media, MessageMediaPhoto):
-                        mime_type = "image/jpeg"
-                        filename = f"photo_{message_id}.jpg"
-                    
-                    elif hasattr(message.media, 'document'):
-                        document = message.media.document
-                        
-                        if hasattr(document, 'mime_type') and document.mime_type:
-                            mime_type = document.mime_type
-                        
-                        for attr in document.attributes:
-                            if isinstance(attr, DocumentAttributeFilename):
-                                filename = attr.file_name
-                                break
-                        
-                        # Используем тип для определения имени, если имя не найдено
-                        if filename == os.path.basename(downloaded_file):
-                            if mime_type.startswith('video/'):
-                                filename = f"video_{message_id}.mp4"
-                            elif mime_type.startswith('image/'):
-                                filename = f"image_{message_id}.jpg"
-                    
-                    # Добавляем медиа в результаты
-                    media_item = {
-                        'file_bytes': file_bytes,
-                        'mime_type': mime_type,
-                        'filename': filename
-                    }
-                    
-                    results.append(media_item)
-                    logger.info(f"Успешно добавлено одиночное медиа: {filename}, размер={len(file_bytes)} байт")
-                
-                except Exception as e:
-                    logger.error(f"Ошибка при скачивании одиночного медиа из сообщения {message_id}: {e}", exc_info=True)
-            
-            else:
-                logger.info(f"Сообщение {message_id} не содержит медиа")
+
+            logger.info(
+                f"Начинаю скачивание {len(media_messages)} медиа из сообщения {message_id} канала {chat_id}")
+
+            semaphore = asyncio.Semaphore(ALBUM_DOWNLOAD_CONCURRENCY)
+            total = len(media_messages)
+            downloaded = await asyncio.gather(*[
+                self._download_media_item(msg, i + 1, total, semaphore)
+                for i, msg in enumerate(media_messages)
+            ])
+            results = [item for item in downloaded if item]
 
             logger.info(f"Завершено получение медиа-файлов. Всего получено: {len(results)} файлов")
             return results
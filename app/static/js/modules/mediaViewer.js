@@ -210,21 +210,26 @@ export function loadMedia(index) {
     if (isVideo) {
       mediaElement = document.createElement("video");
       mediaElement.className = "media-element lazy-load-media";
-      mediaElement.dataset.src = `/media/${chatId}/${messageId}/${index}?_nocache=${Date.now()}&type=video&album=1`;
+      mediaElement.dataset.src = `/media/${chatId}/${messageId}/${index}?type=video&album=1`;
       mediaElement.dataset.index = index;
       mediaElement.controls = true;
-      mediaElement.preload = "metadata";
+      // Видео не скачивается до нажатия play, до этого показывается обложка
+      mediaElement.preload = "none";
       mediaElement.playsInline = true;
       mediaElement.autoplay = false;
+      applyPlaceholder(mediaElement, mediaItem, mediaContainer, loaderElement);
       console.log(
         `Создан элемент видео для lazy loading с индексом ${index}: data-src=${mediaElement.dataset.src}`
       );
     } else if (isImage) {
       mediaElement = document.createElement("img");
       mediaElement.className = "media-element lazy-load-media";
-      mediaElement.dataset.src = `/media/${chatId}/${messageId}/${index}?_nocache=${Date.now()}&album=1`;
+      mediaElement.dataset.src = `/media/${chatId}/${messageId}/${index}?album=1`;
+      if (mediaItem.srcset) {
+        mediaElement.dataset.srcset = mediaItem.srcset;
+      }
       mediaElement.dataset.index = index;
-      mediaElement.src = placeholderSrc;
+      applyPlaceholder(mediaElement, mediaItem, mediaContainer, loaderElement);
       mediaElement.alt = "Фото";
       console.log(
         `Создан элемент фото для lazy loading с индексом ${index}: data-src=${mediaElement.dataset.src}`
@@ -245,21 +250,25 @@ export function loadMedia(index) {
       ) {
         mediaElement = document.createElement("video");
         mediaElement.className = "media-element lazy-load-media";
-        mediaElement.dataset.src = `/media/${chatId}/${messageId}/${index}?_nocache=${Date.now()}&type=video&doc=1`;
+        mediaElement.dataset.src = `/media/${chatId}/${messageId}/${index}?type=video&doc=1`;
         mediaElement.dataset.index = index;
         mediaElement.controls = true;
-        mediaElement.preload = "metadata";
+        mediaElement.preload = "none";
         mediaElement.playsInline = true;
         mediaElement.autoplay = false;
+        applyPlaceholder(mediaElement, mediaItem, mediaContainer, loaderElement);
         console.log(
           `Документ является видео: ${filename}, отображаем как видео (lazy loading) с индексом ${index}`
         );
       } else if (isImageExt || isImageMime) {
         mediaElement = document.createElement("img");
         mediaElement.className = "media-element lazy-load-media";
-        mediaElement.dataset.src = `/media/${chatId}/${messageId}/${index}?_nocache=${Date.now()}`;
+        mediaElement.dataset.src = `/media/${chatId}/${messageId}/${index}`;
+        if (mediaItem.srcset) {
+          mediaElement.dataset.srcset = mediaItem.srcset;
+        }
         mediaElement.dataset.index = index;
-        mediaElement.src = placeholderSrc;
+        applyPlaceholder(mediaElement, mediaItem, mediaContainer, loaderElement);
         mediaElement.alt = "Фото";
         console.log(
           `Документ является изображением: ${filename}, отображаем как фото (lazy loading) с индексом ${index}`
@@ -272,7 +281,7 @@ export function loadMedia(index) {
            <div class="document-name">${
              mediaItem.filename || mediaItem.name || "Документ"
            }</div>
-           <a href="/media/${chatId}/${messageId}/${index}?_nocache=${Date.now()}" 
+           <a href="/media/${chatId}/${messageId}/${index}" 
               class="document-download" download="${
                 mediaItem.filename || mediaItem.name || "document"
               }">
@@ -720,6 +729,34 @@ function setupMediaObserver() {
   mediaObserver = new IntersectionObserver(handleMediaIntersection, options);
 }
 
+// Заглушка до загрузки файла: размытое превью из поста (stripped thumb Telegram)
+// и заранее заданные размеры, чтобы после загрузки разметка не сдвигалась
+function applyPlaceholder(element, mediaItem, container, loader) {
+  const width = Number(mediaItem.width);
+  const height = Number(mediaItem.height);
+  if (width > 0 && height > 0) {
+    // С srcset фото показывается шириной блока медиа, без него - в исходном размере
+    const blockWidth = container ? container.clientWidth : 0;
+    const displayWidth =
+      element.dataset.srcset && blockWidth > 0 ? blockWidth : width;
+    element.width = Math.round(displayWidth);
+    element.height = Math.round((displayWidth * height) / width);
+  }
+
+  if (element.tagName === "VIDEO") {
+    // Обложка с сервера (миниатюра документа), пока ее нет - встроенное превью
+    const poster = mediaItem.poster || mediaItem.placeholder;
+    if (poster) element.poster = poster;
+  } else if (mediaItem.placeholder) {
+    element.src = mediaItem.placeholder;
+    element.classList.add("is-placeholder");
+  } else {
+    element.src = placeholderSrc;
+    return;
+  }
+  if (loader && mediaItem.placeholder) loader.classList.add("over-placeholder");
+}
+
 function handleMediaIntersection(entries, observer) {
   console.log(
     `IntersectionObserver Callback Fired! Entries count: ${entries.length}`
@@ -744,6 +781,7 @@ function handleMediaIntersection(entries, observer) {
       const onMediaLoaded = () => {
         console.log(`Медиа #${index} (${element.tagName}) загрузило размеры.`);
         if (loader) loader.classList.add("fade-out"); // Плавно убираем лоадер
+        element.classList.remove("is-placeholder");
 
         // Удаляем обработчики, чтобы не сработали повторно
         element.onload = null;
@@ -790,10 +828,21 @@ function handleMediaIntersection(entries, observer) {
         element.onerror = onMediaError;
       }
 
-      // Запускаем загрузку
+      // Запускаем загрузку. Для фото браузер выбирает из srcset вариант
+      // под ширину блока медиа, а не полноразмерный файл
+      if (element.tagName === "IMG" && element.dataset.srcset) {
+        const blockWidth = mediaContainer ? mediaContainer.clientWidth : 0;
+        element.sizes = blockWidth > 0 ? `${blockWidth}px` : "100vw";
+        element.srcset = element.dataset.srcset;
+      }
       element.src = element.dataset.src;
       if (element.tagName === "VIDEO") {
         element.load(); // Для видео нужно вызвать load()
+        if (element.preload === "none") {
+          // Метаданные придут только после play: размеры уже заданы, показываем обложку
+          onMediaLoaded();
+          element.onerror = onMediaError;
+        }
       }
 
       // Перестаем наблюдать за этим элементом
@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """LRU-кэш в памяти с ограничением по числу записей и временем жизни"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает значение по ключу и отмечает его как недавно использованное"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Сохраняет значение; при переполнении вытесняет самые старые записи"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and (item[0] is None or item[0] >= time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика попаданий и промахов"""
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом:
+    все ожидающие получают результат одного общего запроса.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.calls += 1
+        task = asyncio.ensure_future(factory())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._forget(key, t))
+        # shield: отмена одного из ожидающих не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    async def join(self, key: Hashable, default: Any = None) -> Any:
+        """Дожидается уже идущего запроса с этим ключом; если его нет, возвращает default"""
+        task = self._inflight.get(key)
+        if task is None:
+            return default
+        self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Помечаем исключение как полученное, даже если все ожидающие ушли
+            task.exception()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'inflight': len(self._inflight),
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+        }
+
+
+class ByteLRUCache:
+    """
+    LRU-кэш байтовых объектов в памяти с ограничением по суммарному размеру.
+    Объекты больше max_item_size не сохраняются. Потокобезопасен:
+    заполняется и из пула потоков записи кэша.
+    """
+
+    def __init__(self, max_bytes: int, max_item_size: int):
+        self.max_bytes = max_bytes
+        self.max_item_size = max_item_size
+        self._data = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def fits(self, size: int) -> bool:
+        return 0 < size <= min(self.max_item_size, self.max_bytes)
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set(self, key: Hashable, data: bytes):
+        if not self.fits(len(data)):
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def _pop(self, key: Hashable) -> Optional[bytes]:
+        data = self._data.pop(key, None)
+        if data is not None:
+            self.bytes -= len(data)
+        return data
+
+    def pop(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            return self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': len(self._data),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -1,9 +1,10 @@
 import logging
 import asyncio
 import os
+import sys
 from telethon import TelegramClient
 from telethon.errors import SessionPasswordNeededError
-from config.settings import API_ID, API_HASH, SESSION_PATH, TELEGRAM_SESSION
+from config.settings import API_ID, API_HASH, SESSION_PATH, SESSION_PATHS, TELEGRAM_SESSION
 
 # Настройка логирования
 logging.basicConfig(
@@ -13,11 +14,12 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def login_to_telegram():
+async def login_to_telegram(session_path=SESSION_PATH):
     """Авторизация в Telegram и сохранение сессии"""
+    client = None
     try:
-        logger.info("Запуск процесса авторизации в Telegram...")
-        client = TelegramClient(SESSION_PATH, API_ID, API_HASH)
+        logger.info(f"Запуск процесса авторизации в Telegram для сессии {session_path}...")
+        client = TelegramClient(session_path, API_ID, API_HASH)
         await client.connect()
 
         # Проверяем, авторизован ли пользователь
@@ -53,7 +55,7 @@ async def login_to_telegram():
             f"Успешная авторизация как: {me.first_name} {getattr(me, 'last_name', '')} (@{me.username})")
 
         # Проверка создания файла сессии
-        session_file = f"{SESSION_PATH}.session"
+        session_file = f"{session_path}.session"
         if os.path.exists(session_file):
             logger.info(f"Файл сессии создан: {session_file}")
         else:
@@ -72,9 +74,16 @@ async def login_to_telegram():
             pass
 
 
+async def login_all(session_paths):
+    """Последовательная авторизация всех сессий пула"""
+    for session_path in session_paths:
+        await login_to_telegram(session_path)
+
+
 if __name__ == "__main__":
     try:
-        asyncio.run(login_to_telegram())
+        # python auth.py [сессия ...] - по умолчанию авторизуются все сессии из SESSION_PATHS
+        asyncio.run(login_all(sys.argv[1:] or SESSION_PATHS))
     except KeyboardInterrupt:
         logger.info("Операция отменена пользователем.")
     except Exception as e:
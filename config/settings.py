@@ -26,10 +26,121 @@ API_ID = int(os.getenv('API_ID', 0))
 API_HASH = os.getenv('API_HASH', '')
 SESSION_PATH = os.getenv('SESSION_PATH', 'tele_session')
 TELEGRAM_SESSION = BASE_DIR / SESSION_PATH
+# Пул сессий: несколько авторизованных аккаунтов через запятую (по умолчанию только SESSION_PATH)
+SESSION_PATHS = [path.strip() for path in os.getenv('SESSION_PATHS', SESSION_PATH).split(',') if path.strip()]
+# DC, соединения с которыми для скачивания медиа открываются заранее (например, "1,2,4,5")
+MEDIA_DC_IDS = [int(dc_id) for dc_id in os.getenv('MEDIA_DC_IDS', '').split(',') if dc_id.strip()]
 
-# Кеширование
-CACHE_DIR = BASE_DIR / 'app' / 'cache'
-CACHE_EXPIRY = 3600  # Время жизни кеша в секундах
+# Кеширование медиа и фото каналов на диске
+CACHE_DIR = Path(os.getenv('CACHE_DIR', BASE_DIR / 'app' / 'media_cache'))
+# Время жизни файла в кэше с момента последнего обращения, секунд
+CACHE_EXPIRY = int(os.getenv('CACHE_EXPIRY', 7 * 24 * 3600))
+# Время жизни связи "медиа поста -> файл Telegram" (сек); не зависит от вытеснения самих файлов
+CACHE_REF_TTL = int(os.getenv('CACHE_REF_TTL', 30 * 24 * 3600))
+# Максимальный объем кэша на диске (байт); при превышении вытесняются редко используемые файлы
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 10 * 1024 ** 3))
+# Политика вытеснения: lru (давно не использованные) или lfu (редко используемые)
+CACHE_EVICTION_POLICY = os.getenv('CACHE_EVICTION_POLICY', 'lru').lower()
+# Период запуска фоновой очистки кэша, секунд
+CACHE_JANITOR_INTERVAL = int(os.getenv('CACHE_JANITOR_INTERVAL', 300))
+# Запись в кэш: число потоков и лимиты очереди отложенной записи
+CACHE_WRITE_WORKERS = int(os.getenv('CACHE_WRITE_WORKERS', 2))
+CACHE_WRITE_QUEUE_BYTES = int(os.getenv('CACHE_WRITE_QUEUE_BYTES', 64 * 1024 * 1024))
+CACHE_WRITE_QUEUE_SIZE = int(os.getenv('CACHE_WRITE_QUEUE_SIZE', 100))
+# Горячий уровень кэша в памяти для фото каналов и небольших медиа
+CACHE_MEMORY_BYTES = int(os.getenv('CACHE_MEMORY_BYTES', 64 * 1024 * 1024))
+# Объекты больше этого размера (байт) в памяти не хранятся
+CACHE_MEMORY_MAX_OBJECT = int(os.getenv('CACHE_MEMORY_MAX_OBJECT', 512 * 1024))
+# Проверять контрольные суммы всех файлов кэша при старте (медленно на больших кэшах)
+CACHE_VERIFY_CHECKSUMS = os.getenv('CACHE_VERIFY_CHECKSUMS', 'False').lower() in ('true', '1', 't')
+# Хранение небольших файлов кэша в общих файлах-сегментах вместо отдельного файла на каждый
+CACHE_SEGMENTS = os.getenv('CACHE_SEGMENTS', 'False').lower() in ('true', '1', 't')
+# Файлы не больше этого размера (байт) пишутся в сегменты
+CACHE_SEGMENT_MAX_OBJECT = int(os.getenv('CACHE_SEGMENT_MAX_OBJECT', 256 * 1024))
+# Размер сегмента, после которого начинается новый (байт)
+CACHE_SEGMENT_BYTES = int(os.getenv('CACHE_SEGMENT_BYTES', 256 * 1024 * 1024))
+# Доля удаленных данных в сегменте, при которой он переписывается
+CACHE_SEGMENT_COMPACT_RATIO = float(os.getenv('CACHE_SEGMENT_COMPACT_RATIO', 0.5))
+# HTTP-кэширование в браузере: медиа поста не меняется, фото канала может смениться
+MEDIA_HTTP_MAX_AGE = int(os.getenv('MEDIA_HTTP_MAX_AGE', 365 * 24 * 3600))  # секунд
+CHANNEL_PHOTO_HTTP_MAX_AGE = int(os.getenv('CHANNEL_PHOTO_HTTP_MAX_AGE', 24 * 3600))  # секунд
+
+# Кэш разрешенных сущностей Telegram (каналы/пользователи)
+ENTITY_CACHE_PATH = BASE_DIR / os.getenv('ENTITY_CACHE_PATH', 'entity_cache.sqlite')
+ENTITY_CACHE_SIZE = int(os.getenv('ENTITY_CACHE_SIZE', 1024))
+ENTITY_CACHE_TTL = int(os.getenv('ENTITY_CACHE_TTL', 86400))  # секунд
+
+# Кратковременный кэш полученных сообщений
+MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE', 512))
+MESSAGE_CACHE_TTL = int(os.getenv('MESSAGE_CACHE_TTL', 60))  # секунд
+
+# Кэш отрицательных ответов Telegram: удаленные сообщения, несуществующие каналы, каналы без фото.
+# Временные ошибки (сеть, FloodWait) в него не попадают
+NEGATIVE_CACHE_SIZE = int(os.getenv('NEGATIVE_CACHE_SIZE', 4096))
+NEGATIVE_CACHE_TTL = int(os.getenv('NEGATIVE_CACHE_TTL', 60))  # секунд
+
+# Кэш готовых постов (HTML, список медиа, информация о канале); сбрасывается при редактировании поста
+POST_CACHE_SIZE = int(os.getenv('POST_CACHE_SIZE', 512))
+POST_CACHE_TTL = int(os.getenv('POST_CACHE_TTL', 3600))  # секунд
+
+# Кэш манифестов альбомов (grouped_id -> ID сообщений и описания медиа)
+ALBUM_CACHE_SIZE = int(os.getenv('ALBUM_CACHE_SIZE', 256))
+ALBUM_CACHE_TTL = int(os.getenv('ALBUM_CACHE_TTL', 3600))  # секунд
+
+# Размер части при потоковом скачивании медиа (кратен 4 КБ, максимум 512 КБ)
+MEDIA_CHUNK_SIZE = int(os.getenv('MEDIA_CHUNK_SIZE', 512 * 1024))
+
+# Сколько частей альбома скачивается одновременно
+ALBUM_DOWNLOAD_CONCURRENCY = int(os.getenv('ALBUM_DOWNLOAD_CONCURRENCY', 4))
+
+# Параллельное скачивание больших файлов по частям
+PARALLEL_DOWNLOAD_WORKERS = int(os.getenv('PARALLEL_DOWNLOAD_WORKERS', 4))
+PARALLEL_DOWNLOAD_MIN_SIZE = int(os.getenv('PARALLEL_DOWNLOAD_MIN_SIZE', 8 * 1024 * 1024))  # байт
+# Число отдельных соединений с DC файла на сессию, по которым распределяются части;
+# 0 - все части идут через основное соединение клиента
+PARALLEL_DOWNLOAD_SENDERS = int(os.getenv('PARALLEL_DOWNLOAD_SENDERS', 4))
+
+# Фоновая предзагрузка медиа поста в кэш при открытии страницы поста
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'True').lower() in ('true', '1', 't')
+# Предзагружаются только изображения: видео и документы страница загружает лишь по запросу пользователя.
+# Изображения больше этого размера (байт) не предзагружаются
+PREFETCH_MAX_BYTES = int(os.getenv('PREFETCH_MAX_BYTES', 5 * 1024 * 1024))
+# Сколько байт всего предзагружается для одного поста (0 - без ограничения); медиа берутся по порядку
+PREFETCH_POST_MAX_BYTES = int(os.getenv('PREFETCH_POST_MAX_BYTES', 10 * 1024 * 1024))
+# Сколько файлов предзагружается одновременно
+PREFETCH_CONCURRENCY = int(os.getenv('PREFETCH_CONCURRENCY', 2))
+# Запрос медиа дожидается идущей предзагрузки только для файлов не больше этого размера (байт);
+# большие файлы отдаются потоком сразу, с поддержкой Range
+PREFETCH_JOIN_MAX_BYTES = int(os.getenv('PREFETCH_JOIN_MAX_BYTES', 1024 * 1024))
+
+# Уменьшенные варианты изображений (/media/...?w=ширина&q=качество)
+# Запрошенная ширина округляется вверх до ближайшей из списка
+IMAGE_VARIANT_WIDTHS = sorted(int(width) for width in os.getenv('IMAGE_VARIANT_WIDTHS', '160,320,640,960,1280').split(',')
+                              if width.strip())
+IMAGE_VARIANT_QUALITY = int(os.getenv('IMAGE_VARIANT_QUALITY', 80))
+# Изображения больше этого размера (байт) не уменьшаются, отдается оригинал
+IMAGE_VARIANT_MAX_SOURCE = int(os.getenv('IMAGE_VARIANT_MAX_SOURCE', 20 * 1024 * 1024))
+# Число процессов для работы с изображениями (Pillow); 0 - выполнять в потоке, без процессов
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Планировщик запросов к Telegram: число одновременных запросов на сессию
+RPC_CONCURRENCY = int(os.getenv('RPC_CONCURRENCY', 8))
+# Частота запросов по умолчанию (запросов в секунду) для методов без отдельного лимита
+RPC_DEFAULT_RATE = float(os.getenv('RPC_DEFAULT_RATE', 10))
+# Лимиты по методам в формате "метод=запросов_в_секунду:запас", через запятую
+RPC_METHOD_RATES = {
+    method.strip(): tuple(float(value) for value in limits.split(':'))
+    for method, limits in (
+        item.split('=') for item in
+        os.getenv('RPC_METHOD_RATES', 'get_entity=2:5,get_messages=10:20,download=30:30').split(',')
+        if item.strip()
+    )
+}
+# FloodWait длиннее этого значения (сек) не пережидается, а возвращается как ошибка
+RPC_FLOOD_MAX_WAIT = int(os.getenv('RPC_FLOOD_MAX_WAIT', 30))
+
+# Максимальное количество ссылок в одном запросе POST /api/posts
+BATCH_POSTS_LIMIT = int(os.getenv('BATCH_POSTS_LIMIT', 100))
 
 # Максимальное время ожидания для запросов
 REQUEST_TIMEOUT = 30  # секунд